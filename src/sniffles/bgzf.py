@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+"""
+BGZF output with parallel compression and a tabix index built while writing (.vcf.gz output).
+
+Uncompressed data is cut into blocks of BLOCK_SIZE bytes, which are compressed by a thread pool (zlib releases the
+GIL) and written in order. The virtual offsets of records are known when they are written as (block number, offset
+within block), and are translated into file offsets once the block has been written. The index follows the tabix
+conventions for VCF (begin: POS, end: END from INFO or POS + length of REF) and is a .tbi index, or a .csi index if
+any record ends beyond the range a .tbi index can hold (2^29 bp).
+"""
+import collections
+import concurrent.futures
+import logging
+import struct
+import zlib
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+# Uncompressed bytes per block, as in htslib
+BLOCK_SIZE = 0xff00
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+BLOCK_HEADER = struct.Struct("<4BI2BH2BHH")
+BLOCK_FOOTER = struct.Struct("<II")
+
+MIN_SHIFT = 14
+TBI_LEVELS = 5
+# format (VCF), sequence column, begin column, end column (none), meta character, lines to skip
+TABIX_CONF = (2, 1, 2, 0, ord("#"), 0)
+
+
+def compress_block(data: bytes, level: int = zlib.Z_DEFAULT_COMPRESSION) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    if len(deflated) + BLOCK_HEADER.size + BLOCK_FOOTER.size > 0x10000:
+        return compress_block(data, 0)
+    return (BLOCK_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(deflated) + BLOCK_HEADER.size + BLOCK_FOOTER.size - 1)
+            + deflated + BLOCK_FOOTER.pack(zlib.crc32(data), len(data)))
+
+
+def bin_first(level: int) -> int:
+    return ((1 << (3 * level)) - 1) // 7
+
+
+def bin_level(bin: int) -> int:
+    level = 0
+    while bin:
+        bin = (bin - 1) >> 3
+        level += 1
+    return level
+
+
+def reg2bin(beg: int, end: int, levels: int) -> int:
+    end -= 1
+    shift = MIN_SHIFT
+    for level in range(levels, 0, -1):
+        if beg >> shift == end >> shift:
+            return bin_first(level) + (beg >> shift)
+        shift += 3
+    return 0
+
+
+def parse_interval(line: bytes) -> tuple[bytes, int, int]:
+    """
+    Contig, begin and end of a VCF record as determined by tabix
+    """
+    contig, pos, _, ref, _, _, _, info = line.split(b"\t", 8)[:8]
+    beg = max(0, int(pos) - 1)
+    end = beg + len(ref) if len(ref) else beg + 1
+    if info.startswith(b"END="):
+        value = info[4:]
+    else:
+        value = info[info.find(b";END=") + 5:] if b";END=" in info else None
+    if value is not None and not value.startswith(b"."):
+        value = value.split(b";", 1)[0]
+        if value.isdigit() and int(value) > beg:
+            end = int(value)
+    return contig, beg, end
+
+
+class TabixIndex:
+    """
+    Tabix index of a bgzipped VCF, built from the records in the order they are written. Offsets are virtual offsets
+    of the form (block number << 16 | offset within block) until they are resolved in write().
+    """
+    def __init__(self):
+        self.contigs = []
+        self.tid = {}
+        self.levels = TBI_LEVELS
+        self.bins = []  # per contig: bin -> list of [start, end] chunks
+        self.linear = []  # per contig: offset of first record overlapping each 16 kb window
+        self.meta = []  # per contig: first offset, last offset, record count
+        self.chunk = None  # tid, bin, start, end of the chunk of consecutive records in the same bin
+        self.last_beg = 0
+        self.error = None
+
+    def push(self, line: bytes, start: int, end: int):
+        if self.error is not None:
+            return
+        try:
+            contig, beg, rec_end = parse_interval(line)
+        except ValueError as e:
+            self.error = f"invalid record: {e}"
+            return
+
+        tid = self.tid.get(contig)
+        if tid is None:
+            tid = self.tid[contig] = len(self.contigs)
+            self.contigs.append(contig)
+            self.bins.append({})
+            self.linear.append([])
+            self.meta.append([start, end, 0])
+        elif tid != len(self.contigs) - 1 or beg < self.last_beg:
+            self.error = f"records are not sorted ({contig.decode()}:{beg + 1})"
+            return
+        self.last_beg = beg
+
+        while rec_end > 1 << (MIN_SHIFT + 3 * self.levels):
+            self.add_level()
+        bin = reg2bin(beg, rec_end, self.levels)
+
+        linear = self.linear[tid]
+        last_window = (rec_end - 1) >> MIN_SHIFT
+        if len(linear) <= last_window:
+            linear.extend([None] * (last_window + 1 - len(linear)))
+        for window in range(beg >> MIN_SHIFT, last_window + 1):
+            if linear[window] is None:
+                linear[window] = start
+
+        meta = self.meta[tid]
+        meta[1] = end
+        meta[2] += 1
+
+        if self.chunk is not None and self.chunk[:2] == [tid, bin]:
+            self.chunk[3] = end
+        else:
+            self.close_chunk()
+            self.chunk = [tid, bin, start, end]
+
+    def close_chunk(self):
+        if self.chunk is None:
+            return
+        tid, bin, start, end = self.chunk
+        chunks = self.bins[tid].setdefault(bin, [])
+        # Merge with the previous chunk of the bin if it ends in the block this one starts in
+        if chunks and chunks[-1][1] >> 16 >= start >> 16:
+            chunks[-1][1] = max(chunks[-1][1], end)
+        else:
+            chunks.append([start, end])
+        self.chunk = None
+
+    def add_level(self):
+        """
+        Use one more binning level (CSI), renumbering existing bins
+        """
+        for tid, bins in enumerate(self.bins):
+            self.bins[tid] = {bin_first(bin_level(bin) + 1) + bin - bin_first(bin_level(bin)): chunks for bin, chunks in bins.items()}
+        if self.chunk is not None:
+            self.chunk[1] = bin_first(bin_level(self.chunk[1]) + 1) + self.chunk[1] - bin_first(bin_level(self.chunk[1]))
+        self.levels += 1
+
+    def write(self, filename: str, block_offsets: list[int]) -> str:
+        """
+        Write the index for the given compressed offsets of all blocks. Returns the index filename.
+        """
+        self.close_chunk()
+
+        def resolve(offset: int) -> int:
+            return (block_offsets[offset >> 16] << 16) | (offset & 0xffff)
+
+        csi = self.levels > TBI_LEVELS
+        names = b"".join(contig + b"\0" for contig in self.contigs)
+        conf = struct.pack("<7i", *TABIX_CONF, len(names)) + names
+        meta_bin = bin_first(self.levels + 1) + 1
+
+        parts = []
+        if csi:
+            parts.append(b"CSI\1" + struct.pack("<3i", MIN_SHIFT, self.levels, len(conf)) + conf + struct.pack("<i", len(self.contigs)))
+        else:
+            parts.append(b"TBI\1" + struct.pack("<i", len(self.contigs)) + conf)
+
+        for bins, linear, (first, last, count) in zip(self.bins, self.linear, self.meta):
+            # Windows without records point to the next record before them, as in htslib
+            previous = first
+            for window, offset in enumerate(linear):
+                previous = linear[window] = offset if offset is not None else previous
+            linear = [resolve(offset) for offset in linear]
+
+            parts.append(struct.pack("<i", len(bins) + 1))
+            for bin in sorted(bins):
+                chunks = bins[bin]
+                if csi:
+                    bottom = (bin - bin_first(bin_level(bin))) << 3 * (self.levels - bin_level(bin))
+                    parts.append(struct.pack("<IQ", bin, linear[bottom] if bottom < len(linear) else 0))
+                else:
+                    parts.append(struct.pack("<I", bin))
+                parts.append(struct.pack(f"<i{2 * len(chunks)}Q", len(chunks), *(resolve(offset) for chunk in chunks for offset in chunk)))
+            parts.append(struct.pack("<IQ" if csi else "<I", meta_bin, *([0] if csi else [])))
+            parts.append(struct.pack("<i4Q", 2, resolve(first), resolve(last), count, 0))
+            if not csi:
+                parts.append(struct.pack(f"<i{len(linear)}Q", len(linear), *linear))
+        parts.append(struct.pack("<Q", 0))
+
+        index_filename = filename + (".csi" if csi else ".tbi")
+        data = b"".join(parts)
+        with open(index_filename, "wb") as handle:
+            for i in range(0, len(data), BLOCK_SIZE):
+                handle.write(compress_block(data[i:i + BLOCK_SIZE]))
+            handle.write(EOF_BLOCK)
+        return index_filename
+
+
+class BGZFWriter:
+    """
+    Binary file handle writing BGZF, compressing blocks with threads worker threads. If index is set, a tabix index
+    of the VCF records written is created when closing.
+    """
+    def __init__(self, filename: str, threads: int = 1, index: bool = True):
+        self.filename = filename
+        self.handle = open(filename, "wb")
+        self.executor = concurrent.futures.ThreadPoolExecutor(max(1, threads)) if threads > 1 else None
+        self.max_pending = 2 * max(1, threads)
+        self.pending = collections.deque()
+        self.block = bytearray()
+        self.block_count = 0
+        self.block_offsets = []
+        self.offset = 0
+        self.partial = bytearray()
+        self.index = TabixIndex() if index else None
+        self.index_filename: Optional[str] = None
+
+    def tell(self) -> int:
+        return self.block_count << 16 | len(self.block)
+
+    def write(self, data: bytes):
+        if self.index is None:
+            self.append(data)
+            return
+        self.partial += data
+        if b"\n" not in data:
+            return
+        lines = self.partial.split(b"\n")
+        self.partial = bytearray(lines.pop())
+        for line in lines:
+            start = self.tell()
+            self.append(line + b"\n")
+            if line and line[:1] != b"#":
+                self.index.push(bytes(line), start, self.tell())
+
+    def append(self, data: bytes):
+        self.block += data
+        while len(self.block) >= BLOCK_SIZE:
+            block = bytes(self.block[:BLOCK_SIZE])
+            del self.block[:BLOCK_SIZE]
+            self.submit(block)
+
+    def submit(self, block: bytes):
+        self.block_count += 1
+        if self.executor is None:
+            self.write_block(compress_block(block))
+            return
+        self.pending.append(self.executor.submit(compress_block, block))
+        while len(self.pending) > self.max_pending:
+            self.write_block(self.pending.popleft().result())
+
+    def write_block(self, compressed: bytes):
+        self.block_offsets.append(self.offset)
+        self.handle.write(compressed)
+        self.offset += len(compressed)
+
+    def close(self):
+        if self.partial:
+            self.append(bytes(self.partial))
+            self.partial = bytearray()
+        if self.block:
+            block = bytes(self.block)
+            self.block = bytearray()
+            self.submit(block)
+        while self.pending:
+            self.write_block(self.pending.popleft().result())
+        if self.executor is not None:
+            self.executor.shutdown()
+        # Offsets at the very end of the file point to the EOF block
+        self.block_offsets.append(self.offset)
+        self.handle.write(EOF_BLOCK)
+        self.handle.close()
+
+        if self.index is not None:
+            if self.index.error is not None:
+                log.error(f"Unable to index {self.filename}: {self.index.error}")
+            else:
+                self.index_filename = self.index.write(self.filename, self.block_offsets)
@@ -10,6 +10,7 @@
 #
 
 from dataclasses import dataclass
+import copy
 import statistics
 import math
 from typing import Optional
@@ -66,6 +67,7 @@ def merge_inner(cluster, threshold):
         to_merge = read_seq[qname][0]
 
         curr_lead = to_merge
+        curr_lead_copied = False
 
         last_ref_end = to_merge.ref_end
         last_qry_end = to_merge.qry_end
@@ -76,6 +78,10 @@ def merge_inner(cluster, threshold):
             merge = (threshold == -1) or ((abs(to_merge.ref_start - last_ref_end) < threshold or abs(to_merge.ref_start - last_ref_start) < threshold) and (
                         abs(to_merge.qry_start - last_qry_end) < threshold or abs(to_merge.qry_start - last_qry_start) < threshold))
             if merge:
+                if not curr_lead_copied:
+                    # Leads of the leadtab may be clustered again (--sweep), so merge into a copy
+                    curr_lead = copy.copy(curr_lead)
+                    curr_lead_copied = True
                 curr_lead.svlen += to_merge.svlen
                 if to_merge.seq is None or curr_lead.seq is None:
                     curr_lead.seq = None
@@ -84,6 +90,7 @@ def merge_inner(cluster, threshold):
             else:
                 cluster.leads.append(curr_lead)
                 curr_lead = to_merge
+                curr_lead_copied = False
             last_ref_end = to_merge.ref_end
             last_qry_end = to_merge.qry_end
             last_ref_start = to_merge.ref_start
@@ -179,8 +186,38 @@ def resplit_bnd(cluster, merge_threshold):
 
 
 def resolve(svtype, leadtab_provider, config, tr):
+    if len(leadtab_provider.leadtab[svtype]) == 0:
+        return
+
+    clusters = build_clusters(svtype, leadtab_provider, config, tr)
+
+    if config.dev_trace_read:
+        for c in clusters:
+            for ld in c.leads:
+                if ld.read_qname == config.dev_trace_read:
+                    print(f"[DEV_TRACE_READ [2/4] [cluster.resolve] Read lead {ld} is in cluster {c.id}, containing a total of {len(c.leads)} leads")
+
+    if config.dev_dump_clusters:
+        filename = f"{config.input}.clusters.{svtype}.{leadtab_provider.contig}.{leadtab_provider.start}.{leadtab_provider.end}.bed"
+        print(f"Dumping clusters to {filename}")
+        with open(filename, "w") as h:
+            for c in clusters:
+                info = f"ID={c.id}, #LEADS={len(c.leads)}; "
+                for ld in c.leads:
+                    info += f"(ref_start={ld.ref_start},svlen={ld.svlen},source={ld.source}); "
+                h.write(f"{c.contig}\t{c.start}\t{c.end}\t\"{info}\"\n")
+
+    for cluster in clusters:
+        yield from split(svtype, cluster, config)
+
+
+def build_clusters(svtype, leadtab_provider, config, tr, seeds: list[int] = None) -> list[Cluster]:
+    """
+    Build and merge clusters from the leads of all bins in seeds (default: all bins) of svtype
+    """
     leadtab = leadtab_provider.leadtab[svtype]
-    seeds = sorted(leadtab_provider.leadtab[svtype])
+    if seeds is None:
+        seeds = sorted(leadtab)
 
     if len(seeds) == 0:
         return []
@@ -211,7 +248,7 @@ def resolve(svtype, leadtab_provider, config, tr):
             leads = [lead for lead in leadtab[seed] if lead.svlen != None]
             leads_long = [lead for lead in leadtab[seed] if lead.svlen == None]
         else:
-            leads = leadtab[seed]
+            leads = list(leadtab[seed])
             leads_long = None
 
         cluster = Cluster(id=f"CL.{svtype}.{leadtab_provider.contig}.{leadtab_provider.start}.{seed_index}",
@@ -260,50 +297,54 @@ def resolve(svtype, leadtab_provider, config, tr):
             i = max(0, i - 2)
         i += 1
 
-    if config.dev_trace_read:
-        for c in clusters:
-            for ld in c.leads:
-                if ld.read_qname == config.dev_trace_read:
-                    print(f"[DEV_TRACE_READ [2/4] [cluster.resolve] Read lead {ld} is in cluster {c.id}, containing a total of {len(c.leads)} leads")
-
-    if config.dev_dump_clusters:
-        filename = f"{config.input}.clusters.{svtype}.{leadtab_provider.contig}.{leadtab_provider.start}.{leadtab_provider.end}.bed"
-        print(f"Dumping clusters to {filename}")
-        with open(filename, "w") as h:
-            for c in clusters:
-                info = f"ID={c.id}, #LEADS={len(c.leads)}; "
-                for ld in c.leads:
-                    info += f"(ref_start={ld.ref_start},svlen={ld.svlen},source={ld.source}); "
-                h.write(f"{c.contig}\t{c.start}\t{c.end}\t\"{info}\"\n")
-
-    for cluster in clusters:
-        if len(cluster.leads) == 0:
-            continue
-
-        if svtype == "BND":
-            if config.dev_no_resplit:
-                yield cluster
-            else:
-                for new_cluster in resplit_bnd(cluster, merge_threshold=config.cluster_merge_bnd):
-                    yield new_cluster
+    return clusters
+
+
+def closed_cluster_count(svtype, clusters: list[Cluster], frontier: int, config) -> int:
+    """
+    Number of leading clusters (as returned by build_clusters) that can not be merged with any leads starting at or
+    after frontier, as they are separated from all following clusters by more than any merge distance
+    """
+    margin = max(config.cluster_repeat_h_max, config.cluster_merge_bnd if svtype == "BND" else 0)
+    closed = 0
+    for i, cluster in enumerate(clusters):
+        next_start = clusters[i + 1].start if i + 1 < len(clusters) else frontier
+        if next_start - cluster.end > max(margin, cluster.stdev_start * config.cluster_r):
+            closed = i + 1
+    return closed
+
+
+def split(svtype, cluster, config):
+    """
+    Split a merged cluster into the final clusters SVs are called from
+    """
+    if len(cluster.leads) == 0:
+        return
+
+    if svtype == "BND":
+        if config.dev_no_resplit:
+            yield cluster
         else:
-            if svtype == "INS" or svtype == "DEL":
-                if cluster.repeat:
-                    merge_inner_threshold = -1
-                else:
-                    merge_inner_threshold = config.cluster_merge_pos
+            for new_cluster in resplit_bnd(cluster, merge_threshold=config.cluster_merge_bnd):
+                yield new_cluster
+    else:
+        if svtype == "INS" or svtype == "DEL":
+            if cluster.repeat:
+                merge_inner_threshold = -1
+            else:
+                merge_inner_threshold = config.cluster_merge_pos
 
-                merge_inner(cluster, merge_inner_threshold)
+            merge_inner(cluster, merge_inner_threshold)
 
-            if not config.dev_no_resplit_repeat and not config.dev_no_resplit:
-                for new_cluster in resplit(cluster,
-                                           prop=lambda lead: lead.svlen,
-                                           binsize=config.cluster_resplit_binsize,
-                                           merge_threshold_min=config.minsvlen,
-                                           merge_threshold_frac=config.cluster_merge_len):
-                    yield new_cluster
-            else:
-                yield cluster
+        if not config.dev_no_resplit_repeat and not config.dev_no_resplit:
+            for new_cluster in resplit(cluster,
+                                       prop=lambda lead: lead.svlen,
+                                       binsize=config.cluster_resplit_binsize,
+                                       merge_threshold_min=config.minsvlen,
+                                       merge_threshold_frac=config.cluster_merge_len):
+                yield new_cluster
+        else:
+            yield cluster
 
 
 def resolve_block_groups(svtype, svcands, groups_initial, config):
@@ -321,7 +362,7 @@ def resolve_block_groups(svtype, svcands, groups_initial, config):
                 # TODO: Favor bigger groups in placement
                 dist = abs(group.pos_mean - svcand.pos) + abs(group.bnd_mate_ref_start_mean - mate_ref_start)
                 if dist < best_dist and dist <= config.cluster_merge_bnd * 2 and group.bnd_mate_contig == mate_contig:
-                    if not config.combine_separate_intra or svcand.sample_internal_id not in group.included_samples:
+                    if not config.combine_separate_intra or svcand.samples.isdisjoint(group.included_samples):
                         best_group = group
                         best_dist = dist
         else:
@@ -330,7 +371,7 @@ def resolve_block_groups(svtype, svcands, groups_initial, config):
                 dist = abs(group.pos_mean - svcand.pos) + abs(abs(group.len_mean) - abs(svcand.svlen))  # check if group.pos_mean is updated or stays the same for the first SV starting the group
                 minlen = float(min(abs(group.len_mean), abs(svcand.svlen)))
                 if minlen > 0 and dist < best_dist and dist <= config.combine_match * math.sqrt(minlen) and dist <= config.combine_match_max:
-                    if (not config.combine_separate_intra or svcand.sample_internal_id not in group.included_samples) and group.align_call(svcand, config.combine_pctseq):
+                    if (not config.combine_separate_intra or svcand.samples.isdisjoint(group.included_samples)) and group.align_call(svcand, config.combine_pctseq):
                         best_group = group
                         best_dist = dist
 
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+"""
+Columnar output of calls (--parquet).
+
+Calls are written to an Apache Parquet file with typed columns for the core fields and a list of per-sample genotype
+structs, one row group per task. All files share the same schema (sample names are stored with each genotype), so
+outputs of several runs can be read as one dataset or combined with merge(). Requires pyarrow.
+"""
+import logging
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    logging.getLogger('sniffles.dependencies').info('Dependency pyarrow not installed - Parquet output is disabled.')
+    pa = pq = None
+
+from sniffles.sv import SVCall, SVGroupSummary
+from sniffles.vcf import annotate_samples, format_genotype
+
+COVERAGE_FIELDS = SVGroupSummary.COVERAGE_FIELDS
+
+
+def get_schema() -> "pa.Schema":
+    genotype = pa.struct([
+        ("sample", pa.string()),
+        ("gt", pa.string()),
+        ("gq", pa.int32()),
+        ("dr", pa.int32()),
+        ("dv", pa.int32()),
+    ])
+    return pa.schema([
+        ("contig", pa.string()),
+        ("pos", pa.int64()),
+        ("id", pa.string()),
+        ("svtype", pa.string()),
+        ("svlen", pa.int64()),
+        ("end", pa.int64()),
+        ("qual", pa.int32()),
+        ("filter", pa.string()),
+        ("precise", pa.bool_()),
+        ("support", pa.int32()),
+        *((field, pa.int32()) for field in COVERAGE_FIELDS),
+        ("strand", pa.string()),
+        ("af", pa.float64()),
+        ("mate_contig", pa.string()),
+        ("mate_pos", pa.int64()),
+        ("genotypes", pa.list_(genotype)),
+    ])
+
+
+def to_int(value):
+    return value if isinstance(value, int) else None
+
+
+class ParquetOutput:
+    """
+    Parquet file of calls, written one row group per task result
+    """
+    def __init__(self, config, filename: str):
+        self.config = config
+        self.filename = filename
+        self.schema = get_schema()
+        self.writer = pq.ParquetWriter(filename, self.schema, compression="zstd")
+        self.call_count = 0
+        self.batches = []  # of the current row group
+
+    def genotypes(self, call: SVCall) -> list[dict]:
+        genotypes = []
+        for internal_id, sample_id in self.config.sample_ids_vcf:
+            gt = call.genotypes.get(internal_id) if call.genotypes else None
+            if gt is None:
+                gt = self.config.genotype_none
+            genotypes.append(dict(sample=sample_id, gt=format_genotype(gt).split(":", 1)[0], gq=to_int(gt[2]),
+                                  dr=to_int(gt[3]), dv=to_int(gt[4])))
+        return genotypes
+
+    def write_calls(self, calls: list[SVCall], flush: bool = True):
+        """
+        Add calls to the current row group, which is written if flush is set (otherwise by a later flush)
+        """
+        if calls:
+            self.batches.append(self.to_batch(calls))
+            self.call_count += len(calls)
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Write calls added since the last flush as one row group
+        """
+        if self.batches:
+            table = pa.Table.from_batches(self.batches, schema=self.schema)
+            self.writer.write_table(table, row_group_size=table.num_rows)
+            self.batches = []
+
+    def to_batch(self, calls: list[SVCall]) -> "pa.RecordBatch":
+        columns = {name: [] for name in self.schema.names}
+        for call in calls:
+            annotate_samples(call, self.config)
+            is_bnd = call.svtype == "BND"
+            bnd_info = call.bnd_info if is_bnd else None
+            af = call.get_info("AF")
+            columns["contig"].append(call.contig)
+            columns["pos"].append(call.pos if call.pos > 0 else 1)
+            columns["id"].append(self.config.id_prefix + call.id)
+            columns["svtype"].append(call.svtype)
+            columns["svlen"].append(None if is_bnd else call.svlen)
+            columns["end"].append(None if is_bnd else call.end)
+            columns["qual"].append(max(0, min(60, call.qual)))
+            columns["filter"].append(call.filter)
+            columns["precise"].append(bool(call.precise))
+            columns["support"].append(call.support)
+            for field in COVERAGE_FIELDS:
+                columns[field].append(getattr(call, field))
+            columns["strand"].append(("+" if call.fwd > 0 else "") + ("-" if call.rev > 0 else ""))
+            columns["af"].append(af)
+            columns["mate_contig"].append(bnd_info.mate_contig if bnd_info is not None else None)
+            columns["mate_pos"].append(bnd_info.mate_ref_start if bnd_info is not None else None)
+            columns["genotypes"].append(self.genotypes(call))
+        return pa.RecordBatch.from_pydict(columns, schema=self.schema)
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def merge(filenames: list[str], output: str):
+    """
+    Merge Parquet outputs into one file, keeping their row groups
+    """
+    with pq.ParquetWriter(output, get_schema(), compression="zstd") as writer:
+        for filename in filenames:
+            parquet_file = pq.ParquetFile(filename)
+            for i in range(parquet_file.num_row_groups):
+                writer.write_table(parquet_file.read_row_group(i))
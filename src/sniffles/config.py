@@ -11,19 +11,27 @@
 
 import os
 import sys
+import copy
 import datetime
 import argparse
+import shlex
 from collections import defaultdict
 
 from typing import Union, Optional
 
 from sniffles import util
+from sniffles.leadcache import EXTRACTION_FIELDS
 from sniffles.region import Region
 
 VERSION = "Sniffles2"
 BUILD = "2.4"
 SNF_VERSION = "S2_rc4"
 
+# Parameters that can not differ between the configurations of a --sweep, in addition to leadcache.EXTRACTION_FIELDS
+SWEEP_FIXED_FIELDS = ("input", "snf", "parquet", "reference", "tandem_repeats", "threads", "contig", "regions", "regions_by_contig",
+                      "genotype_vcf", "sample_id", "low_memory", "stream_window", "lead_cache", "io_threads",
+                      "prefetch_reads", "task_count_multiplier", "task_overlap", "task_split_factor", "cluster_binsize")
+
 
 class ArgFormatter(argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter):
     pass
@@ -85,10 +93,13 @@ class SnifflesConfig(argparse.Namespace):
     input: str
     vcf: str
     snf: str
+    parquet: Optional[str]
     reference: str
     tandem_repeats: str
     phase: bool
     threads: int
+    low_memory: bool
+    stream_window: int
     contig: Optional[str]
     run_id: str
 
@@ -106,11 +117,14 @@ class SnifflesConfig(argparse.Namespace):
         main_args = parser.add_argument_group("Common parameters")
         main_args.add_argument("-i", "--input", metavar="IN", type=str, help="For single-sample calling: A coordinate-sorted and indexed .bam/.cram (BAM/CRAM format) file containing aligned reads. - OR - For multi-sample calling: Multiple .snf files (generated before by running Sniffles2 for individual samples with --snf)", required=True, nargs="+")
         main_args.add_argument("-v", "--vcf", metavar="OUT.vcf", type=str, help="VCF output filename to write the called and refined SVs to. If the given filename ends with .gz, the VCF file will be automatically bgzipped and a .tbi index built for it.", required=False)
-        main_args.add_argument("--snf", metavar="OUT.snf", type=str, help="Sniffles2 file (.snf) output filename to store candidates for later multi-sample calling", required=False)
+        main_args.add_argument("--snf", metavar="OUT.snf", type=str, help="Sniffles2 file (.snf) output filename to store candidates for later multi-sample calling. In multi-calling mode, stores the combined cohort, which can be updated later by passing it together with new .snf files as input", required=False)
+        main_args.add_argument("--parquet", metavar="OUT.parquet", type=str, help="Additionally write calls to an Apache Parquet file (requires pyarrow), with typed columns for the core SV fields and per-sample genotypes", required=False)
         main_args.add_argument("--reference", metavar="reference.fasta", type=str, help="(Optional) Reference sequence the reads were aligned against. To enable output of deletion SV sequences, this parameter must be set.", default=None)
         main_args.add_argument("--tandem-repeats", metavar="IN.bed", type=str, help="(Optional) Input .bed file containing tandem repeat annotations for the reference genome.", default=None)
         main_args.add_argument("--phase", help="Determine phase for SV calls (requires the input alignments to be phased)", default=False, action="store_true")
         main_args.add_argument("-t", "--threads", metavar="N", type=int, help="Number of parallel threads to use (speed-up for multi-core CPUs)", default=4)
+        main_args.add_argument("--low-memory", default=False, action="store_true", help="Store SV signals on disk (in TMPDIR) while reading alignments and process them in small ranges afterwards, to reduce memory usage for high coverage samples")
+        main_args.add_argument("--stream-window", metavar="N", type=int, help="Cluster, call and annotate SVs while reading alignments, as soon as they are more than N bp behind the current read, to bound memory usage of large tasks. Should exceed the length of most reads. (0: disabled)", default=0)
         main_args.add_argument("-c", "--contig", default=None, type=str, help="(Optional) Only process the specified contigs. May be given more than once.", action="append")
         main_args.add_argument("--regions", metavar="REGIONS.bed", type=str, help="(Optional) Only process the specified regions.", default=None)
 
@@ -167,6 +181,7 @@ class SnifflesConfig(argparse.Namespace):
         genotype_args.add_argument("--genotype-error", metavar="N", type=float, help="Estimated false positive rate for leads (relating to total coverage)", default=0.05)
         genotype_args.add_argument("--sample-id", type=str, help="Custom ID for this sample, used for later multi-sample calling (stored in .snf)", default=None)
         genotype_args.add_argument("--genotype-vcf", metavar="IN.vcf", type=str, help="Determine the genotypes for all SVs in the given input .vcf file (forced calling). Re-genotyped .vcf will be written to the output file specified with --vcf.", default=None)
+        genotype_args.add_argument("--genotype-targeted", help="Only read alignments around the SVs of --genotype-vcf instead of whole contigs (faster for small sets of SVs; genotypes of SVs close to signals further away may change slightly)", default=False, action="store_true")
 
     def add_multi_args(self, parser):
         multi_args = parser.add_argument_group("Multi-Sample Calling / Combine parameters")
@@ -183,6 +198,9 @@ class SnifflesConfig(argparse.Namespace):
         multi_args.add_argument("--combine-close-handles", help="Close .SNF file handles after each use. May lower performance, but may be required when maximum number of file handles supported by OS is reached when merging many samples.", default=False, action="store_true")
         multi_args.add_argument("--combine-pctseq", default=0.7, type=float, help="Minimum alignment distance as percent of SV length to be merged. Set to 0 to disable alignments for merging.")
         multi_args.add_argument("--combine-max-inmemory-results", default=20, type=int, help=argparse.SUPPRESS)
+        multi_args.add_argument("--combine-hierarchical", metavar="N", default=0, type=int, help="Combine hierarchically for very large cohorts: merge .snf files in batches of at most N files into intermediate group files, which are then merged recursively (0 disables hierarchical combine)")
+        multi_args.add_argument("--combine-candidate-budget", metavar="N", default=0, type=int, help="Bound memory of combine: maximum number of SV candidates held per task. Blocks whose candidates (estimated from the .snf index) exceed half of N are processed in sub-windows by position, and the leftmost groups are called early when kept groups hold more than half of N candidates (0 disables)")
+        multi_args.add_argument("--combine-sample-blocks", metavar="N", default=0, type=int, help="Parallelize combine across samples as well as genome blocks: split the .snf files into N blocks of samples that are grouped in parallel into intermediate group files, which are then merged (useful for small genome ranges such as single contigs or --regions, 0 disables)")
         # multi_args.add_argument("--combine-exhaustive", help="(DEV) Disable performance optimization in multi-calling", default=False, action="store_true")
         # multi_args.add_argument("--combine-relabel-rare", help="(DEV)", default=False, action="store_true")
         # multi_args.add_argument("--combine-with-missing", help="(DEV)", default=False, action="store_true")
@@ -220,12 +238,16 @@ class SnifflesConfig(argparse.Namespace):
 
     qc_nm: bool
     combine_consensus: bool
-    low_memory: bool
+    lead_cache: Optional[str]
+    sweep: Optional[list]
+    io_threads: Optional[int]
+    prefetch_reads: int
+    task_count_multiplier: int
+    task_overlap: int
+    task_split_factor: float
 
     def add_developer_args(self, parser):
         developer_args = parser.add_argument_group("Developer parameters")
-        developer_args.add_argument("--dev-cache", default=False, action="store_true", help=argparse.SUPPRESS)
-        developer_args.add_argument("--dev-cache-dir", metavar="PATH", type=str, default=None, help=argparse.SUPPRESS)
         developer_args.add_argument("--dev-debug-svtyping", default=False, action="store_true", help=argparse.SUPPRESS)
         developer_args.add_argument("--dev-keep-lowqual-splits", default=False, action="store_true", help=argparse.SUPPRESS)
         developer_args.add_argument("--dev-call-region", metavar="REGION", type=str, default=None, help=argparse.SUPPRESS)
@@ -239,7 +261,14 @@ class SnifflesConfig(argparse.Namespace):
         developer_args.add_argument("--dev-no-resplit", default=False, action="store_true", help=argparse.SUPPRESS)
         developer_args.add_argument("--dev-no-resplit-repeat", default=False, action="store_true", help=argparse.SUPPRESS)
         developer_args.add_argument("--dev-skip-snf-validation", default=False, action="store_true", help=argparse.SUPPRESS)
-        developer_args.add_argument("--low-memory", default=False, action="store_true", help=argparse.SUPPRESS)
+        developer_args.add_argument("--lead-cache", metavar="DIR", type=str, help="Store SV signals extracted from the input alignments in DIR, and reuse them (instead of reading the alignments again) when calling the same input with different clustering, filtering or output parameters", default=None)
+        developer_args.add_argument("--sweep", metavar="'OUT.vcf OPTIONS'", type=str, action="append", help="Additionally call SVs with OPTIONS applied on top of all other parameters and write them to OUT.vcf, reading the input only once. OPTIONS must not affect reading of the input (e.g. --mapq, --minsvlen, --phase). May be given more than once, e.g. --sweep 'strict.vcf --minsupport 10' --sweep 'mosaic.vcf --mosaic'", default=None)
+        developer_args.add_argument("--io-threads", metavar="N", type=int, help="Additional htslib decompression threads per worker process (default: distribute threads not needed for tasks to workers)", default=None)
+        developer_args.add_argument("--prefetch-reads", metavar="N", type=int, help="Number of alignments decoded ahead in a background thread of each worker process (0: disabled)", default=2048)
+        developer_args.add_argument("--task-count-multiplier", metavar="N", type=int, help="Split contigs into tasks with similar read counts, planning N tasks per thread (0: one task per contig)", default=0)
+        developer_args.add_argument("--task-split-factor", metavar="F", type=float, help="Split queued tasks projected (from the throughput of finished tasks) to run more than F times longer than an even share of the remaining work per thread (0: disabled)", default=0)
+        developer_args.add_argument("--task-overlap", metavar="N", type=int, help="Overlap of neighbouring tasks of the same contig (in bp). SVs within the overlap are reported by the task containing their position only.", default=50000)
+        developer_args.add_argument("--reference-window", metavar="N", type=int, help="Read the reference in windows of N bp when writing REF/ALT sequences, so sorted output reads each part of the reference only once (0: read each sequence separately)", default=1000000)
         developer_args.add_argument("--repeat", default=False, action="store_true", help=argparse.SUPPRESS)
         developer_args.add_argument("--qc-nm", default=False, action="store_true", help=argparse.SUPPRESS)
         developer_args.add_argument("--qc-nm-mult", metavar="F", type=float, default=1.66, help=argparse.SUPPRESS)
@@ -283,8 +312,6 @@ class SnifflesConfig(argparse.Namespace):
         self.start_date = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")
         self.run_id = f'{os.environ.get("SLURM_JOB_ID") or os.getpid()}'
 
-        self.task_count_multiplier = 0
-
         self.version = VERSION
         self.build = BUILD
         self.snf_format_version = SNF_VERSION
@@ -362,6 +389,13 @@ class SnifflesConfig(argparse.Namespace):
         # SNF
         self.snf_block_size = 10 ** 5
 
+        if self.combine_hierarchical == 1 or self.combine_hierarchical < 0:
+            util.fatal_error("--combine-hierarchical requires a batch size of at least 2 (or 0 to disable)")
+        if self.combine_candidate_budget < 0:
+            util.fatal_error("--combine-candidate-budget must be positive (or 0 to disable)")
+        if self.combine_sample_blocks == 1 or self.combine_sample_blocks < 0:
+            util.fatal_error("--combine-sample-blocks requires at least 2 blocks (or 0 to disable)")
+
         # Combine
         self.combine_exhaustive = False
         self.combine_relabel_rare = False
@@ -388,3 +422,54 @@ class SnifflesConfig(argparse.Namespace):
             self.qc_nm_measure = self.qc_nm_measure or self.mosaic_qc_nm
             # config.qc_nm_mult=config.mosaic_qc_nm_mult
             # config.qc_strand=config.mosaic_qc_strand
+
+        if self.stream_window > 0 and self.qc_nm_measure:
+            util.fatal_error("--stream-window can not be used with NM based QC (--qc-nm, --mosaic), which requires the average NM of all reads of a task")
+
+        # NM of reads is measured during lead extraction if required by any configuration of a sweep
+        self.qc_nm_extract = self.qc_nm_measure
+        self.sweep = self.parse_sweep(list(args) or sys.argv[1:]) if self.sweep else None
+
+    def parse_sweep(self, args: list[str]) -> list[tuple[str, dict]]:
+        """
+        Parse the --sweep configurations, each given as output filename followed by parameters applied on top of the
+        other parameters. Returns the output filename and the changed parameters of each configuration.
+        """
+        if self.stream_window > 0 or self.low_memory:
+            util.fatal_error("--sweep can not be used together with --stream-window or --low-memory")
+
+        base_args = []
+        skip = False
+        for arg in args:
+            if skip:
+                skip = False
+            elif arg == "--sweep":
+                skip = True
+            elif not arg.startswith("--sweep="):
+                base_args.append(arg)
+
+        base = vars(self)
+        sweep = []
+        for sweep_arg in self.sweep:
+            sweep_vcf, *sweep_args = shlex.split(sweep_arg)
+            if sweep_vcf.startswith("-"):
+                util.fatal_error(f"--sweep '{sweep_arg}': Expected an output .vcf filename followed by parameters")
+            sweep_config = vars(SnifflesConfig(*base_args, *sweep_args))
+            changed = {key: value for key, value in sweep_config.items()
+                       if key not in ("start_date", "command", "sweep", "qc_nm_extract") and (key not in base or base[key] != value)}
+            for key in changed:
+                if key in SWEEP_FIXED_FIELDS or key in EXTRACTION_FIELDS:
+                    util.fatal_error(f"--sweep '{sweep_arg}': {key} can not be changed within a sweep, since it affects reading of the input")
+            self.qc_nm_extract = self.qc_nm_extract or sweep_config["qc_nm_measure"]
+            changed["vcf"] = sweep_vcf
+            sweep.append((sweep_vcf, changed))
+        return sweep
+
+    def sweep_config(self, changed: dict) -> 'SnifflesConfig':
+        """
+        Configuration of one --sweep entry, derived from this configuration
+        """
+        sweep_config = copy.copy(self)
+        vars(sweep_config).update(changed)
+        sweep_config.sweep = None
+        return sweep_config
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+"""
+Genotyping of all calls of a task at once, and matching of SV calls with the SVs to be genotyped (--genotype-vcf).
+
+Support and coverage of all calls are normalized in one pass. Genotype likelihoods only depend on the normalized
+support and coverage (at most GENOTYPE_NORMALIZATION_TARGET), so they are calculated once per distinct pair with the
+same floating point operations as postprocessing.genotype_sv, giving identical results.
+
+The SVs to be genotyped are indexed by SV type and position, so each call is only compared with the SVs within the
+maximum match distance around it, independently of the number of SVs to be genotyped in total. Uses NumPy if
+available.
+"""
+import bisect
+import logging
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    logging.getLogger('sniffles.dependencies').info('Dependency numpy not installed - genotyping is not vectorized.')
+    np = None
+
+from sniffles import postprocessing
+from sniffles import sv
+
+log = logging.getLogger(__name__)
+
+
+def genotype_batch(support: list[int], coverage: list[int], config) -> dict[str, list]:
+    """
+    Genotype calls given their support and coverage (see postprocessing.genotype_support_coverage). Returns lists of
+    the genotype alleles (a, b), genotype quality (gq), z-score (z), reference and variant reads (dr, dv) and allele
+    frequency (af), with the same values as postprocessing.genotype_sv.
+    """
+    target = postprocessing.GENOTYPE_NORMALIZATION_TARGET
+    if np is not None and len(support):
+        support = np.asarray(support, dtype=np.int64)
+        coverage = np.maximum(np.asarray(coverage, dtype=np.int64), support)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            af = support / coverage.astype(np.float64)
+            norm = target / coverage.astype(np.float64)
+            normalize = coverage > target
+            normalized_support = np.where(normalize, np.round(support * norm), support).astype(np.int64)
+            normalized_coverage = np.where(normalize, np.round(coverage * norm), coverage).astype(np.int64)
+
+        pairs, inverse = np.unique(np.stack([normalized_support, normalized_coverage], axis=1), axis=0, return_inverse=True)
+        likelihoods = np.array([(gt[0], gt[1], gq, z) for gt, gq, z in
+                                (postprocessing.genotype_likelihoods(k, n, config) for k, n in pairs.tolist())], dtype=np.int64)
+        a, b, gq, z = likelihoods[inverse.reshape(-1)].T
+        return dict(a=a.tolist(), b=b.tolist(), gq=gq.tolist(), z=z.tolist(), dr=(coverage - support).tolist(),
+                    dv=support.tolist(), af=af.tolist())
+
+    result = dict(a=[], b=[], gq=[], z=[], dr=[], dv=[], af=[])
+    likelihoods = {}
+    for k, n in zip(support, coverage):
+        n = max(n, k)
+        if n > target:
+            norm = target / float(n)
+            pair = (round(k * norm), round(n * norm))
+        else:
+            pair = (k, n)
+        if pair not in likelihoods:
+            likelihoods[pair] = postprocessing.genotype_likelihoods(*pair, config)
+        (a, b), gq, z = likelihoods[pair]
+        for key, value in zip(("a", "b", "gq", "z", "dr", "dv", "af"), (a, b, gq, z, n - k, k, k / float(n))):
+            result[key].append(value)
+    return result
+
+
+def genotype_svs(svcalls: list[sv.SVCall], config):
+    """
+    Batch variant of postprocessing.genotype_sv for all calls of a task
+    """
+    genotyped, support, coverage = [], [], []
+    for svcall in svcalls:
+        support_coverage = postprocessing.genotype_support_coverage(svcall, config)
+        if support_coverage is not None:
+            genotyped.append(svcall)
+            support.append(support_coverage[0])
+            coverage.append(support_coverage[1])
+
+    genotypes = genotype_batch(support, coverage, config)
+    for i, svcall in enumerate(genotyped):
+        postprocessing.set_genotype(svcall, config, postprocessing.get_phase(svcall, config),
+                                    (genotypes["a"][i], genotypes["b"][i]), genotypes["gq"][i], genotypes["z"][i],
+                                    genotypes["dv"][i], genotypes["dv"][i] + genotypes["dr"][i], genotypes["af"][i])
+
+
+class GenotypeIndex:
+    """
+    The SVs to be genotyped of a task, sorted by position for each SV type. Each SV is matched with the closest call
+    within the match distance, the first one in case of ties:
+
+    - BND: distance of the positions, at most --cluster-merge-bnd, same mate contig
+    - other: distance of the positions plus difference of the lengths, at most --combine-match times the square root
+      of the shorter length and at most --combine-match-max
+    """
+    def __init__(self, genotype_svs: list[sv.SVCall], config):
+        self.config = config
+        svs_by_type = {svtype: [] for svtype in sv.TYPES}
+        for genotype_sv in genotype_svs:
+            genotype_sv.genotype_match_sv = None
+            genotype_sv.genotype_match_dist = math.inf
+
+            if genotype_sv.svtype not in svs_by_type:
+                log.warning(f'Unsupported SVTYPE: {genotype_sv.svtype}')
+                continue
+            svs_by_type[genotype_sv.svtype].append(genotype_sv)
+
+        self.svs = {}
+        self.pos = {}
+        self.length = {}
+        self.mate_contig = {}
+        self.best_dist = {}
+        self.mate_contig_ids = {}
+        for svtype, svs in svs_by_type.items():
+            svs.sort(key=lambda genotype_sv: genotype_sv.pos)
+            self.svs[svtype] = svs
+            self.pos[svtype] = [genotype_sv.pos for genotype_sv in svs]
+            if svtype == "BND":
+                self.length[svtype] = [0] * len(svs)
+                self.mate_contig[svtype] = [self.mate_contig_id(genotype_sv.bnd_info.mate_contig) for genotype_sv in svs]
+            else:
+                self.length[svtype] = [abs(genotype_sv.svlen) for genotype_sv in svs]
+                self.mate_contig[svtype] = [-1] * len(svs)
+            self.best_dist[svtype] = [math.inf] * len(svs)
+
+        if np is not None:
+            for svtype in sv.TYPES:
+                self.pos[svtype] = np.array(self.pos[svtype], dtype=np.int64)
+                self.length[svtype] = np.array(self.length[svtype], dtype=np.int64)
+                self.mate_contig[svtype] = np.array(self.mate_contig[svtype], dtype=np.int64)
+                self.best_dist[svtype] = np.full(len(self.svs[svtype]), np.inf)
+
+    def mate_contig_id(self, contig: str) -> int:
+        return self.mate_contig_ids.setdefault(contig, len(self.mate_contig_ids))
+
+    def match(self, candidates: list[sv.SVCall]):
+        """
+        Match calls with the indexed SVs, in order. Sets genotype_match_sv and genotype_match_dist of matched SVs.
+        """
+        match_range = {svtype: self.config.cluster_merge_bnd if svtype == "BND" else self.config.combine_match_max for svtype in sv.TYPES}
+        match_svs = {svtype: [None] * len(self.svs[svtype]) for svtype in sv.TYPES}
+        for cand in candidates:
+            svtype = cand.svtype
+            if len(self.svs[svtype]) == 0:
+                continue
+            if np is not None:
+                self.match_call_numpy(cand, match_range[svtype], match_svs[svtype])
+            else:
+                self.match_call(cand, match_range[svtype], match_svs[svtype])
+
+        for svtype, svs in self.svs.items():
+            for genotype_sv, match_sv, dist in zip(svs, match_svs[svtype], self.best_dist[svtype]):
+                if match_sv is not None:
+                    genotype_sv.genotype_match_sv = match_sv
+                    genotype_sv.genotype_match_dist = int(dist)
+
+    def match_call_numpy(self, cand: sv.SVCall, match_range: int, match_svs: list):
+        svtype = cand.svtype
+        pos = self.pos[svtype]
+        start = int(np.searchsorted(pos, cand.pos - match_range, side="left"))
+        end = int(np.searchsorted(pos, cand.pos + match_range, side="right"))
+        if start == end:
+            return
+
+        best_dist = self.best_dist[svtype][start:end]
+        dist = np.abs(pos[start:end] - cand.pos)
+        if svtype == "BND":
+            mate_contig = self.mate_contig_ids.get(cand.bnd_info.mate_contig, -2)
+            matched = (dist < best_dist) & (dist <= self.config.cluster_merge_bnd) & (self.mate_contig[svtype][start:end] == mate_contig)
+        else:
+            length = self.length[svtype][start:end]
+            cand_length = abs(cand.svlen)
+            dist += np.abs(length - cand_length)
+            minlen = np.minimum(length, cand_length)
+            matched = ((minlen > 0) & (dist < best_dist) & (dist <= self.config.combine_match * np.sqrt(minlen))
+                       & (dist <= self.config.combine_match_max))
+
+        for i in np.flatnonzero(matched):
+            best_dist[i] = dist[i]
+            match_svs[start + i] = cand
+
+    def match_call(self, cand: sv.SVCall, match_range: int, match_svs: list):
+        svtype = cand.svtype
+        pos = self.pos[svtype]
+        best_dist = self.best_dist[svtype]
+        config = self.config
+        for i in range(bisect.bisect_left(pos, cand.pos - match_range), bisect.bisect_right(pos, cand.pos + match_range)):
+            dist = abs(pos[i] - cand.pos)
+            if svtype == "BND":
+                if (dist < best_dist[i] and dist <= config.cluster_merge_bnd
+                        and cand.bnd_info.mate_contig == self.svs[svtype][i].bnd_info.mate_contig):
+                    best_dist[i] = dist
+                    match_svs[i] = cand
+            else:
+                length = self.length[svtype][i]
+                dist += abs(length - abs(cand.svlen))
+                minlen = float(min(length, abs(cand.svlen)))
+                if minlen > 0 and dist < best_dist[i] and dist <= config.combine_match * math.sqrt(minlen) and dist <= config.combine_match_max:
+                    best_dist[i] = dist
+                    match_svs[i] = cand
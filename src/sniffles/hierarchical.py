@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+"""
+Hierarchical (tree) combine for large cohorts.
+
+Input .snf files are merged in batches of at most --combine-hierarchical files into intermediate group .snf files,
+which are merged again until the number of inputs is small enough for the final combine. Group .snf files contain
+one group candidate per SVGroup, carrying aggregated statistics (SVGroupSummary), the genotypes of all included
+samples and per-sample coverages of the whole batch.
+
+With --combine-sample-blocks, one such level is used to parallelize combine across samples: the inputs are split into
+blocks of samples that are grouped in parallel (in addition to the split of each contig into genome blocks), and the
+final combine merges the group .snf files of all blocks.
+
+Results are equivalent to a flat combine with the following tolerances:
+- Grouping is greedy per batch, so candidates that a flat combine would have placed in neighbouring groups may
+  end up in a different group when their batches are merged (positions/lengths within --combine-match).
+- Means and standard deviations (QUAL, SUPPORT, COVERAGE, STDEV_POS, STDEV_LEN) are exact; median based values
+  (--dev-combine-medians, INS sequence selection) use the representative candidate of each batch group.
+"""
+import logging
+import math
+import os
+from argparse import Namespace
+
+from sniffles import parallel
+from sniffles import snf
+from sniffles import util
+
+
+log = logging.getLogger(__name__)
+
+
+def plan_batches(inputs: list[dict], fan_in: int) -> list[list[dict]]:
+    """
+    Split inputs into the minimum number of batches of at most fan_in inputs, with balanced batch sizes
+    """
+    batch_count = math.ceil(len(inputs) / fan_in)
+    batch_size, rest = divmod(len(inputs), batch_count)
+    batches = []
+    start = 0
+    for i in range(batch_count):
+        end = start + batch_size + (1 if i < rest else 0)
+        batches.append(inputs[start:end])
+        start = end
+    return batches
+
+
+def group_snf_filename(config: Namespace, level: int, batch: int) -> str:
+    return f"{config.vcf or config.parquet or config.snf}.tmp_L{level}_G{batch}.snf"
+
+
+def combine_level(config: Namespace, inputs: list[dict], level: int, contig_lengths: list[tuple[str, int]],
+                  processes: list, recycle_hint=None, fan_in: int = None) -> list[dict]:
+    """
+    Merge one level of the combine tree in batches of at most fan_in (default: --combine-hierarchical) inputs,
+    returning the inputs for the next level
+    """
+    batches = plan_batches(inputs, fan_in or config.combine_hierarchical)
+    log.info(f"Hierarchical combine level {level}: merging {len(inputs)} inputs in {len(batches)} batches...")
+
+    tasks_list = []
+    task_id = 0
+    for batch_index, batch in enumerate(batches):
+        if len(batch) == 1:
+            continue
+        for contig_str, contig_length in contig_lengths:
+            task = parallel.GroupCombineTask(
+                id=task_id,
+                contig=contig_str,
+                start=0,
+                end=contig_length,
+                assigned_process_id=None,
+                sv_id=0,
+                config=config,
+                inputs=batch,
+                level=level,
+                batch=batch_index,
+            )
+            tasks_list.extend(task.scatter())
+            task_id = tasks_list[-1].id + 1
+
+    finished_tasks = parallel.run_tasks(config, tasks_list, processes, recycle_hint)
+
+    batches_tasks = {}
+    for task in finished_tasks:
+        if not task.success:
+            util.fatal_error_main(f"Hierarchical combine failed for {task}: {task.result}")
+        batches_tasks.setdefault(task.batch, []).append(task)
+
+    next_inputs = []
+    for batch_index, batch in enumerate(batches):
+        if len(batch) == 1:
+            # Nothing to merge, pass on to the next level
+            next_inputs.append(batch[0])
+            continue
+
+        samples = sorted(sample for snf_info in batch for sample in parallel.CombineTask.input_samples(snf_info))
+        filename = group_snf_filename(config, level, batch_index)
+        with open(filename, "wb") as handle:
+            snf_out = snf.SNFile(config, handle)
+            for task in batches_tasks.get(batch_index, []):
+                task.result.emit(snf_out=snf_out)
+            candidate_count = snf_out.write_results(config, [contig for contig, _ in contig_lengths], samples=samples, hierarchical_level=level)
+        log.info(f"Wrote {candidate_count} group candidates for {len(samples)} samples to {filename}")
+        next_inputs.append({"filename": filename, "samples": samples, "level": level})
+
+    return next_inputs
+
+
+def combine_tree(config: Namespace, inputs: list[dict], contig_lengths: list[tuple[str, int]], processes: list,
+                 recycle_hint=None) -> list[dict]:
+    """
+    Merge inputs level by level until at most config.combine_hierarchical inputs remain. Returns the inputs for the
+    final combine. Intermediate group .snf files of all but the last level are removed.
+    """
+    level = 0
+    while len(inputs) > config.combine_hierarchical:
+        level += 1
+        next_inputs = combine_level(config, inputs, level, contig_lengths, processes, recycle_hint)
+        # Inputs of single input batches are passed on to the next level unchanged
+        cleanup([snf_info for snf_info in inputs if snf_info not in next_inputs])
+        inputs = next_inputs
+    return inputs
+
+
+def scatter_samples(config: Namespace, inputs: list[dict], contig_lengths: list[tuple[str, int]], processes: list,
+                    recycle_hint=None) -> list[dict]:
+    """
+    Group inputs in --combine-sample-blocks blocks of samples in parallel (each task opening only the .snf files of
+    its block), returning one group .snf per block for the final combine, which acts as the reducer
+    """
+    fan_in = math.ceil(len(inputs) / config.combine_sample_blocks)
+    if fan_in < 2:
+        return inputs
+    level = max(snf_info.get("level", 0) for snf_info in inputs) + 1
+    return combine_level(config, inputs, level, contig_lengths, processes, recycle_hint, fan_in=fan_in)
+
+
+def cleanup(inputs: list[dict]):
+    """
+    Remove intermediate group .snf files in inputs
+    """
+    for snf_info in inputs:
+        if snf_info.get("level"):
+            try:
+                os.remove(snf_info["filename"])
+            except OSError:
+                log.warning(f'Unable to remove intermediate file {snf_info["filename"]}')
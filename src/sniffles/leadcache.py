@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+"""
+Persistent lead cache (--lead-cache).
+
+After reading the alignments of a task, its leads and coverage tables are stored in one cache file per task region
+set. Re-running Sniffles on the same input with different clustering, QC or output parameters loads the cached leads
+instead of reading the alignments again.
+
+A cache file is only used if the input file (size, modification time and index contents), the regions of the task
+and all parameters affecting lead extraction (see EXTRACTION_FIELDS) are the same as when it was written. Leads are
+stored in the encoding of sniffles.spill, before any per-bin sequence cap is applied.
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+from typing import Optional
+
+from sniffles import sv
+from sniffles.region import Region
+from sniffles.spill import decode_leads, encode_lead
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"SNFLEADS"
+VERSION = 1
+
+# version, length of key
+FILE_HEADER = struct.Struct("<HI")
+# read id offset, read count, first coverage bin, average regional NM
+TAB_HEADER = struct.Struct("<qqqd")
+COUNT = struct.Struct("<Q")
+
+# Parameters that change which leads and coverages are extracted from the alignments
+EXTRACTION_FIELDS = (
+    "mapq",
+    "min_alignment_length",
+    "minsvlen_screen",
+    "long_ins_length",
+    "detect_large_ins",
+    "phase",
+    "qc_nm_extract",
+    "coverage_binsize",
+    "coverage_shift_bins",
+    "coverage_shift_bins_min_aln_length",
+    "max_splits_base",
+    "max_splits_kb",
+    "bnd_min_split_length",
+    "dev_keep_lowqual_splits",
+    "dev_seq_cache_maxlen",
+    "dev_split_max_query_distance_mult",
+)
+
+
+def find_index(alignments_filename: str) -> Optional[str]:
+    base = os.path.splitext(alignments_filename)[0]
+    for filename in (f"{alignments_filename}.bai", f"{alignments_filename}.csi", f"{alignments_filename}.crai",
+                     f"{base}.bai", f"{base}.csi", f"{base}.crai"):
+        if os.path.exists(filename):
+            return filename
+    return None
+
+
+def file_identity(filename: str) -> dict:
+    stat = os.stat(filename)
+    return dict(size=stat.st_size, mtime=stat.st_mtime_ns)
+
+
+def input_identity(config) -> dict:
+    """
+    Identity of the input alignments, to detect changed inputs. Computed once in the main process.
+    """
+    identity = dict(input=file_identity(config.input))
+    index_filename = find_index(config.input)
+    if index_filename is not None:
+        with open(index_filename, "rb") as handle:
+            identity["index"] = hashlib.sha1(handle.read()).hexdigest()
+    if config.input_is_cram and config.reference is not None:
+        identity["reference"] = file_identity(config.reference)
+    return identity
+
+
+class LeadCache:
+    """
+    Cache file of the leads and coverage tables of one task
+    """
+    def __init__(self, config, regions: list[Region], windows: list[Region] = None):
+        key = dict(input=config.lead_cache_input,
+                   regions=[(r.contig, r.start, r.end) for r in regions],
+                   config={field: getattr(config, field) for field in EXTRACTION_FIELDS})
+        if windows is not None:
+            key["windows"] = [(r.start, r.end) for r in windows]
+        self.key = json.dumps(key, sort_keys=True).encode()
+        digest = hashlib.sha1(self.key).hexdigest()[:20]
+        self.filename = os.path.join(config.lead_cache, f"{os.path.basename(config.input)}.{digest}.leads")
+        self.buffers = {svtype: bytearray() for svtype in sv.TYPES}
+
+    def record(self, ld):
+        self.buffers[ld.svtype] += encode_lead(ld)
+
+    def load(self, lead_provider, regions: list[Region]) -> bool:
+        """
+        Load leads and coverages into lead_provider (which must be empty). Returns False if there is no valid cache file.
+        """
+        try:
+            with open(self.filename, "rb") as handle:
+                data = handle.read()
+        except FileNotFoundError:
+            return False
+
+        offset = len(MAGIC) + FILE_HEADER.size
+        if data[:len(MAGIC)] != MAGIC:
+            log.warning(f"Ignoring invalid lead cache file {self.filename}")
+            return False
+        version, key_length = FILE_HEADER.unpack_from(data, len(MAGIC))
+        if version != VERSION or data[offset:offset + key_length] != self.key:
+            return False
+        offset += key_length
+
+        view = memoryview(data)
+        read_id_offset, read_count, covrtab_min_bin, average_regional_nm = TAB_HEADER.unpack_from(view, offset)
+        offset += TAB_HEADER.size
+
+        for region in regions:
+            lead_provider.enter_region(region)
+        lead_provider.covrtab_min_bin = covrtab_min_bin
+        lead_provider.read_count = read_count
+        lead_provider.read_id += read_count
+        read_id_shift = lead_provider.read_id - read_id_offset - read_count
+
+        for covrtab in (lead_provider.covrtab_fwd, lead_provider.covrtab_rev):
+            count, = COUNT.unpack_from(view, offset)
+            offset += COUNT.size
+            values = struct.unpack_from(f"<{2 * count}q", view, offset)
+            offset += 16 * count
+            covrtab.update(zip(values[::2], values[1::2]))
+
+        binsize = lead_provider.config.cluster_binsize
+        for svtype in sv.TYPES:
+            length, = COUNT.unpack_from(view, offset)
+            offset += COUNT.size
+            for ld in decode_leads(data[offset:offset + length], svtype):
+                if read_id_shift:
+                    if isinstance(ld.read_id, tuple):
+                        ld.read_id = (ld.read_id[0] + read_id_shift,) + ld.read_id[1:]
+                    else:
+                        ld.read_id += read_id_shift
+                lead_provider.record_lead(ld, int(ld.ref_start / binsize) * binsize)
+            offset += length
+
+        lead_provider.config.average_regional_nm = average_regional_nm
+        lead_provider.config.qc_nm_threshold = average_regional_nm
+        return True
+
+    def save(self, lead_provider):
+        """
+        Write the cache file after the leads of lead_provider have been recorded. Failures are logged, not fatal.
+        """
+        config = lead_provider.config
+        parts = [MAGIC, FILE_HEADER.pack(VERSION, len(self.key)), self.key,
+                 TAB_HEADER.pack(lead_provider.read_id - lead_provider.read_count, lead_provider.read_count,
+                                 lead_provider.covrtab_min_bin, config.average_regional_nm)]
+        for covrtab in (lead_provider.covrtab_fwd, lead_provider.covrtab_rev):
+            parts.append(COUNT.pack(len(covrtab)))
+            parts.append(struct.pack(f"<{2 * len(covrtab)}q", *(v for item in covrtab.items() for v in item)))
+        for svtype in sv.TYPES:
+            parts.append(COUNT.pack(len(self.buffers[svtype])))
+            parts.append(self.buffers[svtype])
+        self.buffers = {svtype: bytearray() for svtype in sv.TYPES}
+
+        temp_filename = None
+        try:
+            os.makedirs(config.lead_cache, exist_ok=True)
+            # Write to a temporary file first, so concurrent or aborted runs never leave a partial cache file
+            handle, temp_filename = tempfile.mkstemp(dir=config.lead_cache, prefix=".tmp_", suffix=".leads")
+            with os.fdopen(handle, "wb") as handle:
+                for part in parts:
+                    handle.write(part)
+            os.replace(temp_filename, self.filename)
+        except OSError as ex:
+            log.warning(f"Unable to write lead cache file {self.filename}: {ex}")
+            if temp_filename is not None and os.path.exists(temp_filename):
+                os.remove(temp_filename)
@@ -11,19 +11,14 @@
 from dataclasses import dataclass
 import re
 import itertools
-from typing import Optional
+from typing import Callable, Optional
 
 import pysam
 
-# for: --dev-cache
-import os
-import sys
-import pickle
-# end: for: --dev-cache
-
 from sniffles import util
 from sniffles import sv
-from sniffles.region import Region
+from sniffles.region import Region, clip_regions
+from sniffles.sequence import ReadSequence
 
 
 @dataclass
@@ -162,7 +157,7 @@ for k, v in OPTAB.items():
     OPLIST[int(k)] = v
 
 
-def read_iterindels(read_id, read, contig, config, use_clips, read_nm):
+def read_iterindels(read_id, read, contig, config, use_clips, read_nm, read_seq: ReadSequence = None):
     minsvlen = config.minsvlen_screen
     longinslen = config.long_ins_length / 2.0
     seq_cache_maxlen = config.dev_seq_cache_maxlen
@@ -172,6 +167,8 @@ def read_iterindels(read_id, read, contig, config, use_clips, read_nm):
     CINS = pysam.CINS
     CDEL = pysam.CDEL
     CSOFT_CLIP = pysam.CSOFT_CLIP
+    if read_seq is None:
+        read_seq = ReadSequence(read)
 
     pos_read = 0
     pos_ref = read.reference_start
@@ -193,7 +190,7 @@ def read_iterindels(read_id, read, contig, config, use_clips, read_nm):
                            "INLINE",
                            "INS",
                            oplength,
-                           seq=read.query_sequence[pos_read:pos_read + oplength] if oplength <= seq_cache_maxlen else None)
+                           seq=read_seq.slice(pos_read, pos_read + oplength) if oplength <= seq_cache_maxlen else None)
             elif op == CDEL:
                 yield Lead(read_id,
                            qname,
@@ -256,7 +253,7 @@ def get_cigar_indels(read_id, read, contig, config, use_clips, read_nm):
     return INS_SUM, DEL_SUM
 
 
-def read_itersplits_bnd(read_id, read, contig, config, read_nm):
+def read_itersplits_bnd(read_id, read, contig, config, read_nm, read_seq: ReadSequence = None):
     assert (read.is_supplementary)
     # SA:refname,pos,strand,CIGAR,MAPQ,NM
     all_leads = []
@@ -324,7 +321,7 @@ def read_itersplits_bnd(read_id, read, contig, config, read_nm):
                               "SPLIT_SUP",
                               "?"))
 
-    sv.classify_splits(read, all_leads, config, contig)
+    sv.classify_splits(read, all_leads, config, contig, read_seq)
 
     for lead in all_leads:
         for svtype, svstart, arg in lead.svtypes_starts_lens:
@@ -348,7 +345,7 @@ def read_itersplits_bnd(read_id, read, contig, config, read_nm):
                 yield bnd
 
 
-def read_itersplits(read_id, read, contig, config, read_nm):
+def read_itersplits(read_id, read, contig, config, read_nm, read_seq: ReadSequence = None):
     # SA:refname,pos,strand,CIGAR,MAPQ,NM
     all_leads = []
     supps = [part.split(",") for part in read.get_tag("SA").split(";") if len(part) > 0]
@@ -440,7 +437,7 @@ def read_itersplits(read_id, read, contig, config, read_nm):
     if trace_read:
         print(f"[DEV_TRACE_READ] [0c/4] [LeadProvider.read_itersplits] [{read.query_name}] all_leads: {all_leads}")
 
-    sv.classify_splits(read, all_leads, config, contig)
+    sv.classify_splits(read, all_leads, config, contig, read_seq)
 
     if trace_read:
         print(f"[DEV_TRACE_READ] [0c/4] [LeadProvider.read_itersplits] [{read.query_name}] classify_splits(all_leads): {all_leads}")
@@ -501,6 +498,19 @@ def read_itersplits(read_id, read, contig, config, read_nm):
                            seq=lead.seq if svtype == "INS" else None)
 
 
+def fetch_windows(bam, region: Region, windows: list[Region]):
+    """
+    Fetch reads overlapping any of windows (sorted and disjoint) and starting within region, each read once
+    """
+    min_start = region.start
+    for window in clip_regions(windows, region.start, region.end):
+        for read in bam.fetch(region.contig, window.start, window.end, until_eof=False):
+            # Reads overlapping multiple windows are processed with the first one only
+            if read.reference_start >= min_start:
+                yield read
+        min_start = max(min_start, window.end)
+
+
 class LeadProvider:
     def __init__(self, config, read_id_offset):
         self.config = config
@@ -524,8 +534,19 @@ class LeadProvider:
         self.contig = None
         self.start = None
         self.end = None
+        self.read_start = None
+        self.spill = None
+        self.cache = None
 
     def record_lead(self, ld, pos_leadtab):
+        if self.cache is not None:
+            self.cache.record(ld)
+
+        if self.spill is not None:
+            self.spill.record(ld, pos_leadtab)
+            self.leadcounts[ld.svtype] += 1
+            return
+
         leadtab_svtype = self.leadtab[ld.svtype]
         if pos_leadtab in leadtab_svtype:
             leadtab_svtype[pos_leadtab].append(ld)
@@ -537,7 +558,13 @@ class LeadProvider:
             lead_count = 1
         self.leadcounts[ld.svtype] += 1
 
-    def build_leadtab(self, regions: list[Region], bam):
+    def build_leadtab(self, regions: list[Region], bam, flush: Callable[[int], None] = None, flush_distance: int = 0,
+                      windows: list[Region] = None):
+        """
+        Record leads of all reads starting within regions (and overlapping any of windows, if given). If flush is
+        given, it is called with the start position of the current read every time reads have advanced by more than
+        flush_distance.
+        """
 
         assert (self.contig is None)
         assert (self.start is None)
@@ -546,13 +573,11 @@ class LeadProvider:
         externals = []
         ld_binsize = self.config.cluster_binsize
 
+        next_flush = None
         for region in regions:
-            self.contig = region.contig
-            self.start = region.start if self.start is None else min(region.start, self.start)
-            self.end = region.end if self.end is None else max(region.start, self.end)
-            self.covrtab_min_bin = int(self.start / self.config.coverage_binsize) * self.config.coverage_binsize
+            self.enter_region(region)
 
-            for ld in self.iter_region(bam, region):
+            for ld in self.iter_region(bam, region, windows):
                 ld_contig, ld_ref_start = ld.contig, ld.ref_start
 
                 if region.contig == ld_contig and region.start <= ld_ref_start < region.end:
@@ -561,16 +586,29 @@ class LeadProvider:
                 else:
                     externals.append(ld)
 
+                if flush is not None:
+                    if next_flush is None:
+                        next_flush = self.read_start + flush_distance
+                    elif self.read_start >= next_flush:
+                        flush(self.read_start)
+                        next_flush = self.read_start + flush_distance
+
         return externals
 
-    def iter_region(self, bam, region: Region):
+    def enter_region(self, region: Region):
+        self.contig = region.contig
+        self.start = region.start if self.start is None else min(region.start, self.start)
+        self.end = region.end if self.end is None else max(region.start, self.end)
+        self.covrtab_min_bin = int(self.start / self.config.coverage_binsize) * self.config.coverage_binsize
+
+    def iter_region(self, bam, region: Region, windows: list[Region] = None):
         leads_all = []
         binsize = self.config.cluster_binsize
         coverage_binsize = self.config.coverage_binsize
         coverage_shift_bins = self.config.coverage_shift_bins
         coverage_shift_min_aln_len = self.config.coverage_shift_bins_min_aln_length
         long_ins_threshold = self.config.long_ins_length * 0.5
-        qc_nm = self.config.qc_nm_measure
+        qc_nm = self.config.qc_nm_extract
         phase = self.config.phase
         advanced_tags = qc_nm or phase
         mapq_min = self.config.mapq
@@ -579,7 +617,15 @@ class LeadProvider:
         nm_count = 0
         trace_read = self.config.dev_trace_read
 
-        for read in bam.fetch(region.contig, region.start, region.end, until_eof=False):
+        if windows is None:
+            reads = bam.fetch(region.contig, region.start, region.end, until_eof=False)
+        else:
+            reads = fetch_windows(bam, region, windows)
+        if self.config.prefetch_reads > 0:
+            # Decode records in a background thread while leads are extracted
+            reads = util.prefetch(reads, self.config.prefetch_reads)
+
+        for read in reads:
             if trace_read is not False:
                 if trace_read == read.query_name:
                     print(f"[DEV_TRACE_READ] [0b/4] [LeadProvider.iter_region] [{region}] [{read.query_name}] has been fetched and is entering pre-filtering")
@@ -591,6 +637,7 @@ class LeadProvider:
 
             self.read_id += 1
             self.read_count += 1
+            self.read_start = read.reference_start
 
             alen = read.query_alignment_length
             if read.mapping_quality < mapq_min or read.is_secondary or alen < alen_min:
@@ -620,8 +667,10 @@ class LeadProvider:
                 if trace_read == read.query_name:
                     print(f"[DEV_TRACE_READ] [0b/4] [LeadProvider.iter_region] [{region}] [{read.query_name}] passed pre-filtering (whole-read), begin to extract leads")
 
+            read_seq = ReadSequence(read)
+
             # Extract small indels
-            for lead in read_iterindels(curr_read_id, read, region.contig, self.config, use_clips, read_nm=nm):
+            for lead in read_iterindels(curr_read_id, read, region.contig, self.config, use_clips, read_nm=nm, read_seq=read_seq):
                 if trace_read is not False:
                     if trace_read == read.query_name:
                         print(f"[DEV_TRACE_READ] [1/4] [leadprov.read_iterindels] [{region}] [{read.query_name}] new lead: {lead}")
@@ -633,7 +682,7 @@ class LeadProvider:
                     if trace_read is not False:
                         if trace_read == read.query_name:
                             print(f"[DEV_TRACE_READ] [1/4] [leadprov.read_itersplits_bnd] [{region}] [{read.query_name}] is entering read_itersplits_bnd")
-                    for lead in read_itersplits_bnd(curr_read_id, read, region.contig, self.config, read_nm=nm):
+                    for lead in read_itersplits_bnd(curr_read_id, read, region.contig, self.config, read_nm=nm, read_seq=read_seq):
                         if trace_read is not False:
                             if trace_read == read.query_name:
                                 print(f"[DEV_TRACE_READ] [1/4] [leadprov.read_itersplits_bnd] [{region}] [{read.query_name}] new lead: {lead}")
@@ -642,7 +691,7 @@ class LeadProvider:
                     if trace_read is not False:
                         if trace_read == read.query_name:
                             print(f"[DEV_TRACE_READ] [1/4] [leadprov.read_itersplits] [{region}] [{read.query_name}] is entering read_itersplits")
-                    for lead in read_itersplits(curr_read_id, read, region.contig, self.config, read_nm=nm):
+                    for lead in read_itersplits(curr_read_id, read, region.contig, self.config, read_nm=nm, read_seq=read_seq):
                         if trace_read is not False:
                             if trace_read == read.query_name:
                                 print(f"[DEV_TRACE_READ] [1/4] [leadprov.read_itersplits] [{region}] [{read.query_name}] new lead: {lead}")
@@ -669,11 +718,3 @@ class LeadProvider:
         self.config.average_regional_nm = nm_sum / float(max(1, nm_count))
         self.config.qc_nm_threshold = self.config.average_regional_nm
         # print(f"Contig {contig} avg. regional NM={self.config.average_regional_nm}, threshold={self.config.qc_nm_threshold}")
-
-    def dev_leadtab_filename(self, contig, start, end):
-        scriptloc = os.path.dirname(os.path.realpath(sys.argv[0]))
-        if self.config.dev_cache_dir is None:
-            cache_dir = f"{scriptloc}/cache"
-        else:
-            cache_dir = self.config.dev_cache_dir
-        return f"{cache_dir}/{os.path.basename(self.config.input)}_{contig}_{start}_{end}.pickle"
@@ -8,26 +8,37 @@
 # Maintainer:  Hermann Romanek
 # Contact:     sniffles@romanek.at
 #
+import bisect
+import collections
 import copy
 import gc
 import logging
 import math
 import multiprocessing
+import multiprocessing.connection
 import os
 import threading
+import time
 from argparse import Namespace
 from dataclasses import dataclass
-from typing import Optional, Union, Callable
+from typing import Optional, Union, Callable, Iterator
 
 import pysam
 
 from sniffles import cluster
+from sniffles import genotyping
 from sniffles import leadprov
 from sniffles import postprocessing
+from sniffles import sharding
 from sniffles import snf
+from sniffles import streaming
 from sniffles import sv
-from sniffles.region import Region
-from sniffles.result import Result, ErrorResult, CallResult, GenotypeResult, CombineResult
+from sniffles import vcf
+from sniffles.region import Region, clip_regions
+from sniffles.genotyping import GenotypeIndex
+from sniffles.leadcache import LeadCache
+from sniffles.spill import LeadSpill
+from sniffles.result import Result, ErrorResult, CallResult, GenotypeResult, CombineResult, GroupCombineResult
 
 
 @dataclass
@@ -47,6 +58,11 @@ class Task:
     tandem_repeats: list = None
     genotype_svs: list = None
     regions: list[Region] = None
+    windows: list[Region] = None  # only read alignments overlapping these (--genotype-targeted)
+    overlap: int = 0  # with neighbouring tasks of the same contig, in bp
+    order: tuple = None  # position in output order, for tasks split from another task
+    dispatch_time: float = None
+    elapsed: float = None
     _logger = None
     result: Result = None
 
@@ -61,10 +77,61 @@ class Task:
     def done(self) -> bool:
         return self.result is not None
 
+    @property
+    def priority(self) -> int:
+        """
+        Tasks with higher priority are dispatched first, so the largest tasks do not end up running last
+        """
+        return self.end - self.start
+
     @property
     def success(self) -> bool:
         return self.done and not self.result.error
 
+    @property
+    def sort_key(self) -> tuple:
+        """
+        Results are emitted in order of this key
+        """
+        return self.order if self.order is not None else (self.id,)
+
+    def split(self, parts: int, next_id: int) -> list['Task']:
+        """
+        Split this task into at most parts consecutive tasks with overlap, numbered from next_id. Returns [self] if
+        this task is too small to be split.
+        """
+        config = self.config
+        overlap = self.overlap or config.task_overlap
+        # Parts should not be much smaller than the region they have to read in addition because of the overlap
+        parts = min(parts, (self.end - self.start) // max(config.snf_block_size, 2 * overlap))
+        if parts < 2:
+            return [self]
+        subtasks = []
+        for start, end in sharding.plan_shards(self.end - self.start, parts, align=config.snf_block_size):
+            start, end = self.start + start, self.start + end
+            regions = None
+            if self.regions:
+                regions = clip_regions(self.regions, start - overlap, end + overlap)
+                if not regions:
+                    continue
+            subtask = copy.copy(self)
+            subtask.id = next_id + len(subtasks)
+            subtask.order = self.sort_key + (len(subtasks),)
+            subtask.start, subtask.end = start, end
+            subtask.overlap = overlap
+            subtask.regions = regions
+            if self.genotype_svs is not None:
+                subtask.genotype_svs = [genotype_sv for genotype_sv in self.genotype_svs if start <= genotype_sv.pos < end]
+            subtasks.append(subtask)
+        return subtasks if len(subtasks) > 1 else [self]
+
+    def owns(self, pos: int) -> bool:
+        """
+        Whether an SV at pos is reported by this task. SVs within the overlap with a neighbouring task are seen by
+        both tasks, but only reported by the one containing their position.
+        """
+        return self.overlap == 0 or self.start <= pos < self.end
+
     def add_result(self, result: Result) -> None:
         self.result = result
 
@@ -74,19 +141,52 @@ class Task:
         """
         raise NotImplemented
 
-    def build_leadtab(self):
+    def build_leadtab(self, flush: Callable[[int], None] = None, flush_distance: int = 0, spill: bool = False):
         assert (self.lead_provider is None)
 
         config = self.config
+        regions = self.regions if self.regions else [Region(self.contig, max(0, self.start - self.overlap), self.end + self.overlap)]
+
+        self.lead_provider = leadprov.LeadProvider(config, self.id * config.task_read_id_offset_mult)
+        if spill:
+            self.lead_provider.spill = LeadSpill(config)
 
+        if config.lead_cache is not None:
+            cache = LeadCache(config, regions, self.windows)
+            if cache.load(self.lead_provider, regions):
+                # Leads outside of the task regions are not cached
+                return [], self.lead_provider.read_count
+            self.lead_provider.cache = cache
+
+        # threads includes the calling thread, additional ones are used by htslib for decompression
         if config.input_is_cram and config.reference is not None:
-            self.bam = pysam.AlignmentFile(config.input, config.input_mode, require_index=True, reference_filename=config.reference)
+            self.bam = pysam.AlignmentFile(config.input, config.input_mode, require_index=True, reference_filename=config.reference, threads=1 + config.io_threads)
         else:
-            self.bam = pysam.AlignmentFile(config.input, config.input_mode, require_index=True)
-        self.lead_provider = leadprov.LeadProvider(config, self.id * config.task_read_id_offset_mult)
-        externals = self.lead_provider.build_leadtab(self.regions if self.regions else [Region(self.contig, self.start, self.end)], self.bam)
+            self.bam = pysam.AlignmentFile(config.input, config.input_mode, require_index=True, threads=1 + config.io_threads)
+        externals = self.lead_provider.build_leadtab(regions, self.bam, flush, flush_distance, self.windows)
+        if self.lead_provider.cache is not None:
+            self.lead_provider.cache.save(self.lead_provider)
+            self.lead_provider.cache = None
         return externals, self.lead_provider.read_count
 
+    def stream_candidates(self, keep_qc_fails, config, owned_only=False):
+        """
+        Streaming alternative to build_leadtab, call_candidates and finalize_candidates with bounded memory (see
+        sniffles.streaming), storing leads on disk with --low-memory. Returns the read count, all candidates (owned by this task only, if owned_only) and
+        the finalized calls.
+        """
+        caller = streaming.StreamingCaller(self, keep_qc_fails, owned_only)
+        if config.low_memory:
+            try:
+                _, read_count = self.build_leadtab(spill=True)
+                caller.sweep_spilled()
+            finally:
+                self.lead_provider.spill.close()
+        else:
+            _, read_count = self.build_leadtab(caller.flush, max(config.stream_window // 2, config.cluster_binsize))
+        candidates, passed = caller.finish()
+        return read_count, candidates, passed
+
     def call_candidates(self, keep_qc_fails, config):
         candidates = []
         for svtype in sv.TYPES:
@@ -109,7 +209,7 @@ class Task:
         return candidates
 
     def finalize_candidates(self, candidates, keep_qc_fails, config):
-        passed = []
+        annotate = []
         for svcall in candidates:
             svcall.qc = svcall.qc and postprocessing.qc_sv(svcall, config)
             if not keep_qc_fails and not svcall.qc:
@@ -117,8 +217,13 @@ class Task:
             svcall.qc = svcall.qc and postprocessing.qc_sv_support(svcall, self.coverage_average_total, config)
             if not keep_qc_fails and not svcall.qc:
                 continue
+            annotate.append(svcall)
 
-            postprocessing.annotate_sv(svcall, config)
+        genotyping.genotype_svs(annotate, config)
+
+        passed = []
+        for svcall in annotate:
+            postprocessing.annotate_sv(svcall, config, genotype=False)
 
             svcall.qc = svcall.qc and postprocessing.qc_sv_post_annotate(svcall, config)
 
@@ -145,6 +250,26 @@ class CallTask(Task):
     """
     """
 
+    def call(self, qc: bool, config) -> tuple[list[sv.SVCall], list[sv.SVCall]]:
+        """
+        Call SVs from the leadtab using config. Returns all candidates owned by this task and the calls to be output.
+        """
+        svcandidates = [svcall for svcall in self.call_candidates(qc, config) if self.owns(svcall.pos)]
+        svcalls = self.finalize_candidates(svcandidates, not qc, config)
+        return svcandidates, self.output_calls(svcalls, config)
+
+    @staticmethod
+    def output_calls(svcalls: list[sv.SVCall], config) -> list[sv.SVCall]:
+        """
+        Select the finalized calls to be output: QC fails are kept in the candidates for .snf output only.
+        """
+        if not config.no_qc:
+            svcalls = [s for s in svcalls if s.qc]
+
+        if config.sort:
+            svcalls = sorted(svcalls, key=lambda svcall: svcall.pos)
+        return svcalls
+
     def execute(self) -> CallResult:
         config = self.config
 
@@ -153,17 +278,28 @@ class CallTask(Task):
         else:
             qc = True
 
-        _, read_count = self.build_leadtab()
-        svcandidates = self.call_candidates(qc, config)
-        svcalls = self.finalize_candidates(svcandidates, not qc, config)
-        if not config.no_qc:
-            svcalls = [s for s in svcalls if s.qc]
-
-        if config.sort:
-            svcalls = sorted(svcalls, key=lambda svcall: svcall.pos)
+        if config.stream_window > 0 or config.low_memory:
+            read_count, svcandidates, svcalls = self.stream_candidates(not qc, config, owned_only=True)
+            svcalls = self.output_calls(svcalls, config)
+        else:
+            _, read_count = self.build_leadtab()
+            first_sv_id = self.sv_id
+            svcandidates, svcalls = self.call(qc, config)
+
+            if config.sweep:
+                # Call each configuration of the sweep from the same leads, with the same SV ids as in a separate run
+                sv_id, coverage_average_total = self.sv_id, self.coverage_average_total
+                sweep_svcalls = []
+                for _, changed in config.sweep:
+                    sweep_config = config.sweep_config(changed)
+                    self.sv_id = first_sv_id
+                    sweep_svcalls.append(self.call(sweep_config.snf is None and not sweep_config.no_qc, sweep_config)[1])
+                self.sv_id, self.coverage_average_total = sv_id, coverage_average_total
 
         from sniffles.result import CallResult
         result = CallResult(self, svcalls, read_count)
+        if config.sweep:
+            result.sweep_svcalls = sweep_svcalls
 
         if config.snf is not None:  # and len(svcandidates):
             snf_filename = f"{config.snf}.tmp_{self.id}.snf"
@@ -172,7 +308,7 @@ class CallTask(Task):
                 snf_out = snf.SNFile(config, handle)
                 for cand in svcandidates:
                     snf_out.store(cand)
-                snf_out.annotate_block_coverages(self.lead_provider)
+                snf_out.annotate_block_coverages(self.lead_provider, bounds=(self.start, self.end) if self.overlap else None)
                 snf_out.write_and_index()
                 handle.close()
             result.snf_filename = snf_filename
@@ -187,56 +323,57 @@ class CallTask(Task):
 
 
 class GenotypeTask(Task):
-    def execute(self) -> Optional[GenotypeResult]:
+    def target_windows(self) -> list[Region]:
+        """
+        Merged windows around the SVs to be genotyped, covering the leads that may be clustered with them and the
+        coverage bins of matching calls. Large SVs get separate windows at both breakends and their center.
+        """
         config = self.config
+        pad = (config.combine_match_max + max(config.cluster_repeat_h_max, config.cluster_merge_bnd)
+               + config.coverage_binsize * (config.coverage_updown_bins + 1))
+        intervals = []
+        for genotype_sv in self.genotype_svs:
+            start = genotype_sv.pos
+            if genotype_sv.svtype == "BND":
+                intervals.append((start - pad, start + pad))
+                if genotype_sv.bnd_info is not None and genotype_sv.bnd_info.mate_contig == self.contig:
+                    mate = genotype_sv.bnd_info.mate_ref_start
+                    intervals.append((mate - pad, mate + pad))
+                continue
 
-        qc = False
-        _, read_count = self.build_leadtab()
-        svcandidates = self.call_candidates(qc, config=config)
-        svcalls = self.finalize_candidates(svcandidates, not qc, config=config)
+            end = start + (abs(genotype_sv.svlen or 0) if genotype_sv.svtype != "INS" else 0)
+            if end - start <= 4 * pad:
+                intervals.append((start - pad, end + pad))
+            else:
+                center = (start + end) // 2
+                intervals.extend([(start - pad, start + pad), (center - pad, center + pad), (end - pad, end + pad)])
 
-        binsize = 5000
-        binedge = int(binsize / 10)
-        genotype_svs_svtypes_bins = {svtype: {} for svtype in sv.TYPES}
-        for genotype_sv in self.genotype_svs:
-            genotype_sv.genotype_match_sv = None
-            genotype_sv.genotype_match_dist = math.inf
+        windows = []
+        for start, end in sorted(intervals):
+            if windows and start <= windows[-1].end:
+                windows[-1].end = max(windows[-1].end, end)
+            else:
+                windows.append(Region(self.contig, max(0, start), end))
+        return windows
 
-            if genotype_sv.svtype not in genotype_svs_svtypes_bins:
-                logging.getLogger('sniffles').warning(f'Unsupported SVTYPE: {genotype_sv.svtype}')
-                continue
+    def execute(self) -> Optional[GenotypeResult]:
+        config = self.config
 
-            bins = [int(genotype_sv.pos / binsize) * binsize]
-            if genotype_sv.pos % binsize < binedge:
-                bins.append((int(genotype_sv.pos / binsize) - 1) * binsize)
-            if genotype_sv.pos % binsize > binsize - binedge:
-                bins.append((int(genotype_sv.pos / binsize) + 1) * binsize)
+        if self.genotype_svs is None:
+            self.genotype_svs = vcf.fetch_svs_indexed(config.genotype_vcf, self.contig, self.start, self.end)
 
-            for bin in bins:
-                if bin not in genotype_svs_svtypes_bins[genotype_sv.svtype]:
-                    genotype_svs_svtypes_bins[genotype_sv.svtype][bin] = []
-                genotype_svs_svtypes_bins[genotype_sv.svtype][bin].append(genotype_sv)
+        if config.genotype_targeted:
+            self.windows = self.target_windows()
 
-        for cand in svcandidates:
-            bin = int(cand.pos / binsize) * binsize
-            if bin not in genotype_svs_svtypes_bins[cand.svtype]:
-                continue
-            if cand.svtype == "BND":
-                for genotype_sv in genotype_svs_svtypes_bins[cand.svtype][bin]:
-                    dist = abs(genotype_sv.pos - cand.pos)
-                    # if minlen>0 and dist < genotype_sv.genotype_match_dist and dist <= config.cluster_merge_bnd * 2:
-                    if dist < genotype_sv.genotype_match_dist and dist <= config.cluster_merge_bnd:
-                        if cand.bnd_info.mate_contig == genotype_sv.bnd_info.mate_contig:
-                            genotype_sv.genotype_match_sv = cand
-                            genotype_sv.genotype_match_dist = dist
-            else:
-                for genotype_sv in genotype_svs_svtypes_bins[cand.svtype][bin]:
-                    dist = abs(genotype_sv.pos - cand.pos) + abs(abs(genotype_sv.svlen) - abs(cand.svlen))
-                    minlen = float(min(abs(genotype_sv.svlen), abs(cand.svlen)))
-                    if minlen > 0 and dist < genotype_sv.genotype_match_dist and dist <= config.combine_match * math.sqrt(
-                            minlen) and dist <= config.combine_match_max:
-                        genotype_sv.genotype_match_sv = cand
-                        genotype_sv.genotype_match_dist = dist
+        qc = False
+        if config.stream_window > 0 or config.low_memory:
+            read_count, svcandidates, svcalls = self.stream_candidates(not qc, config)
+        else:
+            _, read_count = self.build_leadtab()
+            svcandidates = self.call_candidates(qc, config=config)
+            svcalls = self.finalize_candidates(svcandidates, not qc, config=config)
+
+        GenotypeIndex(self.genotype_svs, config).match(svcandidates)
 
         postprocessing.coverage(self.genotype_svs, self.lead_provider, config)
 
@@ -266,17 +403,24 @@ class CombineTask(Task):
     result_class = CombineResult
 
     block_indices: list[int] = None
+    inputs: list[dict] = None
+    group_candidates: Optional[list[sv.SVCall]] = None
+    sample_coverages: Optional[dict[int, dict[int, dict[int, int]]]] = None
+    subwindowed_blocks: int = 0
+    early_called_groups: int = 0
 
     def __init__(self, *args, **kwargs):
         self.result_class = kwargs.pop('result_class', None) or self.result_class
+        inputs = kwargs.pop('inputs', None)
         super().__init__(*args, **kwargs)
+        self.inputs = inputs if inputs is not None else self.config.snf_input_info
         self.generate_blocks()
 
     def generate_blocks(self):
         """
         Generate a set of blocks
         """
-        self.block_indices = list(range(self.start, self.end + self.config.snf_block_size, self.config.snf_block_size))
+        self.block_indices = list(range(self.start, self.end, self.config.snf_block_size))
 
     def __str__(self):
         if len(self.block_indices) > 0:
@@ -322,25 +466,221 @@ class CombineTask(Task):
 
         return [self]
 
-    def execute(self):
-        samples_headers_snf = {}
-        for snf_info in self.config.snf_input_info:
+    @property
+    def priority(self) -> int:
+        return len(self.block_indices)
+
+    def split(self, parts: int, next_id: int) -> list['Task']:
+        return [self]
+
+    @staticmethod
+    def input_samples(snf_info: dict) -> list[int]:
+        """
+        Internal ids of the samples contained in an input .snf: one for sample .snf files, multiple for
+        intermediate group .snf files of hierarchical combine
+        """
+        return snf_info.get("samples") or [snf_info["internal_id"]]
+
+    @staticmethod
+    def sample_block_coverage(blocks: Optional[list[dict]], sample_internal_id: int, coverage_bin: int) -> int:
+        """
+        Coverage of a sample in the given bin, as stored in the blocks of its input .snf
+        """
+        if blocks is None:
+            return 0
+        for block in blocks:
+            if "_SAMPLE_COVERAGE" in block:
+                sample_coverage = block["_SAMPLE_COVERAGE"].get(sample_internal_id)
+                if sample_coverage is not None and coverage_bin in sample_coverage:
+                    return sample_coverage[coverage_bin]
+            else:
+                # Sample .snf: only the first block is considered
+                return block["_COVERAGE"].get(coverage_bin, 0)
+        return 0
+
+    @property
+    def collect_groups(self) -> bool:
+        """
+        Whether group candidates and per-sample coverages are collected for a group/cohort .snf
+        """
+        return self.config.snf is not None
+
+    @property
+    def snf_filename(self) -> str:
+        return f"{self.config.snf}.tmp_{self.id}.snf"
+
+    def read_blocks(self, input_index: int, input_snf: snf.SNFile, block_index: int,
+                    window: Optional[tuple[int, int]] = None) -> Optional[list[dict]]:
+        """
+        Read the blocks of an input for block_index, converting all candidates to compact SVCandidates right away so
+        only the candidates of one input are held as full SVCalls at a time. If a window (start, end) is given, only
+        candidates starting within it are kept.
+        """
+        blocks = input_snf.read_blocks(self.contig, block_index)
+        if blocks is None:
+            return None
+        sample_internal_id = self.inputs[input_index].get("internal_id")
+        for block in blocks:
+            for svtype in sv.TYPES:
+                if window is None:
+                    block[svtype] = [sv.SVCandidate.from_call(cand, sample_internal_id) for cand in block[svtype]]
+                else:
+                    start, end = window
+                    block[svtype] = [sv.SVCandidate.from_call(cand, sample_internal_id) for cand in block[svtype] if start <= cand.pos < end]
+        return blocks
+
+    @property
+    def candidate_budget(self) -> int:
+        return self.config.combine_candidate_budget
+
+    def plan_windows(self, block_index: int, inputs_snf: dict[int, snf.SNFile],
+                     inputs_candidate_size: dict[int, float]) -> list[Optional[tuple[int, int]]]:
+        """
+        Windows in which the candidates of a block are loaded and grouped: the whole block ([None]), or sub-windows
+        by position if the number of candidates of the block, estimated from the compressed sizes in the .snf
+        indices, exceeds half the candidate budget (the other half is left for kept groups).
+        """
+        if not self.candidate_budget:
+            return [None]
+
+        key = str(block_index)
+        estimate = 0
+        for input_index, input_snf in inputs_snf.items():
+            contig_index = input_snf.index.get(self.contig)
+            if contig_index is not None and key in contig_index:
+                estimate += sum(length for _, length in contig_index[key]) / inputs_candidate_size[input_index]
+
+        window_budget = max(1, self.candidate_budget // 2)
+        if estimate <= window_budget:
+            return [None]
+
+        bin_size = self.config.combine_min_size
+        block_size = self.config.snf_block_size
+        window_count = min(math.ceil(estimate / window_budget), block_size // bin_size)
+        window_size = math.ceil(block_size / window_count / bin_size) * bin_size
+        windows = [(start, start + window_size) for start in range(block_index, block_index + block_size, window_size)]
+        # Candidates are stored in the block of their position, the outer windows take anything beyond for safety
+        windows[0] = (-math.inf, windows[0][1])
+        windows[-1] = (windows[-1][0], math.inf)
+        self.subwindowed_blocks += 1
+        self.logger.info(f'Block {self.contig}:{block_index}: ~{estimate:.0f} candidates exceed the candidate budget, processing in {len(windows)} sub-windows')
+        return windows
+
+    def limit_kept_groups(self, svtype: str, keep: list[sv.SVGroup], groups_keep: dict[str, list[sv.SVGroup]],
+                          groups_call: list[sv.SVGroup]) -> list[sv.SVGroup]:
+        """
+        Call kept groups early, starting with the leftmost, while the candidates held by all kept groups exceed half
+        the candidate budget. Returns the groups that remain kept.
+        """
+        held = sum(len(group.candidates) for group in keep)
+        held += sum(len(group.candidates) for other_svtype, groups in groups_keep.items() if other_svtype != svtype for group in groups)
+        limit = max(1, self.candidate_budget // 2)
+        if held <= limit:
+            return keep
+
+        keep = sorted(keep, key=lambda group: group.pos_mean)
+        called = 0
+        while keep and held > limit:
+            group = keep.pop(0)
+            held -= len(group.candidates)
+            groups_call.append(group)
+            called += 1
+        self.early_called_groups += called
+        self.logger.info(f'{called} {svtype} groups called early to stay within the candidate budget ({self.contig})')
+        return keep
+
+    def on_block(self, block_index: int, inputs_blocks: dict[int, Optional[list[dict]]]):
+        """
+        Called for every block after it has been loaded from all inputs
+        """
+        if self.sample_coverages is None:
+            return
+
+        sample_coverages = self.sample_coverages.setdefault(block_index, {})
+        for input_index, blocks in inputs_blocks.items():
+            if blocks is None:
+                continue
+            for block in blocks:
+                if "_SAMPLE_COVERAGE" in block:
+                    for sample_internal_id, coverage in block["_SAMPLE_COVERAGE"].items():
+                        sample_coverages.setdefault(sample_internal_id, {}).update(coverage)
+                else:
+                    sample_coverages.setdefault(self.inputs[input_index]["internal_id"], {}).update(block["_COVERAGE"])
+
+    def collect_group_candidates(self, svgroups: list[sv.SVGroup], min_pos: int = None):
+        """
+        Summarize finished groups into group candidates for the .snf output, skipping those before min_pos
+        """
+        if self.group_candidates is not None:
+            for group in svgroups:
+                group_candidate = group.summarize(self.config)
+                if min_pos is None or not group_candidate.pos < min_pos:
+                    self.group_candidates.append(group_candidate)
+
+    def call_groups(self, svgroups: list[sv.SVGroup], min_pos: int = None) -> list[sv.SVCall]:
+        """
+        Turn finished groups into output records, skipping those before min_pos
+        """
+        self.collect_group_candidates(svgroups, min_pos)
+
+        if self.config.vcf is None and self.config.parquet is None:
+            return []
+
+        return [call for call in sv.call_groups(svgroups, self.config, self) if min_pos is None or not call.pos < min_pos]
+
+    def write_groups(self, result: CombineResult):
+        """
+        Write collected group candidates and per-sample coverages to a temporary .snf part for result
+        """
+        with open(self.snf_filename, "wb") as handle:
+            snf_out = snf.SNFile(self.config, handle)
+            for cand in self.group_candidates:
+                snf_out.store(cand)
+            snf_out.annotate_sample_coverages(self.sample_coverages)
+            snf_out.write_and_index()
+        result.snf_filename = self.snf_filename
+        result.snf_index = snf_out.get_index()
+        result.snf_total_length = snf_out.get_total_length()
+        result.snf_candidate_count = len(self.group_candidates)
+        result.has_snf = True
+
+    def combine(self) -> tuple[list[sv.SVCall], int]:
+        """
+        Combine all inputs for the blocks of this task, returning the resulting records (in the container provided by
+        the result class) and number of candidates processed
+        """
+        if self.collect_groups:
+            self.group_candidates = []
+            self.sample_coverages = {}
+
+        inputs_snf = {}
+        inputs_samples = {}
+        inputs_candidate_size = {}
+        sample_inputs = {}
+        for input_index, snf_info in enumerate(self.inputs):
             snf_in = snf.LazySNFile(self.config, open(snf_info["filename"], "rb"), filename=snf_info["filename"])
             snf_in.read_header()
-            samples_headers_snf[snf_info["internal_id"]] = snf_in
+            inputs_snf[input_index] = snf_in
+            inputs_samples[input_index] = self.input_samples(snf_info)
+            for sample_internal_id in inputs_samples[input_index]:
+                sample_inputs[sample_internal_id] = input_index
+
+            if self.candidate_budget:
+                # Average compressed size of a candidate (including coverages), for estimating block sizes
+                inputs_candidate_size[input_index] = (os.path.getsize(snf_info["filename"]) - snf_in.header_length) / max(1, snf_in.header["snf_candidate_count"])
 
             if self.config.combine_close_handles:
                 snf_in.close()
 
-        svcalls = []
+        svcalls = self.result_class.new_calls(self)
 
         # block_groups_keep_threshold=5000
         # TODO: Parameterize
         bin_min_size = self.config.combine_min_size
-        bin_max_candidates = max(25, int(len(self.config.snf_input_info) * 0.5))
+        bin_max_candidates = max(25, int(len(sample_inputs) * 0.5))
         overlap_abs = self.config.combine_overlap_abs
 
-        sample_internal_ids = set(samples_headers_snf.keys())
+        sample_internal_ids = set(sample_inputs.keys())
 
         #
         # Load candidate SVs from all samples for each block separately and cluster them based on start position
@@ -350,94 +690,139 @@ class CombineTask(Task):
 
         for cur, block_index in enumerate(self.block_indices):  # iterate over all blocks
             self.logger.info(f'Processing block {cur + 1}/{len(self.block_indices)} (active calls: {sv.SVCall._counter} groups: {sv.SVGroup._counter})')
-            samples_blocks = {}
-            for sample_internal_id, sample_snf in samples_headers_snf.items():
-                blocks = sample_snf.read_blocks(self.contig, block_index)
-                samples_blocks[sample_internal_id] = blocks
-                # sample_internal_id is the number of the processed file
-                # blocks is a list[dict[str, list[SVCall]]] {'INS': [...], 'DEL': [...], ...}
+            windows = self.plan_windows(block_index, inputs_snf, inputs_candidate_size)
+            for window in windows:
+                inputs_blocks = {}
+                for input_index, input_snf in inputs_snf.items():
+                    blocks = self.read_blocks(input_index, input_snf, block_index, window)
+                    inputs_blocks[input_index] = blocks
+                    # input_index is the number of the processed file
+                    # blocks is a list[dict[str, list[SVCall]]] {'INS': [...], 'DEL': [...], ...}
+
+                if window is windows[0]:
+                    self.on_block(block_index, inputs_blocks)
+
+                for svtype in sv.TYPES:
+                    bins = {}
+                    # svcandidates=[]
+                    for input_index in inputs_snf.keys():  # fetch current block for each file
+                        blocks = inputs_blocks[input_index]
+                        if blocks is None:
+                            continue
+                        for block in blocks:  # usually only 1 block
+                            for cand in block[svtype]:
+                                # if config.combine_pass_only and (cand.qc==False or cand.filter!="PASS"):
+                                #    continue
+
+                                bin = int(cand.pos / bin_min_size) * bin_min_size
+                                if bin not in bins:
+                                    bins[bin] = [cand]
+                                else:
+                                    bins[bin].append(cand)
+                            candidates_processed += len(block[svtype])
 
-            for svtype in sv.TYPES:
-                bins = {}
-                # svcandidates=[]
-                for sample_internal_id in samples_headers_snf.keys():  # fetch current block for each file
-                    blocks = samples_blocks[sample_internal_id]
-                    if blocks is None:
+                    if len(bins) == 0:
                         continue
-                    for block in blocks:  # usually only 1 block
-                        for cand in block[svtype]:
-                            # if config.combine_pass_only and (cand.qc==False or cand.filter!="PASS"):
-                            #    continue
 
-                            cand.sample_internal_id = sample_internal_id
+                    size = 0
+                    svcands = []
+                    keep = groups_keep[svtype]
+                    sorted_bins = sorted(bins)
+                    last_bin = sorted_bins[-1]
+                    for curr_bin in sorted_bins:
+                        svcands.extend(bins[curr_bin])  # here SVCalls from bins are collected...
+                        size += bin_min_size
+
+                        if (not self.config.combine_exhaustive and len(svcands) >= bin_max_candidates) or curr_bin == last_bin:
+                            if len(svcands) == 0:
+                                size = 0
+                                continue
+
+                            svgroups = cluster.resolve_block_groups(svtype, svcands, keep, self.config)
+                            groups_call = []
+                            keep = []
+                            for group in svgroups:
+                                coverage_bin = int(
+                                    group.pos_mean / self.config.coverage_binsize_combine) * self.config.coverage_binsize_combine
+                                for non_included_sample in sample_internal_ids - group.included_samples:
+                                    coverage = self.sample_block_coverage(inputs_blocks[sample_inputs[non_included_sample]], non_included_sample, coverage_bin)
+                                    if non_included_sample in group.coverages_nonincluded:
+                                        group.coverages_nonincluded[non_included_sample] = max(
+                                            coverage,
+                                            group.coverages_nonincluded[non_included_sample]
+                                        )
+                                    else:
+                                        group.coverages_nonincluded[non_included_sample] = coverage
+
+                                if abs(group.pos_mean - curr_bin) < max(size * 0.5, overlap_abs):
+                                    keep.append(group)
+                                else:
+                                    groups_call.append(group)
 
-                            bin = int(cand.pos / bin_min_size) * bin_min_size
-                            if bin not in bins:
-                                bins[bin] = [cand]
-                            else:
-                                bins[bin].append(cand)
-                        candidates_processed += len(block[svtype])
+                            if self.candidate_budget:
+                                keep = self.limit_kept_groups(svtype, keep, groups_keep, groups_call)
 
-                if len(bins) == 0:
-                    continue
+                            if cur > 0 or self.emit_first_block:
+                                if cur == 1 and not self.emit_first_block and len(self.block_indices) > 1:
+                                    # If we're not emitting the first block
+                                    svcalls.extend(self.call_groups(groups_call, min_pos=self.block_indices[1]))
+                                else:
+                                    svcalls.extend(self.call_groups(groups_call))
 
-                size = 0
-                svcands = []
-                keep = groups_keep[svtype]
-                sorted_bins = sorted(bins)
-                last_bin = sorted_bins[-1]
-                for curr_bin in sorted_bins:
-                    svcands.extend(bins[curr_bin])  # here SVCalls from bins are collected...
-                    size += bin_min_size
-
-                    if (not self.config.combine_exhaustive and len(svcands) >= bin_max_candidates) or curr_bin == last_bin:
-                        if len(svcands) == 0:
                             size = 0
-                            continue
+                            svcands = []
 
-                        svgroups = cluster.resolve_block_groups(svtype, svcands, keep, self.config)
-                        groups_call = []
-                        keep = []
-                        for group in svgroups:
-                            coverage_bin = int(
-                                group.pos_mean / self.config.coverage_binsize_combine) * self.config.coverage_binsize_combine
-                            for non_included_sample in sample_internal_ids - group.included_samples:
-                                if samples_blocks[non_included_sample] is not None and coverage_bin in samples_blocks[non_included_sample][0]["_COVERAGE"]:
-                                    coverage = samples_blocks[non_included_sample][0]["_COVERAGE"][coverage_bin]
-                                else:
-                                    coverage = 0
-                                if non_included_sample in group.coverages_nonincluded:
-                                    group.coverages_nonincluded[non_included_sample] = max(
-                                        coverage,
-                                        group.coverages_nonincluded[non_included_sample]
-                                    )
-                                else:
-                                    group.coverages_nonincluded[non_included_sample] = coverage
+                    groups_keep[svtype] = keep
+
+        for svtype in groups_keep:
+            svcalls.extend(self.call_groups(groups_keep[svtype]))
 
-                            if abs(group.pos_mean - curr_bin) < max(size * 0.5, overlap_abs):
-                                keep.append(group)
-                            else:
-                                groups_call.append(group)
+        return svcalls, candidates_processed
 
-                        if cur > 0 or self.emit_first_block:
-                            if cur == 1 and not self.emit_first_block and len(self.block_indices) > 1:
-                                # If we're not emitting the first block
-                                svcalls.extend(call for call in sv.call_groups(groups_call, self.config, self) if not call.pos < self.block_indices[1])
-                            else:
-                                svcalls.extend(sv.call_groups(groups_call, self.config, self))
+    def execute(self):
+        svcalls, candidates_processed = self.combine()
 
-                        size = 0
-                        svcands = []
+        if self.config.sort and isinstance(svcalls, list):
+            # Spilled calls are sorted by the result class
+            svcalls.sort(key=lambda call: call.pos)
 
-                groups_keep[svtype] = keep
+        result = self.result_class(self, svcalls, candidates_processed)
+        result.subwindowed_blocks = self.subwindowed_blocks
+        result.early_called_groups = self.early_called_groups
+        if self.collect_groups:
+            self.write_groups(result)
+        return result
 
-        for svtype in groups_keep:
-            svcalls.extend(sv.call_groups(groups_keep[svtype], self.config, self))
 
-        if self.config.sort:
-            svcalls.sort(key=lambda call: call.pos)
+class GroupCombineTask(CombineTask):
+    """
+    Task for hierarchical combine: merges a batch of .snf files into an intermediate group .snf part, containing
+    one group candidate (SVCall with SVGroupSummary) per SVGroup, carrying the genotypes of all included samples
+    and the coverages of all samples of the batch.
+    """
+    result_class = GroupCombineResult
+    level: int = 0
+    batch: int = 0
+
+    def __init__(self, *args, **kwargs):
+        self.level = kwargs.pop('level', self.level)
+        self.batch = kwargs.pop('batch', self.batch)
+        super().__init__(*args, **kwargs)
+
+    def __str__(self):
+        return f'Group {super().__str__()} (level {self.level}, batch {self.batch})'
+
+    @property
+    def collect_groups(self) -> bool:
+        return True
+
+    @property
+    def snf_filename(self) -> str:
+        return f"{self.config.vcf or self.config.parquet or self.config.snf}.tmp_L{self.level}_G{self.batch}_{self.id}.snf"
 
-        return self.result_class(self, svcalls, candidates_processed)
+    def call_groups(self, svgroups: list[sv.SVGroup], min_pos: int = None) -> list[sv.SVCall]:
+        self.collect_group_candidates(svgroups, min_pos)
+        return []
 
 
 class ShutdownTask:
@@ -454,8 +839,12 @@ class SnifflesWorker:
     """
     Handle for a worker process. Since we're forking, this class will be available in
     both the parent and the worker processes.
+
+    All tasks, including the config and their lookup tables (tandem repeats, SVs to genotype), are published to
+    the worker process once when it is started, in its task table. Only task ids are sent over the pipe.
     """
     id: int  # sequential ID of this worker, starting with 0 for the first
+    task_table: dict[int, Task]  # all tasks of this run by id, inherited by the worker process
     externals: list = None
     recycle: bool = False
     running = True
@@ -469,7 +858,7 @@ class SnifflesWorker:
     def __init__(self, process_id: int, config: Namespace, tasks: list[Task], recycle_hint: Union[bool, Callable] = None):
         self.id = process_id
         self.config = config
-        self.tasks = tasks
+        self.task_table = {task.id: task for task in tasks}
         self.task = None
         self.finished_tasks = []
         self.recycle = recycle_hint
@@ -507,53 +896,57 @@ class SnifflesWorker:
                 target=self.run_worker,
                 daemon=True
             )
+            gc.freeze()
             self.process.start()
+            gc.unfreeze()
 
-    def run_parent(self) -> bool:
+    def dispatch(self, task: Task, tasks_left: int = 0):
+        """
+        Send task to the worker process, recycling it before if that has been requested
+        """
+        self.maybe_recycle()
+        self.task = task
+        # Tasks planned at runtime (e.g. by splitting) are not in the inherited task table and are sent as a whole
+        self.pipe_main.send(task.id if task.id in self.task_table else task)
+        task.dispatch_time = time.monotonic()
+        self._logger.info(f'Dispatched task #{task.id} to worker {self.id} ({tasks_left} tasks left)')
+
+    def receive(self) -> Task:
         """
-        Worker thread, running in parent process
+        Receive the result for the current task, after the pipe or process sentinel of this worker became ready.
+        Returns the finished task.
         """
+        task = self.task
         try:
-            if self.task is None:
-                # we are not working on something...
-                if len(self.tasks) > 0:
-                    # ...but there is more work to be done
-                    self.maybe_recycle()
-
-                    try:
-                        self.task = self.tasks.pop(0)
-                    except IndexError:
-                        # another worker may have taken the last task
-                        self._logger.debug(f'No more tasks to do for {self.id}')
-                    else:
-                        self.pipe_main.send(self.task)
-                        self._logger.info(f'Dispatched task #{self.task.id} to worker {self.id} ({len(self.tasks)}  tasks left)')
-                else:
-                    # ...and no more work available, so we shut down this worker
-                    self._logger.info(f'Worker {self.id} shutting down...')
-                    self.pipe_main.send(ShutdownTask())
-                    self.running = False
+            if self.pipe_main.poll():
+                result: Result = self.pipe_main.recv()
             else:
-                if self.pipe_main.poll(0.01):
-                    self._logger.debug(f'Worker {self.id} got result for task {self.task.id}...')
-                    result: Result = self.pipe_main.recv()
-
-                    if result.error:
-                        self._logger.error(f'Worker {self.id} received error: {result}')
-                    else:
-                        self._logger.info(f'Worker {self.id} got result for task #{result.task_id}')
-
-                    self.task.add_result(result)
-                    self.finished_tasks.append(self.task)
-                    self.task = None
-        except:
+                raise RuntimeError(f'Worker process {self.process.pid} exited unexpectedly (code {self.process.exitcode})')
+        except Exception as e:
             self._logger.exception(f'Unhandled error in worker {self.id}. This may result in an orphened worker process.')
+            result = ErrorResult(e)
+            self.running = False
             try:
                 self.process.kill()
             except:
                 ...
 
-        return self.running
+        task.elapsed = time.monotonic() - task.dispatch_time
+        if result.error:
+            self._logger.error(f'Worker {self.id} received error: {result}')
+        else:
+            rate = result.processed_read_count / task.elapsed if task.elapsed > 0 else 0
+            self._logger.info(f'Worker {self.id} got result for task #{result.task_id} after {task.elapsed:.2f}s ({rate:.0f} {result.processed_unit}/s)')
+
+        task.add_result(result)
+        self.finished_tasks.append(task)
+        self.task = None
+        return task
+
+    def shutdown(self):
+        self._logger.info(f'Worker {self.id} shutting down...')
+        self.pipe_main.send(ShutdownTask())
+        self.running = False
 
     def finalize(self):
         self.process.join(10)
@@ -574,7 +967,8 @@ class SnifflesWorker:
             try:
                 self._logger.debug(f'Worker {self.id} ({self.pid}) waiting for tasks...')
 
-                task = self.pipe_worker.recv()
+                message = self.pipe_worker.recv()
+                task = self.task_table.pop(message) if isinstance(message, int) else message
 
                 self._logger.debug(f'Worker {self.id} got task {task.id}')
 
@@ -594,6 +988,129 @@ class SnifflesWorker:
                 self.pipe_worker.send(ErrorResult(e))
 
 
+class TaskScheduler:
+    """
+    Distributes tasks to config.threads new worker processes, largest tasks first. A worker gets its next task the
+    moment it returns a result.
+
+    The time spent per unit of task size (Task.priority) is tracked for finished tasks. If the next queued task is
+    projected to run more than config.task_split_factor times longer than an even share of all remaining work per
+    worker, it is split into smaller tasks, so all workers stay busy until the end of the run.
+    """
+    def __init__(self, config: Namespace, tasks: list[Task], processes: list[SnifflesWorker], recycle_hint: Union[bool, Callable] = None):
+        self.config = config
+        self.workers = [SnifflesWorker(process_id=pnum, config=config, tasks=tasks, recycle_hint=recycle_hint) for pnum in range(config.threads)]
+        processes.extend(self.workers)
+        self.pending = collections.deque(sorted(tasks, key=lambda task: task.priority, reverse=True))
+        self.outstanding = sorted(task.sort_key for task in tasks)  # of all tasks not yet emitted in order
+        self.next_id = max((task.id for task in tasks), default=-1) + 1
+        self.split_factor = config.task_split_factor
+        self.work_done = 0
+        self.time_spent = 0.0
+        self._logger = logging.getLogger('sniffles.scheduler')
+
+    def estimate(self, task: Task) -> float:
+        """
+        Projected remaining run time of task in seconds, based on the throughput of finished tasks
+        """
+        seconds = task.priority * self.time_spent / self.work_done
+        if task.dispatch_time is not None:
+            seconds = max(0.0, seconds - (time.monotonic() - task.dispatch_time))
+        return seconds
+
+    def maybe_split(self):
+        """
+        Split the next queued task if it would run far longer than an even share of the remaining work
+        """
+        if self.split_factor <= 0 or self.work_done == 0 or self.time_spent == 0:
+            return
+
+        task = self.pending[0]
+        remaining = sum(self.estimate(t) for t in self.pending) + sum(self.estimate(p.task) for p in self.workers if p.task is not None)
+        fair_share = remaining / self.config.threads
+        estimate = self.estimate(task)
+        if fair_share <= 0 or estimate <= self.split_factor * fair_share:
+            return
+
+        subtasks = task.split(min(self.config.threads, math.ceil(estimate / fair_share)), self.next_id)
+        if len(subtasks) < 2:
+            return
+
+        self._logger.info(f'Splitting task #{task.id} (projected {estimate:.1f}s, even share {fair_share:.1f}s) into {len(subtasks)} tasks')
+        self.pending.popleft()
+        self.pending.extendleft(reversed(subtasks))
+        self.next_id = max(t.id for t in subtasks) + 1
+        self.outstanding.remove(task.sort_key)
+        for subtask in subtasks:
+            bisect.insort(self.outstanding, subtask.sort_key)
+
+    def next_task(self, worker: SnifflesWorker):
+        if self.pending and worker.running:
+            self.maybe_split()
+            worker.dispatch(self.pending.popleft(), len(self.pending))
+        elif worker.running:
+            worker.shutdown()
+
+    def run(self) -> Iterator[Task]:
+        """
+        Run all tasks, yielding each task as soon as its result has been received. Workers are added to
+        processes (for cleanup on errors).
+        """
+        # Keep the garbage collector of worker processes from touching (and thereby copying) the inherited task tables
+        gc.freeze()
+        for p in self.workers:
+            p.start()
+        gc.unfreeze()
+
+        for p in self.workers:
+            self.next_task(p)
+
+        while busy := [p for p in self.workers if p.task is not None]:
+            ready = multiprocessing.connection.wait([p.pipe_main for p in busy] + [p.process.sentinel for p in busy])
+            for p in busy:
+                if p.pipe_main in ready or p.process.sentinel in ready:
+                    task = p.receive()
+                    if task.success:
+                        self.work_done += task.priority
+                        self.time_spent += task.elapsed
+                    self.next_task(p)
+                    yield task
+
+        for p in self.workers:
+            p.finalize()
+
+        while self.pending:
+            task = self.pending.popleft()
+            task.add_result(ErrorResult(RuntimeError(f'No worker left to execute task #{task.id}')))
+            yield task
+
+    def run_ordered(self) -> Iterator[Task]:
+        """
+        Run all tasks, yielding them in order (by Task.sort_key) as soon as all previous ones have finished. Tasks
+        finishing early are kept in a reorder buffer until it is their turn.
+        """
+        buffer = {}
+        for task in self.run():
+            buffer[task.sort_key] = task
+            while self.outstanding and self.outstanding[0] in buffer:
+                yield buffer.pop(self.outstanding.pop(0))
+        yield from (buffer[key] for key in sorted(buffer))
+
+
+def schedule_tasks(config: Namespace, tasks: list[Task], processes: list[SnifflesWorker], recycle_hint: Union[bool, Callable] = None) -> Iterator[Task]:
+    """
+    Run tasks on new worker processes, yielding each task as soon as its result has been received
+    """
+    return TaskScheduler(config, tasks, processes, recycle_hint).run()
+
+
+def run_tasks(config: Namespace, tasks: list[Task], processes: list[SnifflesWorker], recycle_hint: Union[bool, Callable] = None) -> list[Task]:
+    """
+    Run all tasks on new worker processes, returning the finished tasks sorted by task id
+    """
+    return sorted(schedule_tasks(config, tasks, processes, recycle_hint), key=lambda task: task.sort_key)
+
+
 def execute_task(task: Task):
     logging.getLogger('sniffles.parallel').info(f'Working on {task}')
     return task.execute()
@@ -14,15 +14,18 @@ from sniffles import consensus
 from sniffles.config import SnifflesConfig
 from sniffles.sv import SVCall
 import math
+from typing import Optional
 
+# Genotype likelihoods are calculated for support and coverage scaled down to at most this coverage
+GENOTYPE_NORMALIZATION_TARGET = 250
 
-def annotate_sv(svcall, config):
-    if config.phase:
-        phase = phase_sv(svcall, config)
-    else:
-        phase = (None, None)
 
-    genotype_sv(svcall, config, phase)
+def annotate_sv(svcall, config, genotype=True):
+    """
+    Genotype (unless already done for all calls, see sniffles.genotyping.genotype_svs) and add the INS sequence
+    """
+    if genotype:
+        genotype_sv(svcall, config, get_phase(svcall, config))
 
     if svcall.svtype == "INS" and not config.symbolic:
         merged_leads = [lead for lead in svcall.postprocess.cluster.leads if lead.seq is not None]
@@ -50,6 +53,11 @@ def annotate_sv(svcall, config):
             # merged_leads=merged_leads_new
 
             if len(merged_leads) >= config.consensus_min_reads and not config.no_consensus:
+                # Consensus calculation works on decoded (packed) sequences
+                for ld in merged_leads:
+                    ld.seq = str(ld.seq)
+                best_lead.seq = str(best_lead.seq)
+
                 kmer_len = config.consensus_kmer_len
                 skip = config.consensus_kmer_skip_base + int(len(best_lead.seq)*config.consensus_kmer_skip_seqlen_mult)
                 skip_repetitive = skip
@@ -57,7 +65,7 @@ def annotate_sv(svcall, config):
                 svcall.alt = consensus.novel_from_reads(best_lead, merged_leads, klen=kmer_len, skip=skip,
                                                         skip_repetitive=skip_repetitive)
             else:
-                svcall.alt = best_lead.seq
+                svcall.alt = str(best_lead.seq)
 
 
 def add_request(svcall, field, pos, requests_for_coverage, config):
@@ -323,7 +331,12 @@ def qc_sv(svcall: SVCall, config: SnifflesConfig):
     return True
 
 
-def qc_sv_post_annotate(svcall: SVCall, config: SnifflesConfig):
+def qc_sv_post_annotate(svcall: SVCall, config: SnifflesConfig, qc_nm_threshold: float = None):
+    """
+    qc_nm_threshold overrides the regional NM threshold set in config (without --qc-nm-mult applied)
+    """
+    if qc_nm_threshold is None:
+        qc_nm_threshold = config.qc_nm_threshold
     af = svcall.get_info("AF")
     af = af if af is not None else 0
     sv_is_mosaic = af <= config.mosaic_af_max
@@ -335,10 +348,9 @@ def qc_sv_post_annotate(svcall: SVCall, config: SnifflesConfig):
         return False
 
     qc_nm = config.qc_nm
-    qc_nm_threshold = config.qc_nm_threshold * config.qc_nm_mult
+    qc_nm_threshold = qc_nm_threshold * config.qc_nm_mult
     if config.mosaic and sv_is_mosaic:
         qc_nm = config.mosaic_qc_nm
-        qc_nm_threshold = config.qc_nm_threshold * config.qc_nm_mult
     if qc_nm and svcall.nm > qc_nm_threshold and (len(svcall.genotypes) == 0 or svcall.genotypes[0][1] == 0):
         svcall.filter = "ALN_NM"
         return False
@@ -377,15 +389,13 @@ def likelihood_ratio(q1, q2):
         return 0
 
 
-def genotype_sv(svcall, config, phase):
-    normalization_target = 250
-    hom_ref_p = config.genotype_error
-    het_p = (1.0 / config.genotype_ploidy)  # - config.genotype_error
-    hom_var_p = 1.0 - config.genotype_error
+def genotype_support_coverage(svcall, config) -> Optional[tuple[int, int]]:
+    """
+    Support and coverage used for genotyping svcall, None if it can not be genotyped
+    """
     coverage = 0
 
     # Count inline events only once per read, but split events as individual alignments, as in coverage calculation
-    leads = svcall.postprocess.cluster.leads
     # TODO: long insertions skew this way higher than the number of reads we have
     support = rescale_support(svcall, config)
 
@@ -414,29 +424,25 @@ def genotype_sv(svcall, config, phase):
         # For clean DEL cuts we don't have anything inside the call,
         # so coverage_list will be empty -> use up/downstream to continue
         if not (svcall.svtype == "DEL" and svcall.coverage_upstream > 0 and svcall.coverage_downstream > 0):
-            return
+            return None
 
     if len(coverage_list) > 0:
         coverage += round(sum(coverage_list) / len(coverage_list))
+    return support, coverage
 
-    if support > coverage:
-        coverage = support
 
-    af = support / float(coverage)
+def genotype_likelihoods(normalized_support, normalized_coverage, config) -> tuple[tuple[int, int], int, int]:
+    """
+    Most likely genotype, its quality and the z-score for the given (normalized) support and coverage
+    """
+    hom_ref_p = config.genotype_error
+    het_p = (1.0 / config.genotype_ploidy)  # - config.genotype_error
+    hom_var_p = 1.0 - config.genotype_error
 
     genotype_p = [((0, 0), hom_ref_p),
                   ((0, 1), het_p),
                   ((1, 1), hom_var_p)]
 
-    max_lead = max(support, coverage)
-    if max_lead > normalization_target:
-        norm = normalization_target / float(max_lead)
-        normalized_support = round(support * norm)
-        normalized_coverage = round(coverage * norm)
-    else:
-        normalized_support = support
-        normalized_coverage = coverage
-
     genotype_likelihoods = []
     for gt, p in genotype_p:
         q = binomial_probability(normalized_support, normalized_coverage, p)
@@ -451,17 +457,56 @@ def genotype_sv(svcall, config, phase):
     qz = [q for gt, q in normalized_likelihoods if gt == (0, 0)][0]
     genotype_z_score = min(60, int((-10) * likelihood_ratio(qz, q1)))
     genotype_quality = min(60, int((-10) * likelihood_ratio(q2, q1)))
+    return gt1, genotype_quality, genotype_z_score
 
+
+def set_genotype(svcall, config, phase, gt, genotype_quality, genotype_z_score, support, coverage, af):
     is_long_ins = (svcall.svtype == "INS" and svcall.svlen >= config.long_ins_length and config.detect_large_ins)
     if genotype_z_score < config.genotype_min_z_score and not config.mosaic and not is_long_ins:
         if svcall.filter == "PASS":
             svcall.filter = "GT"
 
-    a, b = gt1
+    a, b = gt
     svcall.genotypes[0] = (a, b, genotype_quality, coverage - support, support, phase)
     svcall.set_info("AF", af)
 
 
+def genotype_sv(svcall, config, phase):
+    """
+    Genotype a single call. See sniffles.genotyping.genotype_svs for genotyping all calls of a task at once.
+    """
+    normalization_target = GENOTYPE_NORMALIZATION_TARGET
+
+    support_coverage = genotype_support_coverage(svcall, config)
+    if support_coverage is None:
+        return
+    support, coverage = support_coverage
+
+    if support > coverage:
+        coverage = support
+
+    af = support / float(coverage)
+
+    max_lead = max(support, coverage)
+    if max_lead > normalization_target:
+        norm = normalization_target / float(max_lead)
+        normalized_support = round(support * norm)
+        normalized_coverage = round(coverage * norm)
+    else:
+        normalized_support = support
+        normalized_coverage = coverage
+
+    gt, genotype_quality, genotype_z_score = genotype_likelihoods(normalized_support, normalized_coverage, config)
+    set_genotype(svcall, config, phase, gt, genotype_quality, genotype_z_score, support, coverage, af)
+
+
+def get_phase(svcall, config):
+    if config.phase:
+        return phase_sv(svcall, config)
+    else:
+        return None, None
+
+
 def phase_sv(svcall, config):
     reads_phases = {lead.read_id[0]: (lead.read_id[1], lead.read_id[2]) for lead in svcall.postprocess.cluster.leads}
     hp_list = util.most_common(hp for hp, ps in reads_phases.values())
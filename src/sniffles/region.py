@@ -9,6 +9,7 @@
 # Contact:     sniffles@romanek.at
 #
 import logging
+import sys
 from dataclasses import dataclass
 from typing import Optional
 
@@ -39,5 +40,28 @@ class Region:
             log.warning(f'Invalid region line: {line} ({ex})')
             return None
 
+    @classmethod
+    def from_string(cls, text: str) -> 'Region':
+        """
+        Parse a region given as CONTIG, CONTIG:START or CONTIG:START-END (1-based, inclusive, as in samtools).
+        Raises ValueError for invalid regions.
+        """
+        contig, sep, interval = text.rpartition(':')
+        if not sep or not contig:
+            return Region(contig=text, start=0, end=sys.maxsize)
+        start, _, end = interval.replace(',', '').partition('-')
+        start = int(start) if start else 1
+        end = int(end) if end else sys.maxsize
+        if start < 1 or end < start:
+            raise ValueError(f'Invalid region: {text}')
+        return Region(contig=contig, start=start - 1, end=end)
+
     def __str__(self) -> str:
         return f'{self.contig}:{self.start}-{self.end}'
+
+
+def clip_regions(regions: list[Region], start: int, end: int) -> list[Region]:
+    """
+    Clip regions to start..end, dropping those outside
+    """
+    return [Region(r.contig, max(r.start, start), min(r.end, end)) for r in regions if r.start < end and r.end > start]
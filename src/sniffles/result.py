@@ -8,9 +8,13 @@
 # Maintainer:  Hermann Romanek
 # Contact:     sniffles@romanek.at
 #
+import dataclasses
+import heapq
+import itertools
 import logging
 import os
 import pickle
+from typing import Iterator, Optional
 
 from sniffles.snf import SNFile
 from sniffles.sv import SVCall
@@ -29,6 +33,7 @@ class Result:
     run_id: str
     contig: str
     processed_read_count: int
+    processed_unit: str = "reads"  # counted in processed_read_count
     svcalls: list[SVCall]
     svcount: int
     error: bool = False
@@ -41,25 +46,41 @@ class Result:
         self.svcount = len(svcalls)
         self.store_calls(svcalls)
 
+    @classmethod
+    def new_calls(cls, task: 'Task') -> list[SVCall]:
+        """
+        Container for the calls of task, passed to the result once the task is done
+        """
+        return []
+
     def store_calls(self, svcalls):
         self.svcalls = svcalls
 
-    def emit(self, vcf_out: VCF = None, **kwargs) -> int:
+    def emit(self, vcf_out: VCF = None, parquet_out: 'ParquetOutput' = None, **kwargs) -> int:
         """
         Emit this result to a file. Returns the number of records written.
         """
+        if vcf_out is None and parquet_out is None:
+            log.debug(f'No vcf output file specified.')
+            return 0
+
+        calls = self.svcalls
         if vcf_out is not None:
-            calls = self.svcalls
             if calls:
                 for call in calls:
                     vcf_out.write_call(call)
                 log.debug(f"Wrote {len(calls)} calls from {self} to VCF.")
             else:
                 log.debug(f'No calls for {self}')
-            return len(calls)
-        else:
-            log.debug(f'No vcf output file specified.')
-            return 0
+        if parquet_out is not None:
+            parquet_out.write_calls(calls)
+        return len(calls)
+
+    def release(self):
+        """
+        Free the calls of this result once it has been emitted
+        """
+        self.svcalls = []
 
 
 class CallResult(Result):
@@ -69,13 +90,22 @@ class CallResult(Result):
     snf_index = None
     snf_total_length = None
     snf_candidate_count = None
+    sweep_svcalls: list[list[SVCall]] = None
 
     def emit(self, **kwargs) -> int:
         res = super().emit(**kwargs)
         if snf_out := kwargs.get('snf_out'):
             snf_out.add_result(self)
+        if self.sweep_svcalls is not None:
+            for sweep_vcf_out, svcalls in zip(kwargs['sweep_vcf_out'], self.sweep_svcalls):
+                for call in svcalls:
+                    sweep_vcf_out.write_call(call)
         return res
 
+    def release(self):
+        super().release()
+        self.sweep_svcalls = None
+
 
 class GenotypeResult(Result):
     """
@@ -84,15 +114,8 @@ class GenotypeResult(Result):
 
     def emit(self, vcf_out: VCF = None, snf_out: SNFile = None, **kwargs) -> int:
         if vcf_out is not None:
-            genotype_lineindex_order = kwargs['genotype_lineindex_order']
-            genotype_lineindex_svcalls_returned = {}
-
-            for svcall in self.svcalls:
-                genotype_lineindex_svcalls_returned[svcall.raw_vcf_line_index] = svcall
-
-            for lineindex in genotype_lineindex_order:
-                if lineindex in genotype_lineindex_svcalls_returned:
-                    vcf_out.rewrite_genotype(genotype_lineindex_svcalls_returned[lineindex])
+            for svcall in sorted(self.svcalls, key=lambda svcall: svcall.raw_vcf_line_index):
+                vcf_out.rewrite_genotype(svcall)
 
         return len(self.svcalls)
 
@@ -101,34 +124,173 @@ class CombineResult(Result):
     """
     Result of a combine run for one task, simple variant with calls in memory. Must be pickleable.
     """
+    processed_unit = "candidates"
+    coverage_average_total = 0
+    has_snf = False
+    snf_filename = None
+    snf_index = None
+    snf_total_length = None
+    snf_candidate_count = None
+    subwindowed_blocks = 0  # blocks processed in sub-windows due to --combine-candidate-budget
+    early_called_groups = 0  # groups called early due to --combine-candidate-budget
+
+    def emit(self, **kwargs) -> int:
+        res = super().emit(**kwargs)
+        if snf_out := kwargs.get('snf_out'):
+            snf_out.add_result(self)
+        return res
+
     def __str__(self):
         return f'CombineResult #{self.task_id}'
 
 
+class GroupCombineResult(CombineResult):
+    """
+    Result of combining a batch of samples into an intermediate group .snf part (hierarchical combine). The group
+    candidates are stored in the .snf part only.
+    """
+    def store_calls(self, svcalls):
+        self.svcalls = []
+
+    def emit(self, vcf_out: VCF = None, snf_out: SNFile = None, **kwargs) -> int:
+        if snf_out is not None:
+            snf_out.add_result(self)
+        return self.snf_candidate_count
+
+    def __str__(self):
+        return f'GroupCombineResult #{self.task_id}'
+
+
+class CallRuns:
+    """
+    Calls of a task spilled to a temporary file as runs of calls, each cut into chunks of CHUNK_SIZE calls. Calls are
+    buffered until RUN_SIZE calls have been added, then written as a run (sorted by position if sort is set).
+    Iterating merges the runs, reading one chunk per run at a time. Calls are encoded as tuples of their field values.
+    """
+    RUN_SIZE = 10000
+    CHUNK_SIZE = 500
+    FIELDS = tuple(field.name for field in dataclasses.fields(SVCall))
+
+    def __init__(self, filename: str, sort: bool = True):
+        self.filename = filename
+        self.sort = sort
+        self.runs: list[list[tuple[int, int]]] = []  # offset and length of each chunk
+        self.count = 0
+        self.buffer = []
+        self.handle = open(filename, "wb")
+        self.offset = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, call: SVCall):
+        self.buffer.append(call)
+        self.count += 1
+        if len(self.buffer) >= self.RUN_SIZE:
+            self.write_run()
+
+    def extend(self, calls: list[SVCall]):
+        for call in calls:
+            self.append(call)
+
+    def write_run(self):
+        if not self.buffer:
+            return
+        if self.sort:
+            self.buffer.sort(key=lambda call: call.pos)
+        run = []
+        for i in range(0, len(self.buffer), self.CHUNK_SIZE):
+            data = pickle.dumps([tuple(getattr(call, field) for field in self.FIELDS) for call in self.buffer[i:i + self.CHUNK_SIZE]],
+                                protocol=pickle.HIGHEST_PROTOCOL)
+            self.handle.write(data)
+            run.append((self.offset, len(data)))
+            self.offset += len(data)
+        self.runs.append(run)
+        self.buffer = []
+
+    def close(self):
+        """
+        Write remaining calls. Closes the file, after which this object is sent to the parent process.
+        """
+        self.write_run()
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+    def __getstate__(self):
+        return {key: value for key, value in self.__dict__.items() if key not in ("handle", "buffer")}
+
+    def read_run(self, handle, run: list[tuple[int, int]]) -> Iterator[SVCall]:
+        for offset, length in run:
+            handle.seek(offset)
+            for values in pickle.loads(handle.read(length)):
+                yield SVCall(*values)
+
+    def __iter__(self) -> Iterator[SVCall]:
+        with open(self.filename, "rb") as handle:
+            runs = [self.read_run(handle, run) for run in self.runs]
+            if self.sort and len(runs) > 1:
+                yield from heapq.merge(*runs, key=lambda call: call.pos)
+            else:
+                yield from itertools.chain(*runs)
+
+    def iter_chunks(self) -> Iterator[list[SVCall]]:
+        """
+        Calls in order, in lists of up to CHUNK_SIZE calls
+        """
+        calls = iter(self)
+        while chunk := list(itertools.islice(calls, self.CHUNK_SIZE)):
+            yield chunk
+
+    def remove(self):
+        os.unlink(self.filename)
+
+
 class CombineResultTmpFile(CombineResult):
     """
-    Result of a combine run, with calls in a temporary file instead of memory
+    Result of a combine run, with calls spilled to a temporary file by the task (see CallRuns) instead of memory.
+    Calls are merged from the file straight into the outputs when emitting.
     """
-    @property
-    def tmpfile_name(self) -> str:
-        return f'result-{self.run_id}-{self.task_id}.part'
+    runs: Optional[CallRuns] = None
 
-    def store_calls(self, svcalls):
-        with open(self.tmpfile_name, 'wb') as f:
-            f.write(pickle.dumps(svcalls))
+    @classmethod
+    def new_calls(cls, task: 'Task') -> CallRuns:
+        return CallRuns(f'result-{task.config.run_id}-{task.id}.part', sort=task.config.sort)
+
+    def store_calls(self, svcalls: CallRuns):
+        svcalls.close()
+        self.runs = svcalls
 
     @property
-    def svcalls(self) -> list[SVCall]:
-        with open(self.tmpfile_name, 'rb') as f:
-            return pickle.loads(f.read())
+    def tmpfile_name(self) -> str:
+        return self.runs.filename
 
-    def emit(self, **kwargs) -> int:
-        res = super().emit(**kwargs)
+    def emit(self, vcf_out: VCF = None, parquet_out: 'ParquetOutput' = None, snf_out: SNFile = None, **kwargs) -> int:
+        count = 0
+        if vcf_out is not None or parquet_out is not None:
+            for calls in self.runs.iter_chunks():
+                if vcf_out is not None:
+                    for call in calls:
+                        vcf_out.write_call(call)
+                if parquet_out is not None:
+                    parquet_out.write_calls(calls, flush=False)
+                count += len(calls)
+            if parquet_out is not None:
+                # One row group per task
+                parquet_out.flush()
+            log.debug(f"Wrote {count} calls from {self}.")
+        if snf_out is not None:
+            snf_out.add_result(self)
         self.cleanup()
-        return res
+        return count
+
+    def release(self):
+        """
+        Calls are kept in the temporary file only, which has already been removed by emit
+        """
 
     def cleanup(self):
-        os.unlink(self.tmpfile_name)
+        self.runs.remove()
 
 
 class ErrorResult:
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+"""
+Compact storage of read sequences held by leads.
+
+Insertion sequences are packed with 2 bits per base (ACGT only) or 4 bits per base (all symbols of the BAM sequence
+alphabet) and only decoded for consensus calculation and ALT output. Packing and unpacking use str.translate and
+int/bytes conversions, so no Python loop over bases is involved.
+"""
+from typing import Union
+
+ALPHABET_2BIT = "ACGT"
+ALPHABET_4BIT = "=ACMGRSVTWYHKDBN"
+
+ENCODE_2BIT = str.maketrans(ALPHABET_2BIT, "0123")
+DECODE_2BIT = str.maketrans({f"{i:x}": ALPHABET_2BIT[i >> 2] + ALPHABET_2BIT[i & 3] for i in range(16)})
+ENCODE_4BIT = str.maketrans(ALPHABET_4BIT, "0123456789abcdef")
+DECODE_4BIT = str.maketrans("0123456789abcdef", ALPHABET_4BIT)
+DELETE_4BIT = str.maketrans("", "", ALPHABET_4BIT)
+
+
+class PackedSequence:
+    """
+    A nucleotide sequence packed with 2 or 4 bits per base
+    """
+    __slots__ = ("data", "length", "bits")
+
+    def __init__(self, data: bytes, length: int, bits: int):
+        self.data = data
+        self.length = length
+        self.bits = bits
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __str__(self) -> str:
+        if self.length == 0:
+            return ""
+        if self.bits == 2:
+            return self.data.hex().translate(DECODE_2BIT)[-self.length:]
+        return self.data.hex().translate(DECODE_4BIT)[:self.length]
+
+    def __add__(self, other: Union["PackedSequence", str]) -> "PackedSequence":
+        return pack(str(self) + str(other))
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (PackedSequence, str)):
+            return str(self) == str(other)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(str(self))
+
+    def __repr__(self) -> str:
+        return f"PackedSequence({str(self)!r})"
+
+
+def pack(seq: str) -> Union[PackedSequence, str]:
+    """
+    Pack seq with 2 bits per base if it consists of ACGT only, otherwise with 4 bits per base. Sequences containing
+    symbols outside of the BAM alphabet are returned unchanged.
+    """
+    digits = seq.translate(ENCODE_2BIT)
+    if digits.isdigit() or len(seq) == 0:
+        return PackedSequence(int(digits or "0", 4).to_bytes((len(seq) + 3) // 4, "big"), len(seq), 2)
+
+    if seq.translate(DELETE_4BIT):
+        return seq
+    digits = seq.translate(ENCODE_4BIT)
+    return PackedSequence(bytes.fromhex(digits + "0" * (len(digits) % 2)), len(seq), 4)
+
+
+class ReadSequence:
+    """
+    The query sequence of an alignment, decoded from the alignment record on first access only and shared by all
+    leads extracted from it
+    """
+    __slots__ = ("read", "sequence")
+
+    def __init__(self, read):
+        self.read = read
+        self.sequence = None
+
+    def slice(self, start: int, end: int) -> Union[PackedSequence, str]:
+        if self.sequence is None:
+            self.sequence = self.read.query_sequence
+        return pack(self.sequence[start:end])
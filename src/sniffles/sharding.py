@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+"""
+Planning of intra-contig tasks (shards) with similar read counts.
+
+Read density along a contig is estimated from the linear index of the input .bai file, which stores the (compressed)
+file offset of the first alignment overlapping each 16kb window. The number of compressed bytes between two windows
+is proportional to the alignment data starting in between. If no .bai index is available (e.g. CSI indices or CRAM
+input), contigs are split into shards of equal length.
+"""
+import logging
+import os
+import struct
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+BAI_MAGIC = b"BAI\1"
+BAI_WINDOW_SIZE = 2 ** 14
+
+
+def find_bai(alignments_filename: str) -> Optional[str]:
+    for filename in (f"{alignments_filename}.bai", f"{os.path.splitext(alignments_filename)[0]}.bai"):
+        if os.path.exists(filename):
+            return filename
+    return None
+
+
+def read_bai_linear_index(filename: str) -> list[list[int]]:
+    """
+    Read the linear index of a .bai file, returning the compressed file offsets of all 16kb windows for each reference
+    """
+    with open(filename, "rb") as handle:
+        data = handle.read()
+
+    if data[:4] != BAI_MAGIC:
+        raise ValueError(f"{filename} is not a .bai index")
+
+    (n_ref,) = struct.unpack_from("<i", data, 4)
+    offset = 8
+    linear_index = []
+    for _ in range(n_ref):
+        (n_bin,) = struct.unpack_from("<i", data, offset)
+        offset += 4
+        for _ in range(n_bin):
+            _, n_chunk = struct.unpack_from("<Ii", data, offset)
+            offset += 8 + n_chunk * 16
+        (n_intv,) = struct.unpack_from("<i", data, offset)
+        offset += 4
+        virtual_offsets = struct.unpack_from(f"<{n_intv}Q", data, offset)
+        offset += n_intv * 8
+        linear_index.append([voffset >> 16 for voffset in virtual_offsets])
+    return linear_index
+
+
+def window_weights(offsets: list[int]) -> list[int]:
+    """
+    Estimate the amount of alignment data for each window from the linear index offsets of one reference
+    """
+    weights = []
+    previous = None
+    for window_offset in offsets:
+        if window_offset == 0 and previous is not None:
+            # Empty windows may not have an offset assigned
+            window_offset = previous
+        if previous is not None:
+            weights.append(max(0, window_offset - previous))
+        previous = window_offset
+    if weights:
+        weights.append(round(sum(weights) / len(weights)))
+    return weights
+
+
+def plan_shards(contig_length: int, shard_count: int, weights: Optional[list[int]] = None, align: int = 1) -> list[tuple[int, int]]:
+    """
+    Split a contig into at most shard_count consecutive shards (start, end) of similar weight, end exclusive, so that
+    the last shard ends at contig_length. Split points are rounded to multiples of align. Without weights, shards have
+    equal length.
+    """
+    if not weights or sum(weights) == 0:
+        weights = [1] * max(1, -(-contig_length // BAI_WINDOW_SIZE))
+
+    total = sum(weights)
+    bounds = [0]
+    cumulative = 0
+    next_shard = 1
+    for window, weight in enumerate(weights):
+        cumulative += weight
+        while next_shard < shard_count and cumulative >= total * next_shard / shard_count:
+            split = round((window + 1) * BAI_WINDOW_SIZE / align) * align
+            if bounds[-1] < split < contig_length:
+                bounds.append(split)
+            next_shard += 1
+    bounds.append(contig_length)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class ShardPlanner:
+    """
+    Plans shards for all contigs of an input alignment file
+    """
+    def __init__(self, alignments_filename: str, align: int):
+        self.align = align
+        self.linear_index = None
+
+        bai_filename = find_bai(alignments_filename)
+        if bai_filename is not None:
+            try:
+                self.linear_index = read_bai_linear_index(bai_filename)
+            except (ValueError, struct.error) as ex:
+                log.warning(f"Unable to read linear index from {bai_filename} ({ex}), splitting contigs into tasks of equal length.")
+        else:
+            log.info(f"No .bai index found for {alignments_filename}, splitting contigs into tasks of equal length.")
+
+    def plan(self, tid: int, contig_length: int, shard_count: int) -> list[tuple[int, int]]:
+        weights = None
+        if self.linear_index is not None and tid < len(self.linear_index):
+            weights = window_weights(self.linear_index[tid])
+        return plan_shards(contig_length, shard_count, weights, self.align)
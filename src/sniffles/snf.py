@@ -8,13 +8,16 @@
 # Maintainer:  Hermann Romanek
 # Contact:     sniffles@romanek.at
 #
+import bisect
+import heapq
 import os
 import pickle
 import json
 import gzip
 import math
+from argparse import Namespace
 from collections import OrderedDict
-from typing import Optional, Union
+from typing import Iterable, Iterator, Optional, Union
 
 from sniffles import sv
 from sniffles.config import SnifflesConfig
@@ -59,7 +62,10 @@ class SNFile:
             svcand.rnames = None
         self.blocks[block_index][svcand.svtype].append(svcand)
 
-    def annotate_block_coverages(self, lead_provider, resolution=500):
+    def annotate_block_coverages(self, lead_provider, resolution=500, bounds: tuple[int, int] = None):
+        """
+        Store coverages of all blocks covered by lead_provider, or only those within bounds (start, end) if given
+        """
         config = self.config
         start_bin = lead_provider.covrtab_min_bin
         end_bin = int(lead_provider.end / config.coverage_binsize) * config.coverage_binsize
@@ -86,7 +92,7 @@ class SNFile:
                 block_index = int(bin / snf_block_size) * snf_block_size
 
                 coverage_total_curr = math.ceil(coverage_sum / float(bin_count))
-                if coverage_total_curr > 0:
+                if coverage_total_curr > 0 and (bounds is None or bounds[0] <= bin < bounds[1]):
                     if block_index not in self.blocks:
                         self.blocks[block_index] = {svtype: [] for svtype in sv.TYPES}
                         self.blocks[block_index]["_COVERAGE"] = {}
@@ -96,6 +102,17 @@ class SNFile:
                 coverage_sum = 0
                 bin_count = 0
 
+    def annotate_sample_coverages(self, sample_coverages: dict[int, dict[int, dict[int, int]]]):
+        """
+        Store per-sample coverages (block index -> sample internal id -> coverage bin -> coverage) for
+        intermediate group .snf files of hierarchical combine
+        """
+        for block_index, coverages in sample_coverages.items():
+            if block_index not in self.blocks:
+                self.blocks[block_index] = {svtype: [] for svtype in sv.TYPES}
+                self.blocks[block_index]["_COVERAGE"] = {}
+            self.blocks[block_index]["_SAMPLE_COVERAGE"] = coverages
+
     def serialize_block(self, block_id):
         return pickle.dumps(self.blocks[block_id])
 
@@ -183,9 +200,10 @@ class SNFile:
 
         return res
 
-    def write_results(self, config: SnifflesConfig, contigs: list[str]) -> int:
+    def write_results(self, config: SnifflesConfig, contigs: list[str], **header_extra) -> int:
         """
-        Writes all added results (regional temporary .snf files) to this file. Returns SNF candidate count
+        Writes all added results (regional temporary .snf files) to this file. Returns SNF candidate count.
+        Additional keyword arguments are stored in the header.
         """
         main_index = {}
         offset = 0
@@ -203,6 +221,7 @@ class SNFile:
 
         config.contig_coverages = self._calculate_contig_coverages(contigs)
         header = {"config": config.__dict__, "index": main_index, "snf_candidate_count": snf_candidate_count}
+        header.update(header_extra)
         header_json = json.dumps(header, default=lambda obj: "<Unstored_Object>") + "\n"
         self.handle.write(header_json.encode())
 
@@ -233,6 +252,38 @@ class SNFile:
             coverage.update(b['_COVERAGE'])
         return coverage
 
+    @property
+    def sample_id(self) -> Optional[str]:
+        """
+        Sample id of a sample .snf (as used by combine), None for group and cohort .snf files
+        """
+        if self.header.get("samples") is not None:
+            return None
+        if self.header["config"].get("sample_id") is not None:
+            return self.header["config"]["sample_id"]
+        return os.path.splitext(os.path.basename(self.filename))[0]
+
+    def query(self, contig: str, start: int, end: int, svtypes: Optional[Iterable[str]] = None) -> Iterator[sv.SVCall]:
+        """
+        Candidates of contig with a position (POS) within start..end (0-based, half open), optionally only those of
+        the given SV types, in order of position. Only blocks overlapping the region are read, using the block index.
+        """
+        svtypes = sv.TYPES if svtypes is None else [svtype for svtype in sv.TYPES if svtype in svtypes]
+        contig_index = self.index.get(contig)
+        if not contig_index:
+            return
+        block_size = self.header["config"]["snf_block_size"]
+        block_indices = sorted(int(block_index) for block_index in contig_index)
+        # Candidates are stored in the block of their position
+        first = bisect.bisect_left(block_indices, ((start + 1) // block_size) * block_size)
+        for block_index in block_indices[first:]:
+            if block_index > end:
+                break
+            candidates = [cand for block in self.read_blocks(contig, block_index) or [] for svtype in svtypes
+                          for cand in block[svtype] if start < cand.pos <= end]
+            candidates.sort(key=lambda cand: cand.pos)
+            yield from candidates
+
 
 class LazySNFile(SNFile):
     """
@@ -286,3 +337,37 @@ class LazySNFile(SNFile):
 
         self._header = None
         self._index = None
+
+
+QUERY_COLUMNS = ("file", "sample", "contig", "pos", "id", "svtype", "svlen", "end", "qual", "filter", "qc", "precise",
+                 "support", "gt", "dr", "dv", "samples")
+
+
+def query(filenames: list[str], contig: str, start: int, end: int, svtypes: Optional[Iterable[str]] = None,
+          config: Namespace = None) -> Iterator[tuple[LazySNFile, sv.SVCall]]:
+    """
+    Candidates of the given region (see SNFile.query) from multiple .snf files, merged in order of position, as tuples
+    of (file, candidate). Files are opened lazily and closed after each read, so any number of files can be queried.
+    """
+    config = config or Namespace(combine_close_handles=True)
+    snf_files = [LazySNFile(config, False, filename=filename) for filename in filenames]
+
+    def file_candidates(snf_file: LazySNFile) -> Iterator[tuple[LazySNFile, sv.SVCall]]:
+        for cand in snf_file.query(contig, start, end, svtypes):
+            yield snf_file, cand
+
+    yield from heapq.merge(*(file_candidates(snf_file) for snf_file in snf_files), key=lambda item: item[1].pos)
+
+
+def query_row(snf_file: SNFile, cand: sv.SVCall) -> tuple:
+    """
+    Values of QUERY_COLUMNS for a candidate returned by query(). Genotype fields are only set for candidates of a
+    single sample, group candidates (hierarchical combine, cohorts) report the number of samples they represent.
+    """
+    gt = dr = dv = None
+    if cand.group is None and cand.genotypes and 0 in cand.genotypes:
+        a, b, _, dr, dv = cand.genotypes[0][:5]
+        gt = f"{a}/{b}"
+    return (snf_file.filename, snf_file.sample_id if cand.group is None else None, cand.contig, cand.pos, cand.id,
+            cand.svtype, cand.svlen, cand.end, cand.qual, cand.filter, cand.qc, cand.precise, cand.support, gt, dr, dv,
+            cand.weight)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+"""
+Disk-backed lead storage for --low-memory.
+
+Leads are appended to one spill file per SV type and range of --snf-block-size bp in a compact binary encoding
+while alignments are read. After all alignments of a task have been read, leads are loaded back one range at a time
+(see streaming.StreamingCaller.sweep_spilled), so only the leads of the current range and of clusters extending
+into it are held in memory.
+"""
+import os
+import shutil
+import struct
+import tempfile
+from typing import Iterator
+
+from sniffles import sv
+from sniffles.leadprov import Lead
+from sniffles.sequence import PackedSequence
+from sniffles.sv import SVCallBNDInfo
+
+# read_id, ref_start, ref_end, qry_start, qry_end, svlen, nm, mapq, flags, len(read_qname), len(contig), len(source),
+# len(seq), bits per base of seq (0: not packed), length of seq data
+LEAD_HEADER = struct.Struct("<qqqqqqdHBHHBIBI")
+BND_INFO = struct.Struct("<qBBH")
+PHASE = struct.Struct("<HH")
+
+FLAG_REVERSE = 1
+FLAG_SVLEN = 2
+FLAG_SEQ = 4
+FLAG_PHASE = 8
+FLAG_BND = 16
+
+BUFFER_SIZE = 2 ** 20
+
+
+def encode_lead(ld: Lead) -> bytes:
+    flags = FLAG_REVERSE if ld.strand == "-" else 0
+    extra = b""
+
+    read_id = ld.read_id
+    if isinstance(read_id, tuple):
+        read_id, hp, ps = read_id
+        hp, ps = hp.encode(), ps.encode()
+        flags |= FLAG_PHASE
+        extra += PHASE.pack(len(hp), len(ps)) + hp + ps
+
+    if ld.svlen is not None:
+        flags |= FLAG_SVLEN
+    seq, seq_len, seq_bits = b"", 0, 0
+    if ld.seq is not None:
+        flags |= FLAG_SEQ
+        if isinstance(ld.seq, PackedSequence):
+            seq, seq_len, seq_bits = ld.seq.data, ld.seq.length, ld.seq.bits
+        else:
+            seq = ld.seq.encode()
+            seq_len = len(seq)
+
+    bnd_info = getattr(ld, "bnd_info", None)
+    if bnd_info is not None:
+        flags |= FLAG_BND
+        mate_contig = bnd_info.mate_contig.encode()
+        extra += BND_INFO.pack(bnd_info.mate_ref_start, bnd_info.is_first, bnd_info.is_reverse, len(mate_contig)) + mate_contig
+
+    qname, contig, source = ld.read_qname.encode(), ld.contig.encode(), ld.source.encode()
+    return LEAD_HEADER.pack(read_id, ld.ref_start, ld.ref_end, ld.qry_start, ld.qry_end, ld.svlen or 0, ld.nm, ld.mapq, flags,
+                            len(qname), len(contig), len(source), seq_len, seq_bits, len(seq)) + qname + contig + source + seq + extra
+
+
+def decode_leads(data: bytes, svtype: str) -> Iterator[Lead]:
+    offset = 0
+    while offset < len(data):
+        (read_id, ref_start, ref_end, qry_start, qry_end, svlen, nm, mapq, flags,
+         qname_len, contig_len, source_len, seq_len, seq_bits, seq_data_len) = LEAD_HEADER.unpack_from(data, offset)
+        offset += LEAD_HEADER.size
+        qname = data[offset:offset + qname_len].decode()
+        offset += qname_len
+        contig = data[offset:offset + contig_len].decode()
+        offset += contig_len
+        source = data[offset:offset + source_len].decode()
+        offset += source_len
+        seq = None
+        if flags & FLAG_SEQ:
+            seq_data = bytes(data[offset:offset + seq_data_len])
+            seq = PackedSequence(seq_data, seq_len, seq_bits) if seq_bits else seq_data.decode()
+        offset += seq_data_len
+
+        if flags & FLAG_PHASE:
+            hp_len, ps_len = PHASE.unpack_from(data, offset)
+            offset += PHASE.size
+            hp = data[offset:offset + hp_len].decode()
+            offset += hp_len
+            ps = data[offset:offset + ps_len].decode()
+            offset += ps_len
+            read_id = (read_id, hp, ps)
+
+        ld = Lead(read_id, qname, contig, ref_start, ref_end, qry_start, qry_end, "-" if flags & FLAG_REVERSE else "+",
+                  mapq, nm, source, svtype, svlen if flags & FLAG_SVLEN else None, seq)
+
+        if flags & FLAG_BND:
+            mate_ref_start, is_first, is_reverse, mate_contig_len = BND_INFO.unpack_from(data, offset)
+            offset += BND_INFO.size
+            mate_contig = data[offset:offset + mate_contig_len].decode()
+            offset += mate_contig_len
+            ld.bnd_info = SVCallBNDInfo(mate_contig=mate_contig, mate_ref_start=mate_ref_start, is_first=bool(is_first),
+                                        is_reverse=bool(is_reverse))
+        yield ld
+
+
+class LeadSpill:
+    """
+    Append-only store of the leads of one task, partitioned into spill files by SV type and range
+    """
+    def __init__(self, config):
+        self.config = config
+        self.range_size = config.snf_block_size
+        self.directory = tempfile.mkdtemp(prefix="sniffles_leads_")
+        self.buffers = {}  # (svtype, range index) -> bytearray
+        self.ranges = set()
+
+    def filename(self, svtype: str, range_index: int) -> str:
+        return os.path.join(self.directory, f"{svtype}_{range_index}.leads")
+
+    def record(self, ld: Lead, pos_leadtab: int):
+        key = (ld.svtype, pos_leadtab // self.range_size)
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = bytearray()
+            self.ranges.add(key[1])
+        buffer += encode_lead(ld)
+        if len(buffer) >= BUFFER_SIZE:
+            self.write(key)
+
+    def write(self, key: tuple[str, int]):
+        with open(self.filename(*key), "ab") as handle:
+            handle.write(self.buffers.pop(key))
+
+    def iter_ranges(self) -> Iterator[tuple[int, dict[str, dict[int, list[Lead]]]]]:
+        """
+        Load leads back one range at a time, in order. Yields the end of each range and the leadtab of each SV type
+        for that range (bin -> leads, in the order they were recorded). Loaded spill files are removed.
+        """
+        binsize = self.config.cluster_binsize
+        max_reads_bin = self.config.consensus_max_reads_bin
+        for range_index in sorted(self.ranges):
+            leadtab = {}
+            for svtype in sv.TYPES:
+                key = (svtype, range_index)
+                data = bytearray()
+                if os.path.exists(self.filename(*key)):
+                    with open(self.filename(*key), "rb") as handle:
+                        data += handle.read()
+                    os.remove(self.filename(*key))
+                data += self.buffers.pop(key, b"")
+
+                leadtab_svtype = leadtab[svtype] = {}
+                for ld in decode_leads(data, svtype):
+                    pos_leadtab = int(ld.ref_start / binsize) * binsize
+                    if pos_leadtab in leadtab_svtype:
+                        leadtab_svtype[pos_leadtab].append(ld)
+                        if len(leadtab_svtype[pos_leadtab]) > max_reads_bin:
+                            ld.seq = None
+                    else:
+                        leadtab_svtype[pos_leadtab] = [ld]
+            yield (range_index + 1) * self.range_size, leadtab
+
+    def close(self):
+        self.buffers.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
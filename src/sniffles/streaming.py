@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+"""
+Streaming (sweep-line) SV calling for a task, enabled by --stream-window.
+
+Alignments are coordinate sorted, so leads recorded more than --stream-window bp behind the current read can be
+clustered while reads are still being processed. Clusters that can no longer be merged with clusters further
+downstream (see cluster.closed_cluster_count) are called and their leads released. Calls are annotated as soon as
+all coverage bins they request are behind the current read, which releases the leads of their clusters as well. Peak
+memory of a task is therefore determined by the local read density, not the task length.
+
+Results are identical to non-streaming calling, except for leads that are recorded more than --stream-window bp
+behind the read they were extracted from (e.g. split alignments of very large SVs), which are clustered separately
+if the bins they belong to have already been called.
+
+With --low-memory, leads are stored on disk instead (see sniffles.spill) and swept in the same way once all
+alignments have been read, which gives identical results.
+"""
+import logging
+import math
+
+from sniffles import cluster
+from sniffles import postprocessing
+from sniffles import sv
+from sniffles.sv import SVCall
+
+log = logging.getLogger(__name__)
+
+
+class CoverageCursor:
+    """
+    Incremental lookup of coverages from the coverage tables of a lead provider, for bins behind the current read.
+    Running totals are checkpointed every checkpoint_bins bins, so lookups never have to walk the tables from the
+    start.
+    """
+    def __init__(self, lead_provider, config, checkpoint_bins: int = 100):
+        self.lead_provider = lead_provider
+        self.binsize = config.coverage_binsize
+        self.checkpoint_size = checkpoint_bins * self.binsize
+        self.start_bin = lead_provider.covrtab_min_bin
+        self.next_bin = self.start_bin
+        self.total = 0
+        self.checkpoints = {}
+
+    @property
+    def end_bin(self) -> int:
+        return int(self.lead_provider.end / self.binsize) * self.binsize
+
+    def delta(self, bin_index: int) -> int:
+        return self.lead_provider.covrtab_fwd.get(bin_index, 0) + self.lead_provider.covrtab_rev.get(bin_index, 0)
+
+    def advance(self, pos: int):
+        """
+        Accumulate coverage of all bins before pos, which must not change anymore
+        """
+        limit = min(int(pos / self.binsize) * self.binsize, self.end_bin + self.binsize)
+        while self.next_bin < limit:
+            if (self.next_bin - self.start_bin) % self.checkpoint_size == 0:
+                self.checkpoints[self.next_bin] = self.total
+            self.total += self.delta(self.next_bin)
+            self.next_bin += self.binsize
+
+    def get(self, bin_index: int) -> int:
+        checkpoint = self.start_bin + (bin_index - self.start_bin) // self.checkpoint_size * self.checkpoint_size
+        total = self.checkpoints[checkpoint]
+        for b in range(checkpoint, bin_index + self.binsize, self.binsize):
+            total += self.delta(b)
+        return total
+
+    def fulfill(self, requests_for_coverage: dict):
+        """
+        Set coverages of requests (as built by postprocessing.coverage_build_requests) behind the cursor
+        """
+        end_bin = self.end_bin
+        for bin_index, requests in requests_for_coverage.items():
+            if self.start_bin <= bin_index <= end_bin:
+                coverage_total = self.get(bin_index)
+                for svcall, field in requests:
+                    setattr(svcall, field, coverage_total)
+
+
+class StreamingCaller:
+    """
+    Clusters, calls and annotates SVs of a task while its leads are being recorded
+    """
+    def __init__(self, task, keep_qc_fails: bool, owned_only: bool):
+        self.task = task
+        self.config = task.config
+        self.keep_qc_fails = keep_qc_fails
+        self.owned_only = owned_only
+        self.first_sv_id = task.sv_id
+
+        # The regional NM threshold is only known after all reads of a task have been processed, so NM based QC is not
+        # available while streaming. Leads swept from the spill (sweep_spilled) use the threshold of the task.
+        self.qc_nm_threshold = 0.0
+
+        self.candidates = {svtype: [] for svtype in sv.TYPES}
+        self.pending = []  # (call, requests for coverage) waiting for their coverage bins to be complete
+        self.qc_passed = {}  # id(call) -> QC result before the support check, for annotated calls
+        self.called_until = {svtype: None for svtype in sv.TYPES}
+        self.late_bins = 0
+        self.coverage = None
+
+    def flush(self, read_start: int):
+        """
+        Call all clusters that can no longer change and annotate all calls with complete coverage before read_start
+        """
+        self.call_closed(read_start - self.config.stream_window)
+        self.advance_coverage(read_start)
+        self.annotate_ready()
+
+    def call_closed(self, frontier: float):
+        """
+        Call all clusters of leads before frontier that can not be merged with leads after frontier anymore
+        """
+        config = self.config
+        lead_provider = self.task.lead_provider
+
+        for svtype in sv.TYPES:
+            leadtab = lead_provider.leadtab[svtype]
+            seeds = sorted(seed for seed in leadtab if seed + config.cluster_binsize <= frontier)
+            if len(seeds) == 0:
+                continue
+
+            called_until = self.called_until[svtype]
+            if called_until is not None:
+                self.late_bins += sum(1 for seed in seeds if seed < called_until)
+
+            clusters = cluster.build_clusters(svtype, lead_provider, config, self.task.tandem_repeats, seeds)
+            closed = cluster.closed_cluster_count(svtype, clusters, frontier, config)
+            if closed == 0:
+                continue
+
+            self.called_until[svtype] = clusters[closed - 1].end
+            for seed in seeds:
+                if seed >= clusters[closed - 1].end:
+                    break
+                del leadtab[seed]
+
+            for svcluster in clusters[:closed]:
+                for split_cluster in cluster.split(svtype, svcluster, config):
+                    for svcall in sv.call_from(split_cluster, config, self.keep_qc_fails, self.task):
+                        self.add(svcall)
+
+    def sweep_spilled(self):
+        """
+        Call and annotate SVs from leads stored on disk, after all alignments have been read, one range at a time
+        """
+        lead_provider = self.task.lead_provider
+        self.qc_nm_threshold = self.config.average_regional_nm  # Set by build_leadtab
+        self.advance_coverage(lead_provider.end + self.config.coverage_binsize)
+        for range_end, leadtab in lead_provider.spill.iter_ranges():
+            for svtype, bins in leadtab.items():
+                lead_provider.leadtab[svtype].update(bins)
+            self.call_closed(range_end)
+            self.annotate_ready()
+
+    def advance_coverage(self, pos: int):
+        if self.coverage is None:
+            self.coverage = CoverageCursor(self.task.lead_provider, self.config)
+        self.coverage.advance(pos)
+
+    def add(self, svcall: SVCall):
+        self.candidates[svcall.svtype].append(svcall)
+        if self.owned_only and not self.task.owns(svcall.pos):
+            svcall.finalize()
+        else:
+            self.pending.append((svcall, postprocessing.coverage_build_requests([svcall], self.config)))
+
+    def annotate_ready(self, final: bool = False):
+        """
+        Annotate all pending calls whose coverage bins are complete (all calls if final), releasing their leads
+        """
+        ready, pending = [], []
+        for svcall, requests in self.pending:
+            (ready if final or max(requests) < self.coverage.next_bin else pending).append((svcall, requests))
+        self.pending = pending
+
+        config = self.config
+        for svcall, requests in ready:
+            self.coverage.fulfill(requests)
+
+            # The support check requires the average coverage of the whole task and is done in finish()
+            svcall.qc = svcall.qc and postprocessing.qc_sv(svcall, config)
+            if self.keep_qc_fails or svcall.qc:
+                qc = svcall.qc
+                postprocessing.annotate_sv(svcall, config)
+                svcall.qc = svcall.qc and postprocessing.qc_sv_post_annotate(svcall, config, self.qc_nm_threshold)
+                self.qc_passed[id(svcall)] = qc
+            svcall.finalize()
+
+    def finish(self) -> tuple[list[SVCall], list[SVCall]]:
+        """
+        Call and annotate all remaining leads. Returns all candidates and the calls passing QC (or all annotated calls
+        if QC fails are kept), in the same order and with the same ids as in non-streaming calling.
+        """
+        self.call_closed(math.inf)
+        self.advance_coverage(self.task.lead_provider.end + self.config.coverage_binsize)
+        self.annotate_ready(final=True)
+
+        if self.late_bins:
+            log.debug(f"{self.task}: {self.late_bins} lead bins were recorded after being called")
+
+        task = self.task
+        candidates = [svcall for svtype in sv.TYPES for svcall in self.candidates[svtype]]
+        for sv_id, svcall in enumerate(candidates, self.first_sv_id):
+            svcall.id = f"{svcall.svtype}.{sv_id:X}S{task.id:X}"
+        task.sv_id = self.first_sv_id + len(candidates)
+
+        task.coverage_average_fwd, task.coverage_average_rev = postprocessing.coverage(candidates, task.lead_provider, self.config)
+        task.coverage_average_total = task.coverage_average_fwd + task.coverage_average_rev
+
+        if self.owned_only:
+            candidates = [svcall for svcall in candidates if task.owns(svcall.pos)]
+
+        passed = []
+        for svcall in candidates:
+            qc = self.qc_passed.get(id(svcall))
+            if qc is None:
+                continue
+            if qc and not postprocessing.qc_sv_support(svcall, task.coverage_average_total, self.config):
+                svcall.qc = False
+            if not self.keep_qc_fails and not svcall.qc:
+                continue
+            passed.append(svcall)
+        return candidates, passed
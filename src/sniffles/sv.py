@@ -9,6 +9,8 @@
 # Contact:     sniffles@romanek.at
 #
 import logging
+import math
+import sys
 from dataclasses import dataclass
 from typing import Optional, Callable
 
@@ -19,6 +21,7 @@ except ImportError:
     align: Optional[Callable] = None
 
 from sniffles import util
+from sniffles.sequence import ReadSequence
 
 TYPES = ["INS", "DEL", "DUP", "INV", "BND"]
 
@@ -36,6 +39,124 @@ class SVCallPostprocessingInfo:
     cluster: list
 
 
+@dataclass
+class SVGroupSummary:
+    """
+    Aggregated statistics of an SVGroup, stored in intermediate group .snf files for hierarchical combine.
+    Sums are kept instead of per-candidate values, so merging summaries of summaries stays exact for means and
+    standard deviations - only median based values are approximated by the representative candidate.
+    """
+    samples: set
+    coverages_nonincluded: dict
+    count: int
+    pass_count: int
+    pass_filter: bool
+    precise_count: int
+    support_sum: int
+    qual_sum: int
+    pos_sum: int
+    pos_sqsum: int
+    len_sum: int
+    len_sqsum: int
+    len_abs_sum: int
+    bnd_mate_ref_start_sum: int = 0
+    coverage_sums: tuple = (0, 0, 0, 0, 0)
+    coverage_counts: tuple = (0, 0, 0, 0, 0)
+
+    COVERAGE_FIELDS = ("coverage_upstream", "coverage_start", "coverage_center", "coverage_end", "coverage_downstream")
+
+    @classmethod
+    def from_candidate(cls, candidate: "SVCall") -> "SVGroupSummary":
+        """
+        Summary of a single (non-group) candidate
+        """
+        if candidate.group is not None:
+            return candidate.group
+
+        coverages = [getattr(candidate, field) for field in cls.COVERAGE_FIELDS]
+        return cls(
+            samples={candidate.sample_internal_id},
+            coverages_nonincluded=dict(),
+            count=1,
+            pass_count=int(candidate.qc),
+            pass_filter=candidate.qc and candidate.filter == "PASS",
+            precise_count=int(candidate.precise),
+            support_sum=candidate.support,
+            qual_sum=int(candidate.qual),
+            pos_sum=candidate.pos,
+            pos_sqsum=candidate.pos ** 2,
+            len_sum=candidate.svlen,
+            len_sqsum=candidate.svlen ** 2,
+            len_abs_sum=abs(candidate.svlen),
+            bnd_mate_ref_start_sum=candidate.bnd_info.mate_ref_start if candidate.svtype == "BND" else 0,
+            coverage_sums=tuple(c if c is not None else 0 for c in coverages),
+            coverage_counts=tuple(int(c is not None) for c in coverages),
+        )
+
+    @classmethod
+    def merge(cls, summaries: list["SVGroupSummary"]) -> "SVGroupSummary":
+        obj = cls(
+            samples=set(),
+            coverages_nonincluded=dict(),
+            count=0,
+            pass_count=0,
+            pass_filter=False,
+            precise_count=0,
+            support_sum=0,
+            qual_sum=0,
+            pos_sum=0,
+            pos_sqsum=0,
+            len_sum=0,
+            len_sqsum=0,
+            len_abs_sum=0,
+        )
+        coverage_sums = [0] * len(cls.COVERAGE_FIELDS)
+        coverage_counts = [0] * len(cls.COVERAGE_FIELDS)
+        for summary in summaries:
+            obj.samples |= summary.samples
+            for sample_internal_id, coverage in summary.coverages_nonincluded.items():
+                obj.coverages_nonincluded[sample_internal_id] = max(coverage, obj.coverages_nonincluded.get(sample_internal_id, 0))
+            obj.count += summary.count
+            obj.pass_count += summary.pass_count
+            obj.pass_filter = obj.pass_filter or summary.pass_filter
+            obj.precise_count += summary.precise_count
+            obj.support_sum += summary.support_sum
+            obj.qual_sum += summary.qual_sum
+            obj.pos_sum += summary.pos_sum
+            obj.pos_sqsum += summary.pos_sqsum
+            obj.len_sum += summary.len_sum
+            obj.len_sqsum += summary.len_sqsum
+            obj.len_abs_sum += summary.len_abs_sum
+            obj.bnd_mate_ref_start_sum += summary.bnd_mate_ref_start_sum
+            for i in range(len(coverage_sums)):
+                coverage_sums[i] += summary.coverage_sums[i]
+                coverage_counts[i] += summary.coverage_counts[i]
+        obj.coverage_sums = tuple(coverage_sums)
+        obj.coverage_counts = tuple(coverage_counts)
+        return obj
+
+    @staticmethod
+    def _stdev(n, total, sqtotal) -> float:
+        if n < 2:
+            return 0
+        # Sums are ints: computed exactly, as subtracting the (large) float terms would cancel most of the precision
+        return math.sqrt(max(0, (n * sqtotal - total * total) / (n * (n - 1))))
+
+    @property
+    def stdev_pos(self) -> float:
+        return self._stdev(self.count, self.pos_sum, self.pos_sqsum)
+
+    @property
+    def stdev_len(self) -> float:
+        return self._stdev(self.count, self.len_sum, self.len_sqsum)
+
+    def coverage_mean(self, field: str) -> Optional[int]:
+        i = self.COVERAGE_FIELDS.index(field)
+        if self.coverage_counts[i] == 0:
+            return None
+        return round(self.coverage_sums[i] / self.coverage_counts[i])
+
+
 @dataclass
 class SVCall:
     contig: str
@@ -75,6 +196,8 @@ class SVCall:
     raw_vcf_line: Optional[str] = None
     raw_vcf_line_index: Optional[int] = None
 
+    group: Optional[SVGroupSummary] = None
+
     _counter = 0
 
     def set_info(self, k, v):
@@ -89,6 +212,112 @@ class SVCall:
     def finalize(self):
         self.postprocess = None
 
+    @property
+    def samples(self) -> set:
+        """
+        Internal ids of all samples this candidate represents (more than one for hierarchical combine group candidates)
+        """
+        return self.group.samples if self.group is not None else {self.sample_internal_id}
+
+    @property
+    def weight(self) -> int:
+        """
+        Number of sample candidates this candidate represents
+        """
+        return self.group.count if self.group is not None else 1
+
+
+class SVCandidate:
+    """
+    Compact form of an SVCall read from a .snf for combining, holding only the fields needed for grouping and calling
+    groups (see SVGroup). Combine keeps the candidates of all samples for the active blocks, so these use slots
+    instead of an instance dict, drop the INFO fields and postprocessing data of the original call, and store the
+    single genotype of a sample candidate as a tuple. INFO is only created when it is accessed.
+    """
+    __slots__ = ("contig", "pos", "id", "alt", "qual", "filter", "svtype", "svlen", "end", "precise", "support",
+                 "rnames", "qc", "fwd", "rev", "coverage_upstream", "coverage_downstream", "coverage_start",
+                 "coverage_center", "coverage_end", "sample_internal_id", "bnd_info", "group", "_genotypes", "_info")
+
+    ref = "N"
+    nm = -1
+    postprocess = None
+
+    def __init__(self, contig: str, pos: int, id: str, alt: str, qual: int, filter: str, svtype: str, svlen: int,
+                 end: int, genotypes: dict[int, tuple], precise: bool, support: int, rnames: Optional[list[str]],
+                 qc: bool, fwd: int, rev: int, coverage_upstream: int, coverage_downstream: int, coverage_start: int,
+                 coverage_center: int, coverage_end: int, sample_internal_id: Optional[int],
+                 bnd_info: Optional[SVCallBNDInfo], group: Optional[SVGroupSummary]):
+        self.contig = contig
+        self.pos = pos
+        self.id = id
+        self.alt = alt
+        self.qual = qual
+        self.filter = sys.intern(filter)
+        self.svtype = sys.intern(svtype)
+        self.svlen = svlen
+        self.end = end
+        self.precise = precise
+        self.support = support
+        self.rnames = rnames
+        self.qc = qc
+        self.fwd = fwd
+        self.rev = rev
+        self.coverage_upstream = coverage_upstream
+        self.coverage_downstream = coverage_downstream
+        self.coverage_start = coverage_start
+        self.coverage_center = coverage_center
+        self.coverage_end = coverage_end
+        self.sample_internal_id = sample_internal_id
+        self.bnd_info = bnd_info if svtype == "BND" else None
+        self.group = group
+        if group is None:
+            # Sample candidates carry the genotype of their sample only
+            genotype = genotypes.get(0) if genotypes else None
+            self._genotypes = genotype if genotype is not None else (".", ".", 0, 0, support, (None, None))
+        else:
+            self._genotypes = genotypes
+        self._info = None
+
+    @classmethod
+    def from_call(cls, call: SVCall, sample_internal_id: Optional[int] = None) -> "SVCandidate":
+        """
+        Compact candidate for call, assigning sample_internal_id to sample candidates
+        """
+        if call.group is None and sample_internal_id is not None:
+            call.sample_internal_id = sample_internal_id
+        return cls(contig=call.contig, pos=call.pos, id=call.id, alt=call.alt, qual=call.qual, filter=call.filter,
+                   svtype=call.svtype, svlen=call.svlen, end=call.end, genotypes=call.genotypes, precise=call.precise,
+                   support=call.support, rnames=call.rnames, qc=call.qc, fwd=call.fwd, rev=call.rev,
+                   coverage_upstream=call.coverage_upstream, coverage_downstream=call.coverage_downstream,
+                   coverage_start=call.coverage_start, coverage_center=call.coverage_center,
+                   coverage_end=call.coverage_end, sample_internal_id=call.sample_internal_id,
+                   bnd_info=call.bnd_info, group=call.group)
+
+    @property
+    def genotypes(self) -> dict[int, tuple]:
+        return self._genotypes if self.group is not None else {0: self._genotypes}
+
+    @property
+    def info(self) -> dict:
+        if self._info is None:
+            self._info = {}
+        return self._info
+
+    def set_info(self, k, v):
+        self.info[k] = v
+
+    def get_info(self, k):
+        return self._info.get(k) if self._info is not None else None
+
+    def has_info(self, k):
+        return self._info is not None and k in self._info
+
+    samples = SVCall.samples
+    weight = SVCall.weight
+
+    def __repr__(self):
+        return f"SVCandidate({self.contig}:{self.pos} {self.svtype} {self.svlen} id={self.id})"
+
 
 @dataclass
 class SVGroup:
@@ -102,6 +331,7 @@ class SVGroup:
     coverages_nonincluded: dict
 
     bnd_mate_ref_start_mean: float = None
+    weight: int = 1
 
     # _pos_mean: float = None
     # _len_mean: float = None
@@ -132,6 +362,21 @@ class SVGroup:
         """
         Start a new group from given candidate.
         """
+        if candidate.group is not None:
+            summary = candidate.group
+            obj = cls(
+                candidates=[candidate],
+                pos_mean=summary.pos_sum / summary.count,
+                len_mean=summary.len_abs_sum / summary.count,
+                included_samples=set(summary.samples),
+                coverages_nonincluded=dict(summary.coverages_nonincluded),
+                weight=summary.count,
+            )
+            if candidate.svtype == "BND":
+                obj.bnd_mate_contig = candidate.bnd_info.mate_contig
+                obj.bnd_mate_ref_start_mean = summary.bnd_mate_ref_start_sum / summary.count
+            return obj
+
         obj = cls(
             candidates=[candidate],
             pos_mean=float(candidate.pos),
@@ -164,52 +409,64 @@ class SVGroup:
     def add_candidate(self, candidate: SVCall):
         """
         Adds a candidate to this group, updating mean position, length
-        and optionally bnd ref start.
+        and optionally bnd ref start. Group candidates (hierarchical combine) are weighted by the number of
+        sample candidates they represent.
         """
-        group_size = len(self.candidates)
+        group_size = self.weight
+        summary = candidate.group
         self.pos_mean *= group_size
         self.len_mean *= group_size
-        self.pos_mean += candidate.pos
-        self.len_mean += abs(candidate.svlen)
+        if summary is None:
+            self.pos_mean += candidate.pos
+            self.len_mean += abs(candidate.svlen)
+        else:
+            self.pos_mean += summary.pos_sum
+            self.len_mean += summary.len_abs_sum
         if candidate.svtype == "BND":
             self.bnd_mate_ref_start_mean *= group_size
-            self.bnd_mate_ref_start_mean += candidate.bnd_info.mate_ref_start
+            if summary is None:
+                self.bnd_mate_ref_start_mean += candidate.bnd_info.mate_ref_start
+            else:
+                self.bnd_mate_ref_start_mean += summary.bnd_mate_ref_start_sum
 
         self.candidates.append(candidate)
-        group_size += 1
+        group_size += candidate.weight
+        self.weight = group_size
         self.pos_mean /= group_size
         self.len_mean /= group_size
-        self.included_samples.add(candidate.sample_internal_id)
+        if summary is None:
+            self.included_samples.add(candidate.sample_internal_id)
+        else:
+            self.included_samples |= summary.samples
+            for sample_internal_id, coverage in summary.coverages_nonincluded.items():
+                self.coverages_nonincluded[sample_internal_id] = max(coverage, self.coverages_nonincluded.get(sample_internal_id, 0))
 
         if candidate.svtype == "BND":
             self.bnd_mate_ref_start_mean /= group_size
 
-    def call(self, config, task) -> Optional[SVCall]:
+    @property
+    def has_group_candidates(self) -> bool:
+        return any(cand.group is not None for cand in self.candidates)
+
+    def merge_genotypes(self, config) -> dict[int, tuple]:
         """
-        Call this group, returning either an SVCall or None.
+        Genotypes of all included samples, merging multiple candidates of the same sample (intra-sample merging)
         """
-        first_cand = self.candidates[0]
-
-        # Filtering
-        samples_count = float(len(config.snf_input_info))
-        sample_internal_ids = set(sample["internal_id"] for sample in config.snf_input_info)
-        total_count = len(self.included_samples)
-        pass_count = sum(cand.qc for cand in self.candidates)
-        qc = (pass_count > 0 and pass_count / samples_count >= config.combine_high_confidence) or (
-                    total_count / samples_count >= config.combine_low_confidence and total_count >= config.combine_low_confidence_abs)
-
-        if not qc:
-            return None
-
-        if (not config.combine_output_filtered) and not any(cand.qc and cand.filter == "PASS" for cand in self.candidates):
-            return None
-
-        rnames = [] if config.output_rnames else None
         genotypes = {}
 
         for cand in self.candidates:
-            if rnames is not None and cand.rnames is not None:
-                rnames.extend(cand.rnames)
+            if cand.group is not None:
+                for sample_internal_id, (a, b, gt_qual, dr, dv, ps, svid) in cand.genotypes.items():
+                    if sample_internal_id in genotypes:
+                        curr_a, curr_b, curr_gt_qual, curr_dr, curr_dv, curr_ps, curr_id = genotypes[sample_internal_id]
+                        new_id = curr_id + "," + svid
+                        if (curr_a == ".") or (a != "." and (a, b) >= (curr_a, curr_b)):
+                            genotypes[sample_internal_id] = (a, b, gt_qual, dr, dv, ps, new_id)
+                        else:
+                            genotypes[sample_internal_id] = (curr_a, curr_b, curr_gt_qual, curr_dr, curr_dv, curr_ps, new_id)
+                    else:
+                        genotypes[sample_internal_id] = (a, b, gt_qual, dr, dv, ps, svid)
+                continue
 
             if 0 not in cand.genotypes:
                 cand.genotypes[0] = (".", ".", 0, 0, cand.support, (None, None))
@@ -226,6 +483,93 @@ class SVGroup:
                 a, b, gt_qual, dr, dv, ps = cand.genotypes[0]
                 genotypes[cand.sample_internal_id] = (a, b, gt_qual, dr, dv, ps, config.id_prefix + cand.id)
 
+        return genotypes
+
+    def summarize(self, config) -> SVCall:
+        """
+        Reduce this group to a single group candidate for an intermediate group .snf (hierarchical combine).
+        No filtering is applied, as this depends on the total number of samples.
+        """
+        first_cand = self.candidates[0]
+        summary = SVGroupSummary.merge([SVGroupSummary.from_candidate(cand) for cand in self.candidates])
+        summary.samples = set(self.included_samples)
+        summary.coverages_nonincluded = {
+            sample_internal_id: coverage for sample_internal_id, coverage in self.coverages_nonincluded.items()
+            if sample_internal_id not in self.included_samples
+        }
+
+        rnames = None
+        if config.output_rnames:
+            rnames = []
+            for cand in self.candidates:
+                if cand.rnames is not None:
+                    rnames.extend(cand.rnames)
+
+        return SVCall(contig=first_cand.contig,
+                      pos=first_cand.pos,
+                      id=first_cand.id,
+                      ref="N",
+                      alt=first_cand.alt,
+                      qual=round(summary.qual_sum / summary.count),
+                      filter="PASS" if summary.pass_filter else first_cand.filter,
+                      info=dict(),
+                      svtype=first_cand.svtype,
+                      svlen=first_cand.svlen,
+                      end=first_cand.end,
+                      genotypes=self.merge_genotypes(config),
+                      precise=summary.precise_count / float(summary.count) > 0.5,
+                      support=round(summary.support_sum / summary.count),
+                      rnames=rnames,
+                      postprocess=None,
+                      qc=summary.pass_count > 0,
+                      nm=-1,
+                      fwd=sum(cand.fwd for cand in self.candidates),
+                      rev=sum(cand.rev for cand in self.candidates),
+                      coverage_upstream=summary.coverage_mean("coverage_upstream"),
+                      coverage_start=summary.coverage_mean("coverage_start"),
+                      coverage_center=summary.coverage_mean("coverage_center"),
+                      coverage_end=summary.coverage_mean("coverage_end"),
+                      coverage_downstream=summary.coverage_mean("coverage_downstream"),
+                      bnd_info=first_cand.bnd_info,
+                      group=summary)
+
+    def call(self, config, task) -> Optional[SVCall]:
+        """
+        Call this group, returning either an SVCall or None.
+        """
+        first_cand = self.candidates[0]
+
+        # Filtering
+        samples_count = float(len(config.snf_input_info))
+        sample_internal_ids = set(sample["internal_id"] for sample in config.snf_input_info)
+        total_count = len(self.included_samples)
+        # Group candidates from hierarchical combine carry aggregated statistics instead of single candidate values
+        summary = SVGroupSummary.merge([SVGroupSummary.from_candidate(cand) for cand in self.candidates]) if self.has_group_candidates else None
+        if summary is None:
+            pass_count = sum(cand.qc for cand in self.candidates)
+        else:
+            pass_count = summary.pass_count
+        qc = (pass_count > 0 and pass_count / samples_count >= config.combine_high_confidence) or (
+                    total_count / samples_count >= config.combine_low_confidence and total_count >= config.combine_low_confidence_abs)
+
+        if not qc:
+            return None
+
+        if summary is None:
+            pass_filter = any(cand.qc and cand.filter == "PASS" for cand in self.candidates)
+        else:
+            pass_filter = summary.pass_filter
+        if (not config.combine_output_filtered) and not pass_filter:
+            return None
+
+        rnames = [] if config.output_rnames else None
+        if rnames is not None:
+            for cand in self.candidates:
+                if cand.rnames is not None:
+                    rnames.extend(cand.rnames)
+
+        genotypes = self.merge_genotypes(config)
+
         for sample_internal_id in sample_internal_ids:
             if sample_internal_id in genotypes:
                 continue
@@ -306,8 +650,17 @@ class SVGroup:
                         coverage_end=util.mean_or_none_round(cand.coverage_end for cand in self.candidates if cand.coverage_end is not None),
                         coverage_downstream=util.mean_or_none_round(cand.coverage_downstream for cand in self.candidates if cand.coverage_downstream is not None))
 
-        svcall.set_info("STDEV_POS", util.stdev(cand.pos for cand in self.candidates))
-        svcall.set_info("STDEV_LEN", util.stdev(cand.svlen for cand in self.candidates))
+        if summary is None:
+            svcall.set_info("STDEV_POS", util.stdev(cand.pos for cand in self.candidates))
+            svcall.set_info("STDEV_LEN", util.stdev(cand.svlen for cand in self.candidates))
+        else:
+            svcall.qual = round(summary.qual_sum / summary.count)
+            svcall.precise = summary.precise_count / float(summary.count) > 0.5
+            svcall.support = round(summary.support_sum / summary.count)
+            for field in SVGroupSummary.COVERAGE_FIELDS:
+                setattr(svcall, field, summary.coverage_mean(field))
+            svcall.set_info("STDEV_POS", summary.stdev_pos)
+            svcall.set_info("STDEV_LEN", summary.stdev_len)
 
         if abs(svcall.svlen) < config.minsvlen_screen:
             return None
@@ -469,7 +822,9 @@ def call_groups(svgroups: list[SVGroup], config, task):
             yield svcall
 
 
-def classify_splits(read, leads, config, main_contig):
+def classify_splits(read, leads, config, main_contig, read_seq: ReadSequence = None):
+    if read_seq is None:
+        read_seq = ReadSequence(read)
     minsvlen_screen = config.minsvlen_screen
     maxsvlen_other = minsvlen_screen * config.dev_split_max_query_distance_mult
     min_split_len_bnd = config.bnd_min_split_length
@@ -500,7 +855,7 @@ def classify_splits(read, leads, config, main_contig):
                     svstart = curr.ref_start
                     svlen = (curr.qry_start - last.qry_end)
                     if svlen <= config.dev_seq_cache_maxlen:
-                        curr.seq = read.query_sequence[last.qry_end:curr.qry_start]
+                        curr.seq = read_seq.slice(last.qry_end, curr.qry_start)
                     else:
                         curr.seq = None
                     curr.svtypes_starts_lens.append(("INS", svstart, svlen))
@@ -512,7 +867,7 @@ def classify_splits(read, leads, config, main_contig):
                     svstart = last.ref_start
                     svlen = (curr.qry_start - last.qry_end)
                     if svlen <= config.dev_seq_cache_maxlen:
-                        curr.seq = read.query_sequence[last.qry_end:curr.qry_start]
+                        curr.seq = read_seq.slice(last.qry_end, curr.qry_start)
                     else:
                         curr.seq = None
                     curr.svtypes_starts_lens.append(("INS", svstart, svlen))
@@ -9,8 +9,10 @@
 # Contact:     sniffles@romanek.at
 #
 
+import queue
 import statistics
 import sys
+import threading
 import time
 
 
@@ -114,6 +116,49 @@ def fatal_error_main(msg):
     raise Sniffles2Exit
 
 
+def prefetch(iterable, size: int, chunk_size: int = 64):
+    """
+    Iterate over iterable in a background thread, keeping up to size items buffered ahead of the consumer. Items are
+    passed in chunks to keep queue overhead low. Exceptions of the background thread are raised to the consumer.
+    """
+    chunks = queue.Queue(maxsize=max(1, size // chunk_size))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            chunk = []
+            for item in iterable:
+                chunk.append(item)
+                if len(chunk) >= chunk_size:
+                    if not put(chunk):
+                        return
+                    chunk = []
+            put(chunk)
+            put(None)
+        except Exception as ex:
+            put(ex)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while (chunk := chunks.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield from chunk
+    finally:
+        stop.set()
+        thread.join()
+
+
 def load_tandem_repeats(filename, padding):
     contigs_tr = {}
     unsorted = False
@@ -9,6 +9,8 @@
 # Contact:     sniffles@romanek.at
 #
 import logging
+import math
+from typing import Optional
 
 import pysam
 import os
@@ -72,6 +74,155 @@ def format_genotype(gt):
             else f"{a}{gt_sep}{b}:{qual}:{dr}:{dv}:{ps}:{svid}"
 
 
+# INFO keys of input SVs used for genotyping, all other keys are not parsed
+GENOTYPE_INFO_KEYS = ("SVTYPE", "SVLEN", "END")
+
+
+def annotate_samples(call: sv.SVCall, config: SnifflesConfig):
+    """
+    For multi-sample output, set allele count (AC) and support vector (SUPP_VEC) of call and filter calls without
+    any supported non-reference genotype (FILTER GT)
+    """
+    if len(config.sample_ids_vcf) < 2:
+        return
+    ac = 0  # Allele count
+    supvec = []
+    for internal_id, _ in config.sample_ids_vcf:
+        gt = call.genotypes.get(internal_id) if call.genotypes else None
+        if gt is not None and gt[0] != "." and gt[4] > 0:  # Not non-genotype and has supporting reads
+            ac += sum(gt[:2])
+            supvec.append("1")
+        else:
+            supvec.append("0")
+
+    call.set_info("AC", ac)
+    call.set_info("SUPP_VEC", "".join(supvec))
+    if ac == 0:
+        call.filter = "GT"
+
+
+def parse_sv(line: str, line_index: int) -> sv.SVCall:
+    """
+    Parse a record of a VCF to be genotyped (--genotype-vcf). The line is kept as raw_vcf_line for rewriting it with
+    the determined genotype.
+    """
+    CHROM, POS, _, REF, ALT, QUAL, FILTER, INFO = line.split("\t")[:8]
+    info_dict = {}
+    for info_item in INFO.split(";"):
+        key, _, value = info_item.partition("=")
+        if key in GENOTYPE_INFO_KEYS:
+            info_dict[key] = value
+    call = sv.SVCall(contig=CHROM,
+                     pos=int(POS) - 1,
+                     id=line_index,
+                     ref=REF,
+                     alt=ALT,
+                     qual=0,
+                     filter=FILTER,
+                     info=info_dict,
+                     svtype=None,
+                     svlen=None,
+                     end=None,
+                     rnames=None,
+                     qc=True,
+                     postprocess=None,
+                     genotypes=None,
+                     precise=None,
+                     support=0,
+                     fwd=0,
+                     rev=0,
+                     nm=-1)
+    if len(call.alt) > len(call.ref):
+        call.svtype = "INS"
+        call.svlen = len(call.alt)
+        call.end = call.pos
+    else:
+        call.svtype = "DEL"
+        call.svlen = -len(call.ref)
+        call.end = call.pos + call.svlen
+
+    if "SVTYPE" in info_dict:
+        call.svtype = info_dict["SVTYPE"]
+        if call.svtype == "TRA":
+            call.svtype = "BND"
+
+    if "SVLEN" in info_dict:
+        call.svlen = int(info_dict["SVLEN"])
+    if "END" in info_dict:
+        call.end = int(info_dict["END"])
+
+    if call.svtype == "BND":
+        bnd_parts = call.alt.replace("]", "[").split("[")
+        if len(bnd_parts) > 2:
+            mate_contig, mate_ref_start = bnd_parts[1].split(":")
+            call.bnd_info = sv.SVCallBNDInfo(mate_contig=mate_contig, mate_ref_start=int(mate_ref_start),
+                                             is_first=(call.alt[0] == "N"), is_reverse=("]" in call.alt))
+        else:
+            raise ValueError("BND ALT not formatted according to VCF 4.2 specifications")
+
+    call.raw_vcf_line = line
+    call.raw_vcf_line_index = line_index
+    return call
+
+
+def open_indexed(filename: str) -> Optional[pysam.TabixFile]:
+    """
+    Open a bgzipped VCF with its tabix index, None if it is not indexed
+    """
+    if not filename.lower().endswith(".gz"):
+        return None
+    try:
+        return pysam.TabixFile(filename)
+    except (OSError, ValueError):
+        return None
+
+
+def fetch_svs_indexed(filename: str, contig: str, start: int, end: int) -> list[sv.SVCall]:
+    """
+    SVs of a bgzipped, tabix-indexed VCF starting within start (inclusive) and end (exclusive) on contig, in the order
+    of the file. raw_vcf_line_index is their index within the fetched records.
+    """
+    svs = []
+    with pysam.TabixFile(filename) as handle:
+        if contig not in handle.contigs:
+            return svs
+        for line_index, line in enumerate(handle.fetch(contig, max(0, start), end)):
+            try:
+                svcall = parse_sv(line.strip(), line_index)
+            except Exception as e:
+                raise ValueError(f"Error parsing input VCF: {contig}:{start}-{end}, record {line_index + 1}: {e}") from e
+            if start <= svcall.pos < end:
+                svs.append(svcall)
+    return svs
+
+
+class CachedReference:
+    """
+    Reference sequence access through a window of window_size bp, starting at the first position requested outside
+    of the current window. Calls written in order of their position are served from the window, so compressed
+    references are decompressed only once. Results and errors are the same as for pysam.FastaFile.fetch.
+    """
+    def __init__(self, handle: pysam.FastaFile, window_size: int):
+        self.handle = handle
+        self.window_size = window_size
+        self.contig = None
+        self.start = 0
+        self.end = 0
+        self.sequence = ""
+
+    def fetch(self, contig: str, start: int, end: int) -> str:
+        if contig == self.contig and self.start <= start and end <= self.end:
+            return self.sequence[start - self.start:end - self.start]
+        if end - start > self.window_size or start < 0:
+            return self.handle.fetch(contig, start, end)
+
+        sequence = self.handle.fetch(contig, start, start + self.window_size)
+        self.contig, self.start, self.sequence = contig, start, sequence
+        # A shorter sequence ends at the end of the contig
+        self.end = start + self.window_size if len(sequence) == self.window_size else math.inf
+        return sequence[:end - start]
+
+
 class VCF:
     def __init__(self, config: SnifflesConfig, handle):
         self.config = config
@@ -104,6 +255,8 @@ class VCF:
                   f"(this may take a while)")
             pysam.faidx(self.config.reference)
         self.reference_handle = pysam.FastaFile(self.config.reference)
+        if self.config.reference_window > 0:
+            self.reference_handle = CachedReference(self.reference_handle, self.config.reference_window)
 
     def write_header(self, contigs_lengths):
         self.write_header_line("fileformat=VCFv4.2")
@@ -191,28 +344,14 @@ class VCF:
         pos = call.pos if call.pos > 0 else 1
 
         # Determine genotypes columns
-        ac = 0  # Allele count
-        supvec = []
         sample_genotypes = []
         for internal_id, _ in self.config.sample_ids_vcf:
             if internal_id in call.genotypes and call.genotypes[internal_id] is not None:
-                gt_curr = call.genotypes[internal_id]
-                sample_genotypes.append(format_genotype(gt_curr))
-                if gt_curr[0] != "." and gt_curr[4] > 0:  # Not non-genotype and has supporting reads
-                    ac += sum(call.genotypes[internal_id][:2])
-                    supp = "1"
-                else:
-                    supp = "0"
+                sample_genotypes.append(format_genotype(call.genotypes[internal_id]))
             else:
                 sample_genotypes.append(format_genotype(self.default_genotype))
-                supp = "0"
-            supvec.append(supp)
 
-        if len(self.config.sample_ids_vcf) > 1:
-            call.set_info("AC", ac)
-            call.set_info("SUPP_VEC", "".join(supvec))
-            if ac == 0:
-                call.filter = "GT"
+        annotate_samples(call, self.config)
 
         # Output core SV attributes
         infos = {
@@ -299,68 +438,17 @@ class VCF:
                     if line_strip[0] == "#":
                         self.header_str += line_strip + "\n"
                     continue
-                CHROM, POS, _, REF, ALT, QUAL, FILTER, INFO = line.split("\t")[:8]
-                info_dict = {}
-                for info_item in INFO.split(";"):
-                    if "=" in info_item:
-                        key, value = info_item.split("=")
-                    else:
-                        key, value = info_item, True
-                    info_dict[key] = value
-                call = sv.SVCall(contig=CHROM,
-                                 pos=int(POS) - 1,
-                                 id=line_index,
-                                 ref=REF,
-                                 alt=ALT,
-                                 qual=int(QUAL),
-                                 filter=FILTER,
-                                 info=info_dict,
-                                 svtype=None,
-                                 svlen=None,
-                                 end=None,
-                                 rnames=None,
-                                 qc=True,
-                                 postprocess=None,
-                                 genotypes=None,
-                                 precise=None,
-                                 support=0,
-                                 fwd=0,
-                                 rev=0,
-                                 nm=-1)
-                if len(call.alt) > len(call.ref):
-                    call.svtype = "INS"
-                    call.svlen = len(call.alt)
-                    call.end = call.pos
-                else:
-                    call.svtype = "DEL"
-                    call.svlen = -len(call.ref)
-                    call.end = call.pos + call.svlen
-
-                if "SVTYPE" in info_dict:
-                    call.svtype = info_dict["SVTYPE"]
-                    if call.svtype == "TRA":
-                        call.svtype = "BND"
-
-                if "SVLEN" in info_dict:
-                    call.svlen = int(info_dict["SVLEN"])
-                if "END" in info_dict:
-                    call.end = int(info_dict["END"])
-
-                if call.svtype == "BND":
-                    bnd_parts = call.alt.replace("]", "[").split("[")
-                    if len(bnd_parts) > 2:
-                        mate_contig, mate_ref_start = bnd_parts[1].split(":")
-                        call.bnd_info = sv.SVCallBNDInfo(mate_contig=mate_contig, mate_ref_start=int(mate_ref_start),
-                                                         is_first=(call.alt[0] == "N"), is_reverse=("]" in call.alt))
-                    else:
-                        raise ValueError("BND ALT not formatted according to VCF 4.2 specifications")
-
-                call.raw_vcf_line = line_strip
-                call.raw_vcf_line_index = line_index
-                yield call
+                yield parse_sv(line_strip, line_index)
             except Exception as e:
                 util.fatal_error(f"Error parsing input VCF: Line {line_index}: {e}")
 
+    def read_header_indexed(self):
+        """
+        Read only the header of a bgzipped, tabix-indexed input VCF. Its SVs are fetched by each task (see
+        fetch_svs_indexed).
+        """
+        self.header_str = "".join(line.strip() + "\n" for line in self.handle.header)
+
     def rewrite_genotype(self, svcall):
         parts_no_gt = svcall.raw_vcf_line.split("\t")[:8]
         gt_format = self.config.genotype_format
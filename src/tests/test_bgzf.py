@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+import gzip
+import os
+import random
+import tempfile
+from unittest import TestCase
+
+import pysam
+
+from sniffles.bgzf import BGZFWriter, parse_interval
+
+
+class TestBGZFWriter(TestCase):
+    """
+    Tests for bgzipped VCF output with a tabix index built while writing
+    """
+
+    @staticmethod
+    def make_records(positions: dict[str, list[int]]) -> list[tuple[str, int, int, str]]:
+        random.seed(42)
+        records = []
+        for contig, contig_positions in positions.items():
+            for pos in sorted(contig_positions):
+                svlen = random.choice([50, 500, 20000, 300000])
+                info = f'SVTYPE=DEL;SVLEN=-{svlen};END={pos + svlen}' if random.random() < 0.5 else 'SVTYPE=INS;SVLEN=100'
+                end = pos + svlen if info.startswith('SVTYPE=DEL') else pos
+                line = f'{contig}\t{pos}\tsv{len(records)}\tN\t<DEL>\t60\tPASS\t{info}\tGT:DR:DV\t' + '\t'.join(['0/1:10:12'] * 50)
+                records.append((contig, pos, end, line))
+        return records
+
+    def write_and_fetch(self, records, threads: int, index_ext: str):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'out.vcf.gz')
+            writer = BGZFWriter(filename, threads=threads)
+            writer.write(b'##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\n')
+            for _, _, _, line in records:
+                writer.write(line.encode())
+                writer.write(b'\n')
+            writer.close()
+            self.assertEqual(filename + index_ext, writer.index_filename)
+
+            with gzip.open(filename, 'rt') as handle:
+                self.assertEqual([line for _, _, _, line in records], [line.rstrip('\n') for line in handle if line[0] != '#'])
+
+            with pysam.TabixFile(filename, index=writer.index_filename) as tabix:
+                for contig, start, end in [('chr1', 0, 10 ** 6), ('chr1', 5000, 5001), ('chr1', 400000, 800000), ('chr2', 100, 200000),
+                                           ('chr2', 700 * 10 ** 6, 900 * 10 ** 6), ('chr1', 10 ** 7, 2 * 10 ** 7)]:
+                    if contig not in tabix.contigs:
+                        continue
+                    expected = [line for c, pos, rec_end, line in records if c == contig and pos - 1 < end and max(rec_end, pos) > start]
+                    self.assertEqual(expected, list(tabix.fetch(contig, start, end)))
+
+    def test_tbi(self):
+        random.seed(1)
+        records = self.make_records({'chr1': random.sample(range(1, 10 ** 7), 3000), 'chr2': random.sample(range(1, 10 ** 6), 500)})
+        self.write_and_fetch(records, threads=4, index_ext='.tbi')
+        self.write_and_fetch(records, threads=1, index_ext='.tbi')
+
+    def test_csi(self):
+        random.seed(2)
+        records = self.make_records({'chr1': random.sample(range(1, 10 ** 6), 200), 'chr2': random.sample(range(1, 10 ** 9), 500)})
+        self.write_and_fetch(records, threads=2, index_ext='.csi')
+
+    def test_parse_interval(self):
+        self.assertEqual((b'chr1', 99, 100), parse_interval(b'chr1\t100\t.\tN\t<INS>\t.\tPASS\tSVTYPE=INS'))
+        self.assertEqual((b'chr1', 99, 101), parse_interval(b'chr1\t100\t.\tNA\tN\t.\tPASS\tSVTYPE=DEL;SVEND=5'))
+        self.assertEqual((b'chr1', 99, 600), parse_interval(b'chr1\t100\t.\tN\t<DEL>\t.\tPASS\tSVTYPE=DEL;END=600;X=1\tGT'))
+        self.assertEqual((b'chr1', 99, 600), parse_interval(b'chr1\t100\t.\tN\t<DEL>\t.\tPASS\tEND=600'))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase, skipIf
+
+from sniffles import columnar
+from sniffles.sv import SVCallBNDInfo
+
+
+@skipIf(columnar.pa is None, 'pyarrow not installed')
+class TestParquetOutput(TestCase):
+    """
+    Tests for --parquet output
+    """
+
+    config = SimpleNamespace(sample_ids_vcf=[(0, 'a'), (1, 'b')], genotype_none=('.', '.', 0, 0, 0, (None, None)), id_prefix='Sniffles2.')
+
+    @staticmethod
+    def make_call(svtype, pos, svlen, genotypes, bnd_info=None):
+        info = {'AF': 0.5}
+        return SimpleNamespace(contig='chr1', pos=pos, id=f'{svtype}.1', svtype=svtype, svlen=svlen, end=pos + abs(svlen), qual=70, filter='PASS',
+                               precise=True, support=5, coverage_upstream=10, coverage_start=10, coverage_center=None, coverage_end=9,
+                               coverage_downstream=8, fwd=3, rev=0, genotypes=genotypes, bnd_info=bnd_info, get_info=info.get,
+                               set_info=info.__setitem__)
+
+    def test_write_calls(self):
+        bnd_info = SVCallBNDInfo(mate_contig='chr2', mate_ref_start=1000, is_first=True, is_reverse=False)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'out.parquet')
+            out = columnar.ParquetOutput(self.config, filename)
+            out.write_calls([self.make_call('DEL', 100, -50, {0: (0, 1, 20, 5, 5, (None, None))})])
+            out.write_calls([self.make_call('BND', 200, 0, {1: (1, 1, 60, 0, 9, (None, None))}, bnd_info),
+                             self.make_call('INS', 300, 80, {0: (0, 0, 30, 10, 0, (None, None))})])
+            out.close()
+
+            self.assertEqual(2, columnar.pq.ParquetFile(filename).num_row_groups)
+            self.assertEqual(columnar.pa.int32(), columnar.pq.read_schema(filename).field('coverage_start').type)
+            rows = columnar.pq.read_table(filename).to_pylist()
+
+        self.assertEqual([(100, -50, 150, None, 60), (200, None, None, 'chr2', 60), (300, 80, 380, None, 60)],
+                         [(row['pos'], row['svlen'], row['end'], row['mate_contig'], row['qual']) for row in rows])
+        # Multi-sample filters are set without VCF output
+        self.assertEqual(['PASS', 'PASS', 'GT'], [row['filter'] for row in rows])
+        self.assertEqual([dict(sample='a', gt='0/1', gq=20, dr=5, dv=5), dict(sample='b', gt='./.', gq=0, dr=0, dv=0)], rows[0]['genotypes'])
+        self.assertEqual(['./.', '1/1'], [genotype['gt'] for genotype in rows[1]['genotypes']])
+        self.assertEqual([10, None, '+'], [rows[0]['coverage_start'], rows[0]['coverage_center'], rows[0]['strand']])
+
+    def test_row_groups(self):
+        calls = [self.make_call('DEL', pos, -50, {0: (0, 1, 20, 5, 5, (None, None))}) for pos in range(100, 1100, 100)]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'out.parquet')
+            out = columnar.ParquetOutput(self.config, filename)
+            for i in range(0, 10, 3):
+                out.write_calls(calls[i:i + 3], flush=False)
+            out.flush()
+            out.write_calls(calls[:2], flush=False)
+            out.close()
+
+            parquet_file = columnar.pq.ParquetFile(filename)
+            self.assertEqual(2, parquet_file.num_row_groups)
+            self.assertEqual([10, 2], [parquet_file.metadata.row_group(i).num_rows for i in range(2)])
+            self.assertEqual(12, out.call_count)
@@ -0,0 +1,35 @@
+import unittest
+
+from sniffles.config import SnifflesConfig
+
+
+class TestSweep(unittest.TestCase):
+    """
+    Tests --sweep parameter
+    """
+    @staticmethod
+    def _get_common_args() -> tuple:
+        return '--input', 'input.bam', '--vcf', 'out.vcf'
+
+    def test_Sweep(self):
+        config = SnifflesConfig(*self._get_common_args(), '--sweep', 'strict.vcf --minsupport 10', '--sweep=mosaic.vcf --mosaic')
+
+        self.assertEqual(
+            config.sweep,
+            [('strict.vcf', {'minsupport': 10, 'vcf': 'strict.vcf'}),
+             ('mosaic.vcf', {'mosaic': True, 'qc_nm_measure': True, 'vcf': 'mosaic.vcf'})]
+        )
+        self.assertFalse(config.qc_nm_measure)
+        self.assertTrue(config.qc_nm_extract)
+
+        mosaic_config = config.sweep_config(config.sweep[1][1])
+        self.assertTrue(mosaic_config.mosaic)
+        self.assertEqual(mosaic_config.vcf, 'mosaic.vcf')
+        self.assertIsNone(mosaic_config.sweep)
+
+    def test_SweepExtractionConflict(self):
+        """
+        Expect exception if a sweep changes parameters affecting reading of the input
+        """
+        with self.assertRaises(SystemExit):
+            SnifflesConfig(*self._get_common_args(), '--sweep', 'out2.vcf --minsvlen 100')
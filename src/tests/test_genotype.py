@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+import pysam
+
+from sniffles import genotyping
+from sniffles import postprocessing
+from sniffles import vcf
+
+from sniffles.config import SnifflesConfig
+from sniffles.genotyping import GenotypeIndex
+from sniffles.leadprov import fetch_windows
+from sniffles.parallel import GenotypeTask
+from sniffles.region import Region
+from sniffles.sv import SVCallBNDInfo
+
+
+class TestTargetedGenotyping(TestCase):
+    """
+    Tests for --genotype-targeted
+    """
+
+    config = SimpleNamespace(combine_match_max=1000, cluster_repeat_h_max=1000, cluster_merge_bnd=1000, coverage_binsize=100, coverage_updown_bins=5)
+
+    def test_target_windows(self):
+        genotype_svs = [
+            SimpleNamespace(svtype='INS', pos=10000, svlen=300, bnd_info=None),
+            SimpleNamespace(svtype='DEL', pos=11000, svlen=-500, bnd_info=None),
+            SimpleNamespace(svtype='DEL', pos=100000, svlen=-50000, bnd_info=None),
+            SimpleNamespace(svtype='BND', pos=300000, svlen=0, bnd_info=SVCallBNDInfo(mate_contig='chr1', mate_ref_start=400000, is_first=True, is_reverse=False)),
+            SimpleNamespace(svtype='BND', pos=500000, svlen=0, bnd_info=SVCallBNDInfo(mate_contig='chr2', mate_ref_start=400000, is_first=True, is_reverse=False)),
+        ]
+        task = GenotypeTask(id=0, sv_id=0, contig='chr1', start=0, end=10 ** 6, config=self.config, genotype_svs=genotype_svs)
+
+        pad = 2600
+        self.assertEqual([(10000 - pad, 11500 + pad), (100000 - pad, 100000 + pad), (125000 - pad, 125000 + pad), (150000 - pad, 150000 + pad),
+                          (300000 - pad, 300000 + pad), (400000 - pad, 400000 + pad), (500000 - pad, 500000 + pad)],
+                         [(w.start, w.end) for w in task.target_windows()])
+
+    def test_fetch_windows(self):
+        reads = [SimpleNamespace(name=name, reference_start=start, reference_end=end) for name, start, end in
+                 [('a', 0, 1000), ('b', 900, 5000), ('c', 2500, 2600), ('d', 4500, 6000), ('e', 5500, 5600)]]
+        bam = SimpleNamespace(fetch=lambda contig, start, end, until_eof: [r for r in reads if r.reference_start < end and r.reference_end > start])
+
+        fetched = fetch_windows(bam, Region('chr1', 500, 10000), [Region('chr1', 0, 1000), Region('chr1', 4000, 5000), Region('chr1', 5500, 5501)])
+        self.assertEqual(['b', 'd', 'e'], [r.name for r in fetched])
+
+
+class TestGenotypeMatching(TestCase):
+    """
+    Tests for matching calls with the SVs to be genotyped
+    """
+
+    config = SimpleNamespace(combine_match=250, combine_match_max=1000, cluster_merge_bnd=1000)
+
+    def match(self):
+        bnd_info = SVCallBNDInfo(mate_contig='chr2', mate_ref_start=1000, is_first=True, is_reverse=False)
+        genotype_svs = [
+            SimpleNamespace(svtype='DEL', pos=4400, svlen=-1000),
+            SimpleNamespace(svtype='DEL', pos=20000, svlen=-100),
+            SimpleNamespace(svtype='INS', pos=20000, svlen=100),
+            SimpleNamespace(svtype='BND', pos=30000, svlen=0, bnd_info=bnd_info),
+            SimpleNamespace(svtype='CNV', pos=30000, svlen=0),
+        ]
+        candidates = [
+            SimpleNamespace(svtype='DEL', pos=5100, svlen=-1000),
+            SimpleNamespace(svtype='DEL', pos=20010, svlen=-100),
+            SimpleNamespace(svtype='DEL', pos=19990, svlen=-100),
+            SimpleNamespace(svtype='DEL', pos=20005, svlen=-90),
+            SimpleNamespace(svtype='INS', pos=22000, svlen=100),
+            SimpleNamespace(svtype='BND', pos=30100, svlen=0, bnd_info=SVCallBNDInfo(mate_contig='chr3', mate_ref_start=1000, is_first=True, is_reverse=False)),
+            SimpleNamespace(svtype='BND', pos=30200, svlen=0, bnd_info=bnd_info),
+        ]
+        with self.assertLogs('sniffles.genotyping', 'WARNING'):
+            GenotypeIndex(genotype_svs, self.config).match(candidates)
+        return [(candidates.index(gsv.genotype_match_sv) if gsv.genotype_match_sv is not None else None, gsv.genotype_match_dist)
+                for gsv in genotype_svs]
+
+    def test_match(self):
+        expected = [(0, 700), (1, 10), (None, float('inf')), (6, 200), (None, float('inf'))]
+        self.assertEqual(expected, self.match())
+        with mock.patch.object(genotyping, 'np', None):
+            self.assertEqual(expected, self.match())
+
+
+class TestIndexedGenotypeVCF(TestCase):
+    """
+    Tests for fetching the SVs to be genotyped per task from a tabix-indexed VCF
+    """
+
+    def test_fetch(self):
+        lines = [
+            '##fileformat=VCFv4.2',
+            '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE',
+            'chr1\t900\tsv1\tN\t<DEL>\t.\tPASS\tSVTYPE=DEL;SVLEN=-500;END=1400;AF=0.5\tGT\t0/1',
+            'chr1\t1001\tsv2\tN\tACGTACGT\t60\tPASS\tPRECISE;SVTYPE=INS;SVLEN=7\tGT\t1/1',
+            'chr1\t2001\tsv3\tN\tN]chr2:5000]\t60\tPASS\tSVTYPE=BND\tGT\t0/1',
+            'chr2\t1001\tsv4\tN\t<DEL>\t60\tPASS\tSVTYPE=DEL;SVLEN=-100\tGT\t0/1',
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'input.vcf')
+            with open(filename, 'w') as handle:
+                handle.write('\n'.join(lines) + '\n')
+            filename = pysam.tabix_index(filename, preset='vcf')
+            self.assertIsNotNone(vcf.open_indexed(filename))
+
+            svs = vcf.fetch_svs_indexed(filename, 'chr1', 1000, 3000)
+            self.assertEqual([('INS', 1000, 7, lines[3]), ('BND', 2000, 12, lines[4])], [(s.svtype, s.pos, s.svlen, s.raw_vcf_line) for s in svs])
+            self.assertEqual({'SVTYPE': 'INS', 'SVLEN': '7'}, svs[0].info)
+            self.assertEqual(('chr2', 5000), (svs[1].bnd_info.mate_contig, svs[1].bnd_info.mate_ref_start))
+            self.assertEqual([], vcf.fetch_svs_indexed(filename, 'chr3', 0, 3000))
+
+
+class TestBatchGenotyping(TestCase):
+    """
+    Tests for genotyping all calls of a task at once
+    """
+
+    @staticmethod
+    def make_call(svtype, support, coverage):
+        svcall = SimpleNamespace(svtype=svtype, svlen=100 if svtype == 'INS' else -100, support=support, filter='PASS', genotypes={}, info={},
+                                 coverage_start=coverage, coverage_center=coverage, coverage_end=coverage,
+                                 coverage_upstream=coverage, coverage_downstream=coverage)
+        svcall.set_info = svcall.info.__setitem__
+        return svcall
+
+    def genotype(self, config):
+        calls = [(svtype, support, coverage) for svtype in ('INS', 'DEL', 'DUP', 'INV') for support in (0, 1, 2, 3, 7, 15, 40, 251, 900)
+                 for coverage in (0, 1, 5, 10, 30, 100, 250, 251, 777, 2000)]
+        scalar, batch = [self.make_call(*call) for call in calls], [self.make_call(*call) for call in calls]
+        for svcall in scalar:
+            if svcall.support > 0 or svcall.coverage_center > 0:
+                postprocessing.genotype_sv(svcall, config, (None, None))
+        genotyping.genotype_svs([svcall for svcall in batch if svcall.support > 0 or svcall.coverage_center > 0], config)
+        self.assertEqual([(s.genotypes, s.info, s.filter) for s in scalar], [(s.genotypes, s.info, s.filter) for s in batch])
+
+    def test_genotype_svs(self):
+        config = SnifflesConfig('--input', 'input.bam', '--vcf', 'out.vcf')
+        self.genotype(config)
+        with mock.patch.object(genotyping, 'np', None):
+            self.genotype(config)
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+import sniffles
+from sniffles import hierarchical
+from sniffles import util
+from sniffles.hierarchical import plan_batches
+from sniffles.parallel import CombineTask
+from sniffles.sv import SVCall, SVCandidate, SVGroup, SVGroupSummary
+from test_streaming import write_bam
+
+
+class TestHierarchicalCombine(TestCase):
+    """
+    Tests for hierarchical (tree) combine
+    """
+
+    @staticmethod
+    def get_candidate(sample_internal_id: int, pos: int, svlen: int, support: int = 10, qc: bool = True) -> SVCall:
+        return SVCall(
+            contig='chr1',
+            pos=pos,
+            id=f'DEL.{sample_internal_id}',
+            ref='N',
+            alt='<DEL>',
+            qual=60,
+            filter='PASS',
+            info={},
+            svtype='DEL',
+            svlen=svlen,
+            end=pos - svlen,
+            genotypes={0: (0, 1, 30, 10, support, (None, None))},
+            precise=True,
+            support=support,
+            rnames=None,
+            qc=qc,
+            nm=-1,
+            postprocess=None,
+            fwd=support // 2,
+            rev=support - support // 2,
+            coverage_upstream=20,
+            coverage_start=20,
+            coverage_center=10,
+            coverage_end=20,
+            coverage_downstream=20,
+            sample_internal_id=sample_internal_id,
+        )
+
+    def test_plan_batches(self):
+        inputs = [{'internal_id': i} for i in range(7)]
+        batches = plan_batches(inputs, 3)
+        self.assertEqual([3, 2, 2], [len(b) for b in batches])
+        self.assertEqual(inputs, [i for b in batches for i in b])
+
+        self.assertEqual([[inputs[0]]], plan_batches(inputs[:1], 3))
+
+    def test_combine_tree(self):
+        """
+        Group .snf files passed on unchanged to the next level must not be removed
+        """
+        def combine_level(config, inputs, level, contig_lengths, processes, recycle_hint=None, fan_in=None):
+            next_inputs = []
+            for batch_index, batch in enumerate(plan_batches(inputs, fan_in or config.combine_hierarchical)):
+                self.assertTrue(all(os.path.exists(snf_info['filename']) for snf_info in batch))
+                if len(batch) == 1:
+                    next_inputs.append(batch[0])
+                    continue
+                filename = hierarchical.group_snf_filename(config, level, batch_index)
+                open(filename, 'w').close()
+                next_inputs.append({'filename': filename, 'samples': [], 'level': level})
+            return next_inputs
+
+        with tempfile.TemporaryDirectory() as directory:
+            for input_count, fan_in in ((6, 2), (7, 2), (10, 3)):
+                config = SimpleNamespace(combine_hierarchical=fan_in, vcf=os.path.join(directory, f'{input_count}.vcf'))
+                inputs = []
+                for i in range(input_count):
+                    filename = os.path.join(directory, f'{input_count}_{i}.snf')
+                    open(filename, 'w').close()
+                    inputs.append({'filename': filename, 'samples': [f'S{i}']})
+
+                with mock.patch.object(hierarchical, 'combine_level', combine_level):
+                    final_inputs = hierarchical.combine_tree(config, inputs, [], [])
+
+                self.assertLessEqual(len(final_inputs), fan_in)
+                self.assertTrue(any(snf_info.get('level', 0) > 1 for snf_info in final_inputs))
+                self.assertTrue(all(os.path.exists(snf_info['filename']) for snf_info in final_inputs))
+                hierarchical.cleanup(final_inputs)
+                # All intermediate files removed, inputs kept
+                self.assertEqual(input_count, len(os.listdir(directory)))
+                for snf_info in inputs:
+                    os.remove(snf_info['filename'])
+
+    def test_scatter_samples(self):
+        inputs = [{'filename': f'{i}.snf', 'samples': [f'S{i}']} for i in range(10)]
+        with mock.patch.object(hierarchical, 'combine_level', return_value=['grouped']) as combine_level:
+            for sample_blocks, fan_in in ((2, 5), (3, 4), (4, 3), (5, 2)):
+                config = SimpleNamespace(combine_sample_blocks=sample_blocks)
+                self.assertEqual(['grouped'], hierarchical.scatter_samples(config, inputs, [], []))
+                combine_level.assert_called_with(config, inputs, 1, [], [], None, fan_in=fan_in)
+                self.assertEqual(sample_blocks, len(plan_batches(inputs, fan_in)))
+
+            # Blocks of single samples: nothing to group
+            combine_level.reset_mock()
+            for sample_blocks in (10, 16):
+                config = SimpleNamespace(combine_sample_blocks=sample_blocks)
+                self.assertIs(inputs, hierarchical.scatter_samples(config, inputs, [], []))
+            combine_level.assert_not_called()
+
+            # After a hierarchical combine, group files are merged at the next level
+            config = SimpleNamespace(combine_sample_blocks=2)
+            group_inputs = inputs[:2] + [{'filename': 'L1_G0.snf', 'samples': ['S3', 'S4'], 'level': 1},
+                                         {'filename': 'L2_G1.snf', 'samples': ['S5', 'S6', 'S7'], 'level': 2}]
+            hierarchical.scatter_samples(config, group_inputs, [], [])
+            combine_level.assert_called_with(config, group_inputs, 3, [], [], None, fan_in=2)
+
+    def test_summary_statistics(self):
+        """
+        Summaries of summaries must give the same means and standard deviations as a flat group
+        """
+        config = type('Config', (), {'output_rnames': False, 'id_prefix': 'Sniffles2.'})()
+        candidates = [self.get_candidate(i, 1000 + i * 7, -500 - i * 3, support=5 + i) for i in range(6)]
+
+        flat = SVGroup.from_candidate(candidates[0])
+        for cand in candidates[1:]:
+            flat.add_candidate(cand)
+
+        groups = []
+        for batch in (candidates[:2], candidates[2:]):
+            group = SVGroup.from_candidate(batch[0])
+            for cand in batch[1:]:
+                group.add_candidate(cand)
+            groups.append(group.summarize(config))
+
+        tree = SVGroup.from_candidate(groups[0])
+        tree.add_candidate(groups[1])
+
+        self.assertAlmostEqual(flat.pos_mean, tree.pos_mean)
+        self.assertAlmostEqual(flat.len_mean, tree.len_mean)
+        self.assertEqual(flat.included_samples, tree.included_samples)
+        self.assertEqual(flat.weight, tree.weight)
+        self.assertEqual(flat.merge_genotypes(config), tree.merge_genotypes(config))
+
+        summary = SVGroupSummary.merge([SVGroupSummary.from_candidate(c) for c in tree.candidates])
+        self.assertAlmostEqual(util.stdev(c.pos for c in candidates), summary.stdev_pos)
+        self.assertAlmostEqual(util.stdev(c.svlen for c in candidates), summary.stdev_len)
+        self.assertEqual(round(util.mean(c.support for c in candidates)), round(summary.support_sum / summary.count))
+        self.assertEqual(10, summary.coverage_mean('coverage_center'))
+
+    def test_summary_statistics_precision(self):
+        """
+        Standard deviations must be exact for large positions and many candidates
+        """
+        candidates = [self.get_candidate(i, 200_000_000 + i % 31, -500 - i % 7) for i in range(5000)]
+        summary = SVGroupSummary.merge([SVGroupSummary.merge([SVGroupSummary.from_candidate(c) for c in candidates[i:i + 100]])
+                                        for i in range(0, len(candidates), 100)])
+        self.assertAlmostEqual(util.stdev(c.pos for c in candidates), summary.stdev_pos, places=9)
+        self.assertAlmostEqual(util.stdev(c.svlen for c in candidates), summary.stdev_len, places=9)
+
+    def test_compact_candidates(self):
+        """
+        Groups of compact candidates must be called the same as groups of the original calls
+        """
+        config = type('Config', (), {'output_rnames': False, 'id_prefix': 'Sniffles2.'})()
+        candidates = [self.get_candidate(i, 1000 + i * 7, -500 - i * 3, support=5 + i) for i in range(4)]
+        candidates[3].genotypes = {}
+        groups = []
+        for cands in (candidates, [SVCandidate.from_call(cand) for cand in candidates]):
+            group = SVGroup.from_candidate(cands[0])
+            for cand in cands[1:]:
+                group.add_candidate(cand)
+            groups.append(group)
+
+        self.assertEqual(groups[0].merge_genotypes(config), groups[1].merge_genotypes(config))
+        self.assertEqual(groups[0].summarize(config), groups[1].summarize(config))
+
+        compact = SVCandidate.from_call(groups[0].summarize(config))
+        self.assertEqual({0, 1, 2, 3}, compact.samples)
+        self.assertEqual(4, compact.weight)
+        self.assertIsNone(compact.get_info('STDEV_POS'))
+        self.assertFalse(hasattr(compact, '__dict__'))
+
+
+class TestCandidateBudget(TestCase):
+    """
+    Tests for --combine-candidate-budget
+    """
+
+    @staticmethod
+    def get_task(budget: int) -> CombineTask:
+        config = SimpleNamespace(combine_candidate_budget=budget, combine_min_size=100, snf_block_size=10 ** 5, snf_input_info=[])
+        return CombineTask(id=0, sv_id=0, contig='chr1', start=0, end=3 * 10 ** 5 - 1, config=config)
+
+    def test_plan_windows(self):
+        # Two inputs with 4000 and 2000 candidates in block 100000, at 10 bytes per candidate
+        inputs_snf = {i: SimpleNamespace(index={'chr1': {'100000': [(0, 20000), (20000, 20000 // (i + 1))]}}) for i in range(2)}
+        inputs_candidate_size = {0: 10, 1: 10}
+
+        self.assertEqual([None], self.get_task(0).plan_windows(100000, inputs_snf, inputs_candidate_size))
+        self.assertEqual([None], self.get_task(20000).plan_windows(100000, inputs_snf, inputs_candidate_size))
+        self.assertEqual([None], self.get_task(1000).plan_windows(200000, inputs_snf, inputs_candidate_size))
+
+        task = self.get_task(1000)
+        windows = task.plan_windows(100000, inputs_snf, inputs_candidate_size)
+        self.assertEqual(1, task.subwindowed_blocks)
+        self.assertEqual(14, len(windows))
+        self.assertEqual((-math.inf, 107200), windows[0])
+        self.assertEqual((193600, math.inf), windows[-1])
+        self.assertTrue(all(end == next_start for (_, end), (next_start, _) in zip(windows, windows[1:])))
+
+        self.assertEqual(1000, len(self.get_task(2).plan_windows(100000, inputs_snf, inputs_candidate_size)))
+
+    def test_limit_kept_groups(self):
+        task = self.get_task(10)
+        keep = []
+        for pos in (3000, 1000, 2000):
+            group = SVGroup.from_candidate(TestHierarchicalCombine.get_candidate(0, pos, -500))
+            for i in range(1, 3):
+                group.add_candidate(TestHierarchicalCombine.get_candidate(i, pos, -500))
+            keep.append(group)
+
+        groups_call = []
+        other = {'INS': [], 'DEL': keep}
+        remaining = task.limit_kept_groups('DEL', keep, other, groups_call)
+        self.assertEqual([3000], [group.pos_mean for group in remaining])
+        self.assertEqual([1000, 2000], [group.pos_mean for group in groups_call])
+        self.assertEqual(2, task.early_called_groups)
+
+
+class TestCohortUpdate(TestCase):
+    """
+    Tests for incremental cohort updates via a cohort .snf file
+    """
+    CONTIG_LENGTH = 40000
+    SVS = [(8000, 'DEL', 400, 0.5), (16000, 'INS', 300, 0.5), (24000, 'DEL', 1500, 0.5), (33000, 'INS', 500, 0.5)]
+
+    @classmethod
+    def sniffles(cls, *args):
+        script = os.path.join(os.path.dirname(sniffles.__file__), 'sniffles')
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(sniffles.__file__)))
+        subprocess.run([sys.executable, script, '--threads', '1', *args], cwd=cls.directory.name, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        # Each sample lacks one of the SVs
+        for i in range(4):
+            svs = [(pos, svtype, svlen, 0.0 if k == i else fraction) for k, (pos, svtype, svlen, fraction) in enumerate(cls.SVS)]
+            write_bam(os.path.join(cls.directory.name, f's{i}.bam'), cls.CONTIG_LENGTH, svs, seed=i + 1)
+            cls.sniffles('--input', f's{i}.bam', '--snf', f's{i}.snf')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def read_vcf(self, filename: str) -> tuple[list[str], list[list[str]]]:
+        with open(os.path.join(self.directory.name, filename)) as handle:
+            lines = [line.rstrip('\n').split('\t') for line in handle if not line.startswith('##')]
+        return lines[0][9:], lines[1:]
+
+    def read_snf_header(self, filename: str) -> dict:
+        with open(os.path.join(self.directory.name, filename), 'rb') as handle:
+            return json.loads(handle.readline())
+
+    def test_update(self):
+        self.sniffles('--input', 's0.snf', 's1.snf', '--snf', 'cohort.snf')
+        self.sniffles('--input', 'cohort.snf', 's2.snf', 's3.snf', '--snf', 'updated.snf', '--vcf', 'updated.vcf')
+        self.sniffles('--input', 's0.snf', 's1.snf', 's2.snf', 's3.snf', '--vcf', 'flat.vcf')
+
+        self.assertEqual(['s0', 's1'], self.read_snf_header('cohort.snf')['sample_ids'])
+        header = self.read_snf_header('updated.snf')
+        self.assertTrue(header['cohort'])
+        self.assertEqual([0, 1, 2, 3], header['samples'])
+        self.assertEqual(['s0', 's1', 's2', 's3'], header['sample_ids'])
+
+        samples, records = self.read_vcf('updated.vcf')
+        flat_samples, flat_records = self.read_vcf('flat.vcf')
+        self.assertEqual(flat_samples, samples)
+        self.assertEqual(len(self.SVS), len(records))
+        # The representative INS sequence may be taken from a different sample than in a flat combine
+        for record, flat_record in zip(records, flat_records):
+            self.assertEqual(flat_record[:2] + flat_record[6:7], record[:2] + record[6:7])
+            self.assertEqual(flat_record[9:], record[9:])
+        # Sample missing an SV is called 0/0, all others 0/1 (or 1/1)
+        for i, record in enumerate(records):
+            self.assertEqual(['0/0' if k == i else '0/1' for k in range(4)], [gt.split(':')[0].replace('1/1', '0/1') for gt in record[9:]])
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+
+from sniffles.leadcache import EXTRACTION_FIELDS, LeadCache
+from sniffles.leadprov import Lead, LeadProvider
+from sniffles.region import Region
+
+
+class TestLeadCache(TestCase):
+    """
+    Tests for the persistent lead cache (--lead-cache)
+    """
+
+    def test_roundtrip(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            config = SimpleNamespace(lead_cache=cache_dir, lead_cache_input={'input': {'size': 1, 'mtime': 2}}, input='sample.bam',
+                                     cluster_binsize=100, consensus_max_reads_bin=1, average_regional_nm=0.5, **{field: 0 for field in EXTRACTION_FIELDS})
+            config.coverage_binsize = 100
+            regions = [Region('chr1', 0, 100000)]
+
+            written = LeadProvider(config, 1000)
+            written.cache = LeadCache(config, regions)
+            written.enter_region(regions[0])
+            written.read_id, written.read_count = 1002, 2
+            written.covrtab_fwd, written.covrtab_rev = {200: 1, 5000: -1}, {300: 1}
+            written.record_lead(Lead(1001, 'read1', 'chr1', 5000, 5000, 200, 500, '+', 60, -1, 'INLINE', 'INS', 300, 'ACGT' * 75), 5000)
+            written.record_lead(Lead(1002, 'read2', 'chr1', 5010, 5010, 200, 500, '-', 60, -1, 'INLINE', 'INS', 300, 'ACGT' * 75), 5000)
+            written.cache.save(written)
+
+            loaded = LeadProvider(config, 3000)
+            self.assertFalse(LeadCache(config, [Region('chr1', 0, 50000)]).load(loaded, regions))
+            self.assertTrue(LeadCache(config, regions).load(loaded, regions))
+
+        self.assertEqual(2, loaded.read_count)
+        self.assertEqual(3002, loaded.read_id)
+        self.assertEqual((written.covrtab_fwd, written.covrtab_rev), (loaded.covrtab_fwd, loaded.covrtab_rev))
+        leads = loaded.leadtab['INS'][5000]
+        self.assertEqual([3001, 3002], [ld.read_id for ld in leads])
+        # The sequence cap per bin is applied when loading, not when caching
+        self.assertEqual(['ACGT' * 75, None], [ld.seq for ld in leads])
@@ -58,3 +58,12 @@ chr1\t100\t200\n  valid line
             config.regions_by_contig,
             {'chr1': [Region('chr1', 100, 200)]}
         )
+
+    def test_from_string(self):
+        self.assertEqual(Region('chr7', 0, 2000000), Region.from_string('chr7:1-2,000,000'))
+        self.assertEqual(Region('chr7', 99, 100), Region.from_string('chr7:100-100'))
+        self.assertEqual('chr7', Region.from_string('chr7').contig)
+        self.assertEqual(499, Region.from_string('chr7:500').start)
+        for text in ('chr7:0-10', 'chr7:10-5', 'chr7:a-b'):
+            with self.assertRaises(ValueError):
+                Region.from_string(text)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+import os
+import pickle
+import random
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase, mock
+
+from sniffles.result import CallRuns, CombineResultTmpFile
+from sniffles.sv import SVCall
+
+
+class TestCallRuns(TestCase):
+    """
+    Tests for spilling combine calls as sorted runs
+    """
+
+    @staticmethod
+    def get_call(pos: int, i: int) -> SVCall:
+        return SVCall(contig='chr1', pos=pos, id=f'DEL.{i}', ref='N', alt='<DEL>', qual=60, filter='PASS', info={'STDEV_POS': 1.5},
+                      svtype='DEL', svlen=-100, end=pos + 100, genotypes={0: (0, 1, 30, 10, 5, (None, None), 'NULL')}, precise=True,
+                      support=5, rnames=None, qc=True, nm=-1, postprocess=None, fwd=2, rev=3)
+
+    def test_merge(self):
+        random.seed(0)
+        calls = [self.get_call(random.randint(1, 1000), i) for i in range(1000)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            for sort in (True, False):
+                runs = CallRuns(os.path.join(directory, 'calls.part'), sort=sort)
+                runs.RUN_SIZE, runs.CHUNK_SIZE = 64, 10
+                runs.extend(calls)
+                runs.close()
+                runs = pickle.loads(pickle.dumps(runs))
+
+                self.assertEqual(1000, len(runs))
+                self.assertEqual(16, len(runs.runs))
+                expected = sorted(calls, key=lambda call: call.pos) if sort else calls
+                self.assertEqual(expected, list(runs))
+                chunks = list(runs.iter_chunks())
+                self.assertEqual(expected, [call for chunk in chunks for call in chunk])
+                self.assertEqual(100, len(chunks))
+                runs.remove()
+
+    def test_emit(self):
+        calls = [self.get_call(pos, pos) for pos in range(1000, 0, -10)]
+        with tempfile.TemporaryDirectory() as directory:
+            runs = CallRuns(os.path.join(directory, 'calls.part'))
+            runs.RUN_SIZE, runs.CHUNK_SIZE = 64, 10
+            runs.extend(calls)
+            task = SimpleNamespace(id=1, contig='chr1', config=SimpleNamespace(run_id='test'))
+            result = CombineResultTmpFile(task, runs, 0)
+
+            parquet_out = mock.Mock()
+            self.assertEqual(100, result.emit(parquet_out=parquet_out))
+            self.assertFalse(os.path.exists(runs.filename))
+
+        # Chunks are added to a single row group per task
+        self.assertEqual(10, parquet_out.write_calls.call_count)
+        self.assertTrue(all(kwargs == {'flush': False} for _, kwargs in parquet_out.write_calls.call_args_list))
+        parquet_out.flush.assert_called_once()
+        self.assertEqual(sorted(calls, key=lambda call: call.pos), [call for args, _ in parquet_out.write_calls.call_args_list for call in args[0]])
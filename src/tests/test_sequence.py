@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+from unittest import TestCase
+
+from sniffles.sequence import PackedSequence, pack
+
+
+class TestSequence(TestCase):
+    """
+    Tests for packed read sequences
+    """
+
+    def test_pack(self):
+        for seq, bits in [('', 2), ('A', 2), ('AAAA', 2), ('TACGTTGCA', 2), ('ACGTN', 4), ('NNNAC=', 4)]:
+            packed = pack(seq)
+            self.assertIsInstance(packed, PackedSequence)
+            self.assertEqual(bits, packed.bits)
+            self.assertEqual(len(seq), len(packed))
+            self.assertEqual(seq, str(packed))
+
+        self.assertEqual('ACGTx', pack('ACGTx'))
+        self.assertEqual('GATTACANN', str(pack('GATT') + pack('ACANN')))
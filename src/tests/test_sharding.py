@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+from types import SimpleNamespace
+from unittest import TestCase
+
+from sniffles.parallel import CallTask, CombineTask
+from sniffles.sharding import plan_shards, window_weights, BAI_WINDOW_SIZE
+
+
+class TestSharding(TestCase):
+    """
+    Tests for planning of intra-contig tasks
+    """
+
+    def test_equal_length(self):
+        shards = plan_shards(1_000_000, 4, align=100_000)
+        self.assertEqual(0, shards[0][0])
+        self.assertEqual(1_000_000, shards[-1][1])
+        self.assertEqual(4, len(shards))
+        for (_, end), (start, _) in zip(shards, shards[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(0, start % 100_000)
+
+    def test_weighted(self):
+        # All reads in the second half of the contig
+        weights = [0] * 32 + [10] * 32
+        shards = plan_shards(64 * BAI_WINDOW_SIZE, 2, weights)
+        self.assertEqual([(0, 48 * BAI_WINDOW_SIZE), (48 * BAI_WINDOW_SIZE, 64 * BAI_WINDOW_SIZE)], shards)
+
+    def test_contig_covered(self):
+        config = SimpleNamespace(snf_block_size=100_000, snf_input_info=[])
+        for contig_length in (1, 99_999, 100_000, 100_001, 1_234_567, 2_000_000):
+            for shard_count in (1, 2, 3, 7):
+                shards = plan_shards(contig_length, shard_count, align=100_000)
+                self.assertEqual(0, shards[0][0])
+                self.assertEqual(contig_length, shards[-1][1])
+                for (_, end), (start, _) in zip(shards, shards[1:]):
+                    self.assertEqual(end, start)
+
+                # Calls at the last base are owned by the last task, and combined in its last block
+                tasks = [CallTask(id=i, contig='chr1', start=start, end=end, sv_id=0, config=config, overlap=1000)
+                         for i, (start, end) in enumerate(shards)]
+                for pos in (0, contig_length - 1):
+                    self.assertEqual(1, sum(task.owns(pos) for task in tasks))
+                combine_task = CombineTask(id=0, contig='chr1', start=0, end=contig_length, sv_id=0, config=config)
+                self.assertEqual(list(range(0, contig_length, 100_000)), combine_task.block_indices)
+
+    def test_small_contig(self):
+        self.assertEqual([(0, 50_000)], plan_shards(50_000, 8, align=100_000))
+
+    def test_window_weights(self):
+        self.assertEqual([100, 0, 50, 50], window_weights([1000, 1100, 0, 1150]))
+
+
+class TestTaskSplit(TestCase):
+    """
+    Tests for splitting straggler tasks
+    """
+    config = SimpleNamespace(task_overlap=50_000, snf_block_size=100_000)
+
+    def get_task(self, start: int, end: int, overlap: int = 0) -> CallTask:
+        return CallTask(id=3, contig='chr1', start=start, end=end, sv_id=0, config=self.config, overlap=overlap)
+
+    def assert_covered(self, task: CallTask, subtasks: list[CallTask]):
+        self.assertEqual(task.start, subtasks[0].start)
+        self.assertEqual(task.end, subtasks[-1].end)
+        for previous, subtask in zip(subtasks, subtasks[1:]):
+            self.assertEqual(previous.end, subtask.start)
+            self.assertLess(subtask.start, subtask.end)
+
+    def test_split(self):
+        task = self.get_task(123_456, 4_000_000)
+        subtasks = task.split(4, 10)
+        self.assertEqual(4, len(subtasks))
+        self.assert_covered(task, subtasks)
+        self.assertEqual([10, 11, 12, 13], [subtask.id for subtask in subtasks])
+        self.assertEqual([(3, i) for i in range(4)], [subtask.order for subtask in subtasks])
+        self.assertTrue(all(subtask.overlap == self.config.task_overlap for subtask in subtasks))
+
+        # Split again
+        subsubtasks = subtasks[1].split(2, 14)
+        self.assert_covered(subtasks[1], subsubtasks)
+        self.assertEqual([(3, 1, 0), (3, 1, 1)], [subtask.order for subtask in subsubtasks])
+
+        # Too small to be split
+        task = self.get_task(0, 150_000)
+        self.assertEqual([task], task.split(4, 10))
+
+    def test_owns(self):
+        task = self.get_task(123_456, 4_000_000)
+        subtasks = task.split(4, 10)
+        self.assertTrue(all(task.owns(pos) for pos in (0, task.start, task.end, 10_000_000)))
+
+        positions = set(range(task.start, task.start + 1000)) | set(range(task.end - 1000, task.end))
+        for subtask in subtasks:
+            positions |= set(range(subtask.start - 2 * subtask.overlap, subtask.start + 2 * subtask.overlap, 7))
+            positions |= {subtask.start - 1, subtask.start, subtask.end - 1, subtask.end}
+        for pos in positions:
+            owners = [subtask for subtask in subtasks if subtask.owns(pos)]
+            if task.start <= pos < task.end:
+                self.assertEqual(1, len(owners), pos)
+                # Owner reads the position, including its overlap with neighbouring tasks
+                self.assertTrue(owners[0].start - owners[0].overlap <= pos < owners[0].end + owners[0].overlap)
+            else:
+                # Positions outside the split task belong to its neighbours
+                self.assertEqual([], owners, pos)
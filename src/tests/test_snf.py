@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+
+from sniffles import snf
+from sniffles.sv import SVCall
+
+
+class TestSNFQuery(TestCase):
+    """
+    Tests for querying regions of .snf files
+    """
+
+    @staticmethod
+    def get_candidate(svtype: str, pos: int) -> SVCall:
+        return SVCall(contig='chr1', pos=pos, id=f'{svtype}.{pos}', ref='N', alt=f'<{svtype}>', qual=60, filter='PASS', info={},
+                      svtype=svtype, svlen=-100 if svtype == 'DEL' else 100, end=pos + 100, genotypes={0: (0, 1, 30, 10, 5, (None, None))},
+                      precise=True, support=5, rnames=None, qc=True, nm=-1, postprocess=None, fwd=2, rev=3)
+
+    @classmethod
+    def write_snf(cls, filename: str, positions: list[int]):
+        config = SimpleNamespace(snf_block_size=1000, output_rnames=False, combine_close_handles=False)
+        part = filename + '.part'
+        with open(part, 'wb') as handle:
+            snf_out = snf.SNFile(config, handle)
+            for pos in positions:
+                snf_out.store(cls.get_candidate('DEL' if pos % 2 else 'INS', pos))
+            snf_out.write_and_index()
+        header = {'config': {'snf_block_size': 1000, 'sample_id': None}, 'snf_candidate_count': len(positions),
+                  'index': {'chr1': {str(block): [index] for block, index in snf_out.get_index().items()}}}
+        with open(filename, 'wb') as handle:
+            handle.write((json.dumps(header) + '\n').encode())
+            with open(part, 'rb') as part_handle:
+                handle.write(part_handle.read())
+        os.remove(part)
+
+    def test_query(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filenames = [os.path.join(directory, 'a.snf'), os.path.join(directory, 'b.snf')]
+            self.write_snf(filenames[0], [5300, 100, 2999, 3000, 1500, 1001, 7000])
+            self.write_snf(filenames[1], [1000, 2500, 3001, 9999])
+
+            results = list(snf.query(filenames, 'chr1', 999, 3000))
+            self.assertEqual([(1000, 'b'), (1001, 'a'), (1500, 'a'), (2500, 'b'), (2999, 'a'), (3000, 'a')],
+                             [(cand.pos, snf_file.sample_id) for snf_file, cand in results])
+
+            results = list(snf.query(filenames, 'chr1', 0, 10 ** 6, svtypes=['DEL']))
+            self.assertEqual([1001, 2999, 3001, 9999], [cand.pos for _, cand in results])
+            self.assertEqual((filenames[0], 'a', 'chr1', 1001, 'DEL.1001', 'DEL', -100, 1101, 60, 'PASS', True, True, 5, '0/1', 10, 5, 1),
+                             snf.query_row(*results[0]))
+
+            self.assertEqual([], list(snf.query(filenames, 'chr2', 0, 10 ** 6)))
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+from types import SimpleNamespace
+from unittest import TestCase
+
+from sniffles.leadprov import Lead
+from sniffles.spill import LeadSpill, decode_leads, encode_lead
+from sniffles.sv import SVCallBNDInfo
+
+
+class TestSpill(TestCase):
+    """
+    Tests for disk-backed lead storage (--low-memory)
+    """
+
+    def test_roundtrip(self):
+        ins = Lead(1001, 'read1', 'chr1', 5000, 5000, 200, 500, '+', 60, -1, 'INLINE', 'INS', 300, 'ACGT' * 75)
+        long_ins = Lead((1002, '1', '4711'), 'read2', 'chr1', 5100, 5100, 0, 3000, '-', 20, 0.25, 'INLINE', 'INS', None, None)
+        bnd = Lead(1003, 'read3', 'chr1', 7000, 7000, 10, 900, '-', 60, -1, 'SPLIT_SUP', 'BND', 1000, None)
+        bnd.bnd_info = SVCallBNDInfo(mate_contig='chr5', mate_ref_start=123456, is_first=True, is_reverse=False)
+
+        data = b''.join(encode_lead(ld) for ld in (ins, long_ins))
+        self.assertEqual([ins, long_ins], list(decode_leads(data, 'INS')))
+
+        decoded, = decode_leads(encode_lead(bnd), 'BND')
+        self.assertEqual(bnd, decoded)
+        self.assertEqual(bnd.bnd_info, decoded.bnd_info)
+
+    def test_ranges(self):
+        config = SimpleNamespace(snf_block_size=10000, cluster_binsize=100, consensus_max_reads_bin=2)
+        spill = LeadSpill(config)
+        try:
+            for i, pos in enumerate([25010, 25020, 25030, 3000]):
+                spill.record(Lead(i, f'read{i}', 'chr1', pos, pos, 0, 100, '+', 60, -1, 'INLINE', 'INS', 100, 'A' * 100), pos // 100 * 100)
+            ranges = list(spill.iter_ranges())
+        finally:
+            spill.close()
+
+        self.assertEqual([10000, 30000], [range_end for range_end, _ in ranges])
+        leads = ranges[1][1]['INS'][25000]
+        self.assertEqual([0, 1, 2], [ld.read_id for ld in leads])
+        self.assertEqual([True, True, False], [ld.seq is not None for ld in leads])
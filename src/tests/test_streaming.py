@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+#
+# Sniffles2
+# A fast structural variant caller for long-read sequencing data
+#
+# Created:     18.10.2026
+# Author:      Hermann Romanek
+# Maintainer:  Hermann Romanek
+# Contact:     sniffles@romanek.at
+#
+import os
+import random
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+
+import pysam
+
+from sniffles import postprocessing
+from sniffles.cluster import Cluster, closed_cluster_count
+from sniffles.config import SnifflesConfig
+from sniffles.parallel import CallTask
+from sniffles.streaming import CoverageCursor
+
+
+def write_bam(filename: str, contig_length: int, svs: list[tuple[int, str, int, float]], seed: int = 0):
+    """
+    Write an indexed .bam file of simulated reads for contig chr1, where each read spanning an SV of svs (position,
+    type, length, fraction of reads supporting the SV) supports it with the given probability. The reference sequence
+    is the same for all seeds. NM tags count (not simulated) mismatches in addition to indels, many for every fifth read.
+    """
+    reference = ''.join(random.Random(0).choice('ACGT') for _ in range(contig_length))
+    rng = random.Random(seed)
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'}, 'SQ': [{'SN': 'chr1', 'LN': contig_length}]}
+    with pysam.AlignmentFile(filename, 'wb', header=header) as handle:
+        for n, start in enumerate(range(0, contig_length - 6000, 100)):
+            end = start + rng.randint(3000, 6000)
+            cigar, sequence, pos = [], '', start
+            for sv_pos, svtype, svlen, fraction in svs:
+                if start + 200 < sv_pos < end - 200 - svlen and rng.random() < fraction:
+                    sequence += reference[pos:sv_pos]
+                    cigar.append((0, sv_pos - pos))
+                    if svtype == 'DEL':
+                        cigar.append((2, svlen))
+                        pos = sv_pos + svlen
+                    else:
+                        sequence += ''.join(rng.choice('ACGT') for _ in range(svlen))
+                        cigar.append((1, svlen))
+                        pos = sv_pos
+            sequence += reference[pos:end]
+            cigar.append((0, end - pos))
+
+            read = pysam.AlignedSegment()
+            read.query_name = f'read{n}'
+            read.query_sequence = sequence
+            read.flag = 16 if rng.random() < 0.5 else 0
+            read.reference_id = 0
+            read.reference_start = start
+            read.mapping_quality = 60
+            read.cigartuples = cigar
+            read.query_qualities = pysam.qualitystring_to_array('I' * len(sequence))
+            read.set_tag('NM', sum(length for op, length in cigar if op in (1, 2)) + (60 if n % 5 == 0 else 2))
+            handle.write(read)
+    pysam.index(filename)
+
+
+class TestStreaming(TestCase):
+    """
+    Tests for streaming SV calling
+    """
+
+    config = SimpleNamespace(coverage_binsize=100, cluster_repeat_h_max=1000, cluster_merge_bnd=1000, cluster_r=2.5)
+
+    @staticmethod
+    def get_cluster(start: int, end: int, stdev_start: float) -> Cluster:
+        cluster = Cluster(id='CL', svtype='DEL', contig='chr1', start=start, end=end, seed=start, leads=[], repeat=False, leads_long=None)
+        cluster.stdev_start = stdev_start
+        return cluster
+
+    def test_closed_cluster_count(self):
+        clusters = [self.get_cluster(1000, 1100, 10), self.get_cluster(1500, 1600, 10), self.get_cluster(5000, 5100, 10)]
+        self.assertEqual(2, closed_cluster_count('DEL', clusters, 5500, self.config))
+        self.assertEqual(3, closed_cluster_count('DEL', clusters, 6200, self.config))
+
+        # Wide clusters may still be merged with clusters further away
+        clusters[1].stdev_start = 2000
+        self.assertEqual(0, closed_cluster_count('DEL', clusters, 5500, self.config))
+
+    def test_coverage_cursor(self):
+        rng = random.Random(0)
+        lead_provider = SimpleNamespace(covrtab_fwd={}, covrtab_rev={}, covrtab_min_bin=10000, end=60000)
+        for bin_index in range(10000, 60100, 100):
+            if rng.random() < 0.5:
+                lead_provider.covrtab_fwd[bin_index] = rng.randint(-3, 3)
+            if rng.random() < 0.5:
+                lead_provider.covrtab_rev[bin_index] = rng.randint(-3, 3)
+
+        def requests(calls):
+            return {bin_index: [(call, 'coverage_center')] for bin_index, call in calls.items()}
+
+        expected = {bin_index: SimpleNamespace(coverage_center=None) for bin_index in range(0, 70000, 700)}
+        postprocessing.coverage_fulfill(requests(expected), lead_provider, self.config)
+
+        cursor = CoverageCursor(lead_provider, self.config, checkpoint_bins=7)
+        actual = {bin_index: SimpleNamespace(coverage_center=None) for bin_index in expected}
+        cursor.advance(35000)
+        cursor.fulfill(requests({b: c for b, c in actual.items() if b < 35000}))
+        cursor.advance(70000)
+        cursor.fulfill(requests({b: c for b, c in actual.items() if b >= 35000}))
+
+        self.assertEqual([c.coverage_center for c in expected.values()], [c.coverage_center for c in actual.values()])
+
+
+class TestStreamingCalls(TestCase):
+    """
+    End-to-end comparison of streaming and low-memory calling with in-memory calling
+    """
+    CONTIG_LENGTH = 60000
+    # position, type, length, fraction of reads supporting the SV
+    SVS = [(8000, 'DEL', 400, 0.6), (16000, 'INS', 300, 0.5), (24000, 'DEL', 1500, 0.15), (33000, 'INS', 500, 0.6),
+           (41000, 'DEL', 600, 0.1), (47000, 'DEL', 300, 0.5), (52000, 'INS', 200, 0.12)]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.bam = os.path.join(cls.directory.name, 'input.bam')
+        write_bam(cls.bam, cls.CONTIG_LENGTH, cls.SVS)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def call(self, *args) -> list:
+        config = SnifflesConfig('--input', self.bam, '--vcf', os.path.join(self.directory.name, 'out.vcf'),
+                                '--snf', os.path.join(self.directory.name, 'out.snf'), '--minsupport', '12', *args)
+        # Set up by the main script
+        config.input, config.input_mode, config.input_is_cram, config.mode = self.bam, 'rb', False, 'call_sample'
+        config.sample_ids_vcf, config.contig_lengths = [(0, 'SAMPLE')], [('chr1', self.CONTIG_LENGTH)]
+        config.task_read_id_offset_mult, config.io_threads = 10 ** 4, 0
+        task = CallTask(id=0, contig='chr1', start=0, end=self.CONTIG_LENGTH, sv_id=0, config=config)
+        result = task.execute()
+        os.remove(result.snf_filename)
+        return [(svcall.pos, svcall.svtype, svcall.svlen, svcall.qc) for svcall in result.svcalls]
+
+    def test_calls(self):
+        expected = self.call()
+        self.assertEqual(sorted(expected), expected)
+        self.assertTrue(all(qc for *_, qc in expected))
+        self.assertGreater(len(expected), 3)
+
+        for window in ('20000', '2000'):
+            with self.subTest(window=window):
+                self.assertEqual(expected, self.call('--stream-window', window))
+
+    def test_low_memory(self):
+        self.assertEqual(self.call(), self.call('--low-memory'))
+        # Including NM based QC, which needs the average NM of all reads of the task
+        self.assertEqual(self.call('--mosaic'), self.call('--mosaic', '--low-memory'))
@@ -13,7 +13,7 @@ from unittest import TestCase
 from unittest.mock import Mock
 
 from sniffles.sv import SVCall
-from sniffles.vcf import VCF
+from sniffles.vcf import VCF, CachedReference
 
 
 class TestVCFFormat(TestCase):
@@ -175,3 +175,22 @@ class TestVCFFormat(TestCase):
         ))
 
         vcf.write_raw.assert_called()
+
+
+class TestCachedReference(TestCase):
+    """
+    Unittests for windowed reference access
+    """
+
+    def test_fetch(self):
+        sequences = {'chr1': 'ACGTTGCA' * 10, 'chr2': 'GATTACA'}
+        handle = Mock()
+        handle.fetch.side_effect = lambda contig, start, end: sequences[contig][start:end]
+        reference = CachedReference(handle, 16)
+
+        requests = [('chr1', 3, 10), ('chr1', 5, 6), ('chr1', 12, 19), ('chr1', 18, 30), ('chr1', 75, 90), ('chr1', 79, 80),
+                    ('chr2', 2, 3), ('chr2', 6, 12), ('chr1', 0, 40)]
+        self.assertEqual([sequences[contig][start:end] for contig, start, end in requests],
+                         [reference.fetch(contig, start, end) for contig, start, end in requests])
+        self.assertEqual([('chr1', 3, 19), ('chr1', 18, 34), ('chr1', 75, 91), ('chr2', 2, 18), ('chr1', 0, 40)],
+                         [call.args for call in handle.fetch.call_args_list])